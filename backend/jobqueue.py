@@ -0,0 +1,310 @@
+import time
+import uuid
+import heapq
+import queue
+import threading
+from collections import deque
+
+# ---------------------------------------------------------------- #
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+FINAL_STATES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+THROUGHPUT_WINDOW = 300.0  # seconds
+
+# finished jobs are kept for lookups until they are this old, or until there
+# are more than this many of them
+FINISHED_JOB_TTL = 3600.0  # seconds
+MAX_FINISHED_JOBS = 1000
+
+
+class QueueFullError(Exception):
+    """
+    Raised when a job is submitted while the queue is at capacity.
+    """
+
+
+class Job:
+    """
+    A single render job and the history of its progress events.
+    """
+
+    def __init__(self, request: dict, priority: int = 0):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.request = request
+        self.priority = priority
+        self.status = JOB_QUEUED
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+        self.events = []
+        self._subscribers = []
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "priority": self.priority,
+            "progress": self.progress,
+            "request": self.request,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+# ---------------------------------------------------------------- #
+
+
+class JobQueue:
+    """
+    Bounded priority queue of render jobs with event fan-out and metrics.
+
+    Higher priority jobs are dispatched first, jobs with equal priority in
+    submission order. Once max_size jobs are waiting, submit() raises
+    QueueFullError so callers can back off.
+
+    Finished jobs are forgotten once they are older than finished_ttl seconds
+    or when more than max_finished of them are kept, oldest first.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 32,
+        finished_ttl: float = FINISHED_JOB_TTL,
+        max_finished: int = MAX_FINISHED_JOBS,
+    ):
+        self.max_size = max_size
+        self.finished_ttl = finished_ttl
+        self.max_finished = max_finished
+
+        self._lock = threading.Condition()
+        self._heap = []
+        self._counter = 0
+        self._jobs = {}
+
+        self._finished = deque()
+
+        self._rejected = 0
+        self._finished_times = deque()
+        self._wait_times = deque(maxlen=100)
+        self._run_times = deque(maxlen=100)
+
+    # ---------------------------------------------------- #
+    # queue operations
+
+    def submit(self, request: dict, priority: int = 0) -> Job:
+        """
+        Add a job to the queue.
+
+        :param request: Job request (post_id or text, voice, settings).
+        :param priority: Higher runs first.
+        :return: The queued job.
+        """
+        with self._lock:
+            if len(self._heap) >= self.max_size:
+                self._rejected += 1
+                raise QueueFullError(
+                    f"Job queue is full ({self.max_size} jobs waiting)."
+                )
+
+            job = Job(request, priority)
+            self._jobs[job.job_id] = job
+            heapq.heappush(self._heap, (-priority, self._counter, job.job_id))
+            self._counter += 1
+            self._lock.notify()
+
+        self.publish(job.job_id, "queued", {"position": self.position(job.job_id)})
+        return job
+
+    def pop(self, timeout: float = None) -> Job:
+        """
+        Take the highest priority job off the queue, waiting if it is empty.
+
+        :param timeout: Seconds to wait, None waits forever.
+        :return: The job, or None on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            while True:
+                while self._heap:
+                    _, _, job_id = heapq.heappop(self._heap)
+                    job = self._jobs[job_id]
+                    if job.status != JOB_QUEUED:
+                        # cancelled while waiting
+                        continue
+                    job.status = JOB_RUNNING
+                    job.started_at = time.time()
+                    self._wait_times.append(job.started_at - job.created_at)
+                    return job
+
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._lock.wait(remaining)
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job that has not started yet.
+
+        :return: True if the job was cancelled.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != JOB_QUEUED:
+                return False
+            self._heap = [entry for entry in self._heap if entry[2] != job_id]
+            heapq.heapify(self._heap)
+        self.finish(job_id, JOB_CANCELLED)
+        return True
+
+    def finish(self, job_id: str, status: str, result: dict = None, error=None):
+        """
+        Mark a job as finished and notify its subscribers.
+        """
+        with self._lock:
+            job = self._jobs[job_id]
+            job.status = status
+            job.result = result
+            job.error = error
+            job.finished_at = time.time()
+            self._finished.append(job_id)
+            if status == JOB_COMPLETED:
+                job.progress = 1.0
+                self._finished_times.append(job.finished_at)
+                self._run_times.append(job.finished_at - job.started_at)
+
+        self.publish(job_id, status, {"result": result, "error": error})
+        with self._lock:
+            self._evict_finished()
+
+    def _evict_finished(self):
+        """
+        Drop finished jobs past the TTL or beyond max_finished, oldest first.
+        Must be called with the lock held.
+        """
+        now = time.time()
+        while self._finished and (
+            len(self._finished) > self.max_finished
+            or now - self._jobs[self._finished[0]].finished_at > self.finished_ttl
+        ):
+            self._jobs.pop(self._finished.popleft(), None)
+
+    # ---------------------------------------------------- #
+    # lookups
+
+    def get(self, job_id: str) -> Job:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> list:
+        with self._lock:
+            self._evict_finished()
+            return sorted(self._jobs.values(), key=lambda job: job.created_at)
+
+    def position(self, job_id: str) -> int:
+        """
+        Number of jobs that will be dispatched before this one.
+        """
+        with self._lock:
+            ordered = sorted(self._heap)
+            for i, (_, _, queued_id) in enumerate(ordered):
+                if queued_id == job_id:
+                    return i
+        return -1
+
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._heap)
+
+    # ---------------------------------------------------- #
+    # progress events
+
+    def publish(self, job_id: str, event: str, data: dict = None):
+        """
+        Record a progress event for a job and push it to every subscriber.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                # finished and already evicted, e.g. a late event of a dead worker
+                return
+            if data and "progress" in data:
+                job.progress = data["progress"]
+            payload = {
+                "job_id": job_id,
+                "event": event,
+                "status": job.status,
+                "progress": job.progress,
+                "time": time.time(),
+                **(data or {}),
+            }
+            job.events.append(payload)
+            subscribers = list(job._subscribers)
+
+        for subscriber in subscribers:
+            subscriber.put(payload)
+
+    def subscribe(self, job_id: str) -> queue.Queue:
+        """
+        Subscribe to a job's events. The returned queue first receives the
+        events that already happened, then every new one.
+        """
+        subscriber = queue.Queue()
+        with self._lock:
+            job = self._jobs[job_id]
+            for payload in job.events:
+                subscriber.put(payload)
+            job._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, job_id: str, subscriber: queue.Queue):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and subscriber in job._subscribers:
+                job._subscribers.remove(subscriber)
+
+    # ---------------------------------------------------- #
+    # metrics
+
+    def metrics(self) -> dict:
+        """
+        Queue depth, job counts, throughput and latency figures.
+        """
+        now = time.time()
+        with self._lock:
+            while self._finished_times and (
+                now - self._finished_times[0] > THROUGHPUT_WINDOW
+            ):
+                self._finished_times.popleft()
+
+            counts = {state: 0 for state in (JOB_QUEUED, JOB_RUNNING) + FINAL_STATES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+
+            return {
+                "queue_depth": len(self._heap),
+                "queue_capacity": self.max_size,
+                "jobs": counts,
+                "rejected": self._rejected,
+                "throughput_per_minute": len(self._finished_times)
+                * 60.0
+                / THROUGHPUT_WINDOW,
+                "avg_wait_seconds": _average(self._wait_times),
+                "avg_run_seconds": _average(self._run_times),
+            }
+
+
+def _average(values) -> float:
+    return sum(values) / len(values) if values else 0.0
@@ -0,0 +1,74 @@
+import os
+import argparse
+
+from jobqueue import JobQueue
+from workers import WorkerPool
+from server import create_server
+
+# ---------------------------------------------------------------- #
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Local render job service for the automated video editor."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("VIDEO_EDITOR_WORKERS", 1)),
+        help="Number of warm generator worker processes.",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=32,
+        help="Maximum number of waiting jobs before submissions are rejected.",
+    )
+    parser.add_argument(
+        "--device",
+        default=os.getenv("KOKORO_DEVICE"),
+        help="Torch device for Kokoro (mps, cuda, cpu). Detected if not set.",
+    )
+    parser.add_argument(
+        "--preload-languages",
+        default="b",
+        help="Comma separated Kokoro language codes every worker loads on start.",
+    )
+    parser.add_argument(
+        "--tts-service",
+        default=os.getenv("TTS_SERVICE"),
+        help="host:port of a shared TTS service (started if not running). "
+        "Workers then synthesize there instead of loading Kokoro themselves.",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    tts_service = None
+    if args.tts_service:
+        host, _, port = args.tts_service.rpartition(":")
+        tts_service = (host or "127.0.0.1", int(port))
+
+    job_queue = JobQueue(max_size=args.queue_size)
+    worker_pool = WorkerPool(
+        job_queue,
+        num_workers=args.workers,
+        device=args.device,
+        preload_languages=[c for c in args.preload_languages.split(",") if c],
+        tts_service=tts_service,
+    )
+    worker_pool.start()
+
+    server = create_server(args.host, args.port, job_queue, worker_pool)
+    print(f"Job service listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    finally:
+        server.server_close()
+        worker_pool.stop()
@@ -0,0 +1,313 @@
+import os
+import re
+import json
+import queue
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from jobqueue import JobQueue, QueueFullError, FINAL_STATES
+
+# ---------------------------------------------------------------- #
+
+# mirrors BrainrotClipGenerator.KOKORO_LANGUAGES / KOKORO_VOICES, the server
+# process never imports the generator so it stays free of torch and kokoro
+KOKORO_LANGUAGES = ("american", "british", "french", "japanese")
+LANGUAGES_WITH_DEFAULT_VOICE = ("american", "british")
+
+EVENT_KEEPALIVE_SECONDS = 15.0
+QUEUE_FULL_RETRY_SECONDS = 30
+
+# mirrors SOURCE_BACKGROUND_FOLDER, a job may only pick clips from it
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKGROUND_FOLDER = os.path.join(ROOT_DIR, "assets", "backgrounds")
+
+# settings a job may pass to the encoder; output files and raw ffmpeg
+# arguments are never taken from a request
+OUTPUT_SPEC_KEYS = ("name", "size", "bitrate", "preset")
+RENDER_OPTION_KEYS = ("preset", "bitrate", "threads")
+TRIM_OPTION_KEYS = ("padding", "gap", "threshold_db")
+X264_PRESETS = (
+    "ultrafast",
+    "superfast",
+    "veryfast",
+    "faster",
+    "fast",
+    "medium",
+    "slow",
+    "slower",
+    "veryslow",
+)
+OUTPUT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+BITRATE_PATTERN = re.compile(r"^[0-9]+(\.[0-9]+)?[kKmM]?$")
+
+
+def validate_job_request(body: dict) -> dict:
+    """
+    Validate a job submission and return the normalized request.
+
+    :param body: Decoded JSON body of POST /jobs.
+    :return: The job request stored with the job.
+    """
+    if not isinstance(body, dict):
+        raise ValueError("Request body must be a JSON object.")
+
+    post_id = body.get("post_id")
+    text = body.get("text")
+    if bool(post_id) == bool(text):
+        raise ValueError("Exactly one of 'post_id' or 'text' is required.")
+
+    language = body.get("language", "british")
+    if language not in KOKORO_LANGUAGES:
+        raise ValueError(
+            f"Unknown language '{language}', expected one of {KOKORO_LANGUAGES}."
+        )
+
+    if not body.get("voice") and language not in LANGUAGES_WITH_DEFAULT_VOICE:
+        raise ValueError(f"'voice' is required for language '{language}'.")
+
+    settings = body.get("settings", {})
+    if not isinstance(settings, dict):
+        raise ValueError("'settings' must be a JSON object.")
+
+    validate_settings(settings)
+
+    priority = body.get("priority", 0)
+    if not isinstance(priority, int):
+        raise ValueError("'priority' must be an integer.")
+
+    return {
+        "post_id": post_id,
+        "text": text,
+        "voice": body.get("voice"),
+        "language": language,
+        "background": resolve_background(body.get("background")),
+        "settings": settings,
+    }
+
+
+def validate_settings(settings: dict):
+    """
+    Check the encoder related job settings against the keys a job may set.
+    """
+    outputs = settings.get("outputs")
+    if outputs is not None:
+        if not isinstance(outputs, list):
+            raise ValueError("'settings.outputs' must be a list.")
+        for spec in outputs:
+            if not isinstance(spec, dict):
+                raise ValueError("Every output spec must be a JSON object.")
+            _check_keys(spec, OUTPUT_SPEC_KEYS, "output spec")
+            if not OUTPUT_NAME_PATTERN.match(str(spec.get("name", ""))):
+                raise ValueError(
+                    "Every output spec needs a 'name' of letters, digits, '-' or '_'."
+                )
+            size = spec.get("size")
+            if size is not None and not (
+                isinstance(size, list)
+                and len(size) == 2
+                and all(isinstance(v, int) and 0 < v <= 4096 for v in size)
+            ):
+                raise ValueError("'size' must be [width, height] in pixels.")
+            _check_encoder_options(spec)
+
+    render_options = settings.get("render_options")
+    if render_options is not None:
+        if not isinstance(render_options, dict):
+            raise ValueError("'settings.render_options' must be a JSON object.")
+        _check_keys(render_options, RENDER_OPTION_KEYS, "render option")
+        _check_encoder_options(render_options)
+        threads = render_options.get("threads")
+        if threads is not None and not (isinstance(threads, int) and threads > 0):
+            raise ValueError("'threads' must be a positive integer.")
+
+    trim_options = settings.get("trim_options")
+    if trim_options is not None:
+        if not isinstance(trim_options, dict):
+            raise ValueError("'settings.trim_options' must be a JSON object.")
+        _check_keys(trim_options, TRIM_OPTION_KEYS, "trim option")
+        if not all(isinstance(v, (int, float)) for v in trim_options.values()):
+            raise ValueError("Trim options must be numbers.")
+
+
+def _check_keys(options: dict, allowed: tuple, kind: str):
+    unknown = sorted(set(options) - set(allowed))
+    if unknown:
+        raise ValueError(f"Unsupported {kind} keys {unknown}, allowed: {allowed}.")
+
+
+def _check_encoder_options(options: dict):
+    preset = options.get("preset")
+    if preset is not None and preset not in X264_PRESETS:
+        raise ValueError(f"Unknown preset '{preset}', expected one of {X264_PRESETS}.")
+    bitrate = options.get("bitrate")
+    if bitrate is not None and not BITRATE_PATTERN.match(str(bitrate)):
+        raise ValueError(f"Invalid bitrate '{bitrate}', e.g. '4M' or '2500k'.")
+
+
+def resolve_background(background) -> str:
+    """
+    Absolute path of a requested background clip, which has to be a file in
+    the background library folder.
+    """
+    if not background:
+        return None
+    if not isinstance(background, str):
+        raise ValueError("'background' must be a file name.")
+    folder = os.path.realpath(BACKGROUND_FOLDER)
+    path = os.path.realpath(os.path.join(folder, background))
+    if os.path.commonpath([folder, path]) != folder or not os.path.isfile(path):
+        raise ValueError(f"Background '{background}' is not a clip in {folder}.")
+    return path
+
+
+# ---------------------------------------------------------------- #
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """
+    REST + server-sent events API of the job service.
+
+        POST   /jobs              submit a job, 202 or 429 when the queue is full
+        GET    /jobs              list all jobs
+        GET    /jobs/<id>         job status
+        DELETE /jobs/<id>         cancel a queued job
+        GET    /jobs/<id>/events  stream progress events (text/event-stream)
+        GET    /metrics           queue depth, throughput and worker metrics
+    """
+
+    job_queue: JobQueue = None
+    worker_pool = None
+    allowed_origin = "http://localhost:3000"
+
+    # ---------------------------------------------------- #
+
+    def do_OPTIONS(self):
+        self.send_response(204)
+        self._send_cors_headers()
+        self.end_headers()
+
+    def do_GET(self):
+        parts = self._path_parts()
+        if parts == ["jobs"]:
+            return self._send_json(
+                200, {"jobs": [job.to_dict() for job in self.job_queue.jobs()]}
+            )
+        if parts == ["metrics"]:
+            metrics = self.job_queue.metrics()
+            if self.worker_pool is not None:
+                metrics.update(self.worker_pool.metrics())
+            return self._send_json(200, metrics)
+        if len(parts) == 2 and parts[0] == "jobs":
+            job = self.job_queue.get(parts[1])
+            if job is None:
+                return self._send_error(404, f"Job not found: {parts[1]}")
+            return self._send_json(200, job.to_dict())
+        if len(parts) == 3 and parts[0] == "jobs" and parts[2] == "events":
+            return self._stream_events(parts[1])
+        self._send_error(404, f"Unknown path: {self.path}")
+
+    def do_POST(self):
+        if self._path_parts() != ["jobs"]:
+            return self._send_error(404, f"Unknown path: {self.path}")
+        # a browser sends other content types cross-origin without a preflight
+        if self.headers.get_content_type() != "application/json":
+            return self._send_error(415, "Content-Type must be application/json.")
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            request = validate_job_request(body)
+        except ValueError as e:
+            return self._send_error(400, str(e))
+
+        try:
+            job = self.job_queue.submit(request, priority=body.get("priority", 0))
+        except QueueFullError as e:
+            return self._send_error(
+                429, str(e), {"Retry-After": str(QUEUE_FULL_RETRY_SECONDS)}
+            )
+        self._send_json(202, job.to_dict())
+
+    def do_DELETE(self):
+        parts = self._path_parts()
+        if len(parts) != 2 or parts[0] != "jobs":
+            return self._send_error(404, f"Unknown path: {self.path}")
+        job = self.job_queue.get(parts[1])
+        if job is None:
+            return self._send_error(404, f"Job not found: {parts[1]}")
+        if not self.job_queue.cancel(parts[1]):
+            return self._send_error(409, "Only queued jobs can be cancelled.")
+        # the finished job may already be evicted from the queue
+        self._send_json(200, job.to_dict())
+
+    # ---------------------------------------------------- #
+
+    def _stream_events(self, job_id: str):
+        job = self.job_queue.get(job_id)
+        if job is None:
+            return self._send_error(404, f"Job not found: {job_id}")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self._send_cors_headers()
+        self.end_headers()
+
+        subscriber = self.job_queue.subscribe(job_id)
+        try:
+            while True:
+                try:
+                    payload = subscriber.get(timeout=EVENT_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+
+                self.wfile.write(
+                    f"event: {payload['event']}\ndata: {json.dumps(payload)}\n\n".encode()
+                )
+                self.wfile.flush()
+                if payload["event"] in FINAL_STATES:
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.job_queue.unsubscribe(job_id, subscriber)
+
+    def _path_parts(self) -> list:
+        return [part for part in urlparse(self.path).path.split("/") if part]
+
+    def _send_cors_headers(self):
+        self.send_header("Access-Control-Allow-Origin", self.allowed_origin)
+        self.send_header("Access-Control-Allow-Methods", "GET, POST, DELETE, OPTIONS")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+
+    def _send_json(self, status: int, data: dict, headers: dict = None):
+        encoded = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self._send_cors_headers()
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def _send_error(self, status: int, message: str, headers: dict = None):
+        self._send_json(status, {"error": message}, headers)
+
+
+def create_server(
+    host: str, port: int, job_queue: JobQueue, worker_pool=None
+) -> ThreadingHTTPServer:
+    """
+    Create the HTTP server for a job queue and (optional) worker pool.
+    """
+    handler = type(
+        "BoundJobRequestHandler",
+        (JobRequestHandler,),
+        {"job_queue": job_queue, "worker_pool": worker_pool},
+    )
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
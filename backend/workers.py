@@ -0,0 +1,477 @@
+import os
+import sys
+import time
+import queue
+import threading
+import traceback
+import multiprocessing
+
+from jobqueue import JobQueue, JOB_COMPLETED, JOB_FAILED
+
+# ---------------------------------------------------------------- #
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = os.path.join(ROOT_DIR, "test")
+
+# a worker that exits before it is ready is restarted after 1s, 2s, 4s, ...
+WORKER_RESPAWN_BACKOFF = 1.0  # seconds
+WORKER_MAX_RESPAWN_DELAY = 60.0  # seconds
+WORKER_MAX_STARTUP_FAILURES = 5
+
+
+def _detect_device() -> str:
+    import torch
+
+    if torch.backends.mps.is_available():
+        return "mps"
+    if torch.cuda.is_available():
+        return "cuda"
+    return "cpu"
+
+
+def worker_main(
+    worker_id: int,
+    task_queue,
+    event_queue,
+    device: str = None,
+    preload_languages: tuple = (),
+    tts_service: tuple = None,
+):
+    """
+    Entry point of a worker process.
+
+    The worker imports torch and kokoro once, loads the kokoro model into a
+    KokoroPool (one model shared by the pipelines of all languages) and
+    preloads the voice packs of preload_languages. With tts_service set to a
+    (host, port) address, it connects to that TTS service instead and never
+    loads torch itself. It then renders jobs from task_queue until it
+    receives None. Everything it reports goes through event_queue as
+    (event, worker_id, job_id, data) tuples.
+
+    The background library (if the folder exists) is scanned on start, so
+    clips added to or removed from the folder since the index was written
+    are picked up before the first job.
+    """
+    os.chdir(ROOT_DIR)
+    if SOURCE_DIR not in sys.path:
+        sys.path.insert(0, SOURCE_DIR)
+
+    from dotenv import load_dotenv
+    from source.ttspool import KokoroPool
+    from source.ttsservice import connect_tts_service
+    from source.generator import BrainrotClipGenerator
+    from source.backgrounds import BackgroundLibrary
+    from source.globals import SOURCE_BACKGROUND_FOLDER, SOURCE_BACKGROUND_INDEX_FILE
+
+    load_dotenv()
+    if tts_service:
+        host, port = tts_service
+        tts_pool = connect_tts_service(host, port, device=device)
+        device = f"tts service {host}:{port}"
+    else:
+        device = device or _detect_device()
+        tts_pool = KokoroPool(device=device)
+
+    for lang_code in preload_languages:
+        tts_pool.preload(
+            [
+                voice
+                for voices in BrainrotClipGenerator.KOKORO_VOICES.values()
+                for voice in voices
+                if voice.startswith(lang_code)
+            ]
+        )
+
+    background_library = None
+    if os.path.isdir(SOURCE_BACKGROUND_FOLDER):
+        background_library = BackgroundLibrary(
+            SOURCE_BACKGROUND_FOLDER, SOURCE_BACKGROUND_INDEX_FILE
+        )
+        background_library.scan()
+    event_queue.put(("ready", worker_id, None, {"device": device}))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        job_id, request = task
+        try:
+            result = run_job(
+                job_id,
+                request,
+                tts_pool,
+                event_queue,
+                worker_id,
+                background_library=background_library,
+            )
+            event_queue.put((JOB_COMPLETED, worker_id, job_id, result))
+        except Exception as e:
+            event_queue.put(
+                (
+                    JOB_FAILED,
+                    worker_id,
+                    job_id,
+                    {"error": str(e), "traceback": traceback.format_exc()},
+                )
+            )
+
+
+def run_job(
+    job_id: str,
+    request: dict,
+    tts_pool,
+    event_queue,
+    worker_id: int,
+    background_library=None,
+) -> dict:
+    """
+    Render a single job inside a worker process using the video pipeline stages.
+
+    :param background_library: The worker's BackgroundLibrary, rescanned for
+        every job (only new or changed clips are analyzed).
+
+    :return: Paths of the produced files and the stages that ran.
+    """
+    from source.generator import BrainrotClipGenerator
+    from source.pipeline import RunManifest
+    from source.stages import build_video_pipeline
+    from source.tuning import EncoderTuner
+    from source.media import MediaStore
+    from source.globals import (
+        SOURCE_BACKGROUND_CLIP,
+        TARGET_JOBS_FOLDER,
+        TARGET_ENCODER_TUNING_FILE,
+        TARGET_MEDIA_FOLDER,
+    )
+
+    settings = request.get("settings", {})
+    language = request.get("language", "british")
+    voice = request.get("voice") or BrainrotClipGenerator.KOKORO_VOICES[language][0]
+
+    job_folder = os.path.join(TARGET_JOBS_FOLDER, job_id)
+    os.makedirs(job_folder, exist_ok=True)
+
+    generator = BrainrotClipGenerator(
+        video_text="",
+        video_file=request.get("background") or SOURCE_BACKGROUND_CLIP,
+        tts_pool=tts_pool,
+        encoder_tuner=(
+            EncoderTuner(TARGET_ENCODER_TUNING_FILE)
+            if settings.get("auto_tune", True)
+            else None
+        ),
+        debug_output=settings.get("debug_output", False),
+        framerate=settings.get("framerate", 30),
+        inter_segment_delay=settings.get("inter_segment_delay", 0.1),
+        low_memory=settings.get("low_memory", False),
+    )
+
+    reddit_scraper = None
+    if request.get("post_id"):
+        from source.redditscraper import RedditScraperBot
+
+        reddit_scraper = RedditScraperBot(
+            client_id=os.getenv("REDDIT_CLIENT_ID"),
+            client_secret=os.getenv("REDDIT_SECRET_KEY"),
+            user_agent=os.getenv("REDDIT_USER_AGENT"),
+        )
+
+    text_cleaner = None
+    if settings.get("clean_text", True):
+        from source.profanityfilter import init_genai, clean_text
+
+        init_genai()
+        text_cleaner = clean_text
+
+    # without an explicit background, jobs draw from the background library
+    # (post videos are downloaded into the media store and added to it)
+    media_store = None
+    if request.get("background"):
+        background_library = None
+    elif background_library is not None:
+        # clips may have been added or deleted while the worker was running
+        background_library.scan()
+        media_store = MediaStore(TARGET_MEDIA_FOLDER)
+
+    run_manifest = RunManifest(os.path.join(job_folder, "run_manifest.json"))
+    output_file = os.path.join(job_folder, "output.mp4")
+    done_stages = []
+
+    def progress_callback(stage_name: str, status: str):
+        if status != "running":
+            done_stages.append(stage_name)
+        event_queue.put(
+            (
+                "progress",
+                worker_id,
+                job_id,
+                {
+                    "stage": stage_name,
+                    "stage_status": status,
+                    "progress": len(done_stages) / len(pipeline.stage_names()),
+                },
+            )
+        )
+
+    pipeline = build_video_pipeline(
+        generator,
+        run_manifest,
+        segments_folder=os.path.join(job_folder, "segments"),
+        concat_file=os.path.join(job_folder, "concatenated_audio.wav"),
+        output_file=output_file,
+        voice=voice,
+        source_text=request.get("text"),
+        reddit_scraper=reddit_scraper,
+        post_id=request.get("post_id"),
+        text_cleaner=text_cleaner,
+        max_words=settings.get("max_words", 10),
+        max_chars=settings.get("max_chars", 1e9),
+        render_options=settings.get("render_options"),
+        progress_callback=progress_callback,
+        background_library=background_library,
+        media_store=media_store,
+        outputs=settings.get("outputs"),
+        trim_silence=settings.get("trim_silence", True),
+        trim_options=settings.get("trim_options"),
+    )
+
+    try:
+        render_result = pipeline.run()
+    finally:
+        generator.cleanup(keep_files=run_manifest.artifacts())
+
+    return {
+        "output_files": render_result["files"],
+        "trim": pipeline.resolve("trim")["report"],
+        "executed": pipeline.executed,
+        "skipped": pipeline.skipped,
+    }
+
+
+# ---------------------------------------------------------------- #
+
+
+class WorkerPool:
+    """
+    Pool of warm worker processes fed from a JobQueue.
+
+    A dispatcher thread hands a job to a worker only once that worker is idle,
+    so jobs wait in the priority queue (not in a FIFO pipe) and are always
+    dispatched in priority order. A collector thread turns worker events into
+    job events and restarts workers that die.
+
+    Every spawned process gets a new worker id, so events of a process that
+    already died are recognized and dropped. Workers that crash before they
+    are ready are restarted with an exponential backoff, and not at all after
+    WORKER_MAX_STARTUP_FAILURES crashes in a row.
+    """
+
+    def __init__(
+        self,
+        job_queue: JobQueue,
+        num_workers: int = 1,
+        device: str = None,
+        preload_languages: tuple = ("b",),
+        tts_service: tuple = None,
+    ):
+        self.job_queue = job_queue
+        self.num_workers = num_workers
+        self.device = device
+        self.preload_languages = tuple(preload_languages)
+        self.tts_service = tts_service
+
+        self._context = multiprocessing.get_context("spawn")
+        self._event_queue = self._context.Queue()
+        self._processes = {}
+        self._task_queues = {}
+        self._ready = set()
+        self._idle = []
+        self._assigned = {}
+        self._next_worker_id = 0
+        self._respawn_at = []
+        self._startup_failures = 0
+        self._lock = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    # ---------------------------------------------------- #
+
+    def start(self):
+        with self._lock:
+            for _ in range(self.num_workers):
+                self._spawn()
+
+        for target in (self._dispatch_loop, self._collect_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        with self._lock:
+            self._lock.notify_all()
+            task_queues = list(self._task_queues.values())
+            processes = list(self._processes.values())
+        for task_queue in task_queues:
+            task_queue.put(None)
+        for process in processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.num_workers,
+                "workers_running": len(self._processes),
+                "workers_idle": len(self._idle),
+                "workers_busy": len(self._assigned),
+            }
+
+    # ---------------------------------------------------- #
+
+    def _spawn(self):
+        """
+        Start a worker process under a new worker id. Must be called with the
+        lock held.
+        """
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+        task_queue = self._context.Queue()
+        process = self._context.Process(
+            target=worker_main,
+            args=(
+                worker_id,
+                task_queue,
+                self._event_queue,
+                self.device,
+                self.preload_languages,
+                self.tts_service,
+            ),
+            daemon=True,
+        )
+        process.start()
+        self._task_queues[worker_id] = task_queue
+        self._processes[worker_id] = process
+
+    def _dispatch_loop(self):
+        while not self._stopping.is_set():
+            with self._lock:
+                while not self._idle and not self._stopping.is_set():
+                    self._lock.wait()
+                if self._stopping.is_set():
+                    return
+
+            job = None
+            while job is None and not self._stopping.is_set():
+                job = self.job_queue.pop(timeout=1.0)
+            if job is None:
+                return
+
+            # the worker that was idle may have died while the job was awaited,
+            # so the worker is chosen and given the job under the lock that
+            # _check_workers() holds while it removes dead workers
+            with self._lock:
+                while not self._idle and not self._stopping.is_set():
+                    self._lock.wait()
+                if self._stopping.is_set():
+                    return
+                worker_id = self._idle.pop(0)
+                self._assigned[worker_id] = job.job_id
+                self.job_queue.publish(
+                    job.job_id, "started", {"worker": worker_id, "progress": 0.0}
+                )
+                self._task_queues[worker_id].put((job.job_id, job.request))
+
+    def _collect_loop(self):
+        while not self._stopping.is_set():
+            # checked on every iteration, a busy event queue must not hide a
+            # crashed worker
+            self._check_workers()
+            try:
+                event, worker_id, job_id, data = self._event_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            with self._lock:
+                if worker_id not in self._processes:
+                    # sent by a process that died since, its job already failed
+                    continue
+                if event == "ready":
+                    self._ready.add(worker_id)
+                    self._startup_failures = 0
+                    if worker_id not in self._assigned:
+                        self._idle.append(worker_id)
+                        self._lock.notify_all()
+                    continue
+                if self._assigned.get(worker_id) != job_id:
+                    continue
+                if event != "progress":
+                    # a finished job, the worker can take the next one
+                    del self._assigned[worker_id]
+                    self._idle.append(worker_id)
+                    self._lock.notify_all()
+
+            if event == "progress":
+                self.job_queue.publish(job_id, "progress", data)
+            elif event == JOB_COMPLETED:
+                self.job_queue.finish(job_id, JOB_COMPLETED, result=data)
+            elif event == JOB_FAILED:
+                self.job_queue.finish(job_id, JOB_FAILED, error=data)
+
+    def _check_workers(self):
+        """
+        Fail the job of any worker process that died and start a replacement,
+        later and later if workers keep dying before they are ready.
+        """
+        if self._stopping.is_set():
+            return
+
+        failed_jobs = []
+        now = time.time()
+        with self._lock:
+            for worker_id, process in list(self._processes.items()):
+                if process.is_alive():
+                    continue
+
+                del self._processes[worker_id]
+                del self._task_queues[worker_id]
+                if worker_id in self._idle:
+                    self._idle.remove(worker_id)
+                job_id = self._assigned.pop(worker_id, None)
+                if job_id is not None:
+                    failed_jobs.append((worker_id, job_id))
+
+                if worker_id in self._ready:
+                    self._ready.discard(worker_id)
+                    self._respawn_at.append(now)
+                    continue
+                self._startup_failures += 1
+                if self._startup_failures > WORKER_MAX_STARTUP_FAILURES:
+                    print(
+                        f"Worker {worker_id} exited during startup "
+                        f"{self._startup_failures} times in a row, not restarting it."
+                    )
+                    continue
+                delay = min(
+                    WORKER_RESPAWN_BACKOFF * 2 ** (self._startup_failures - 1),
+                    WORKER_MAX_RESPAWN_DELAY,
+                )
+                print(
+                    f"Worker {worker_id} exited during startup, restarting in "
+                    f"{delay:.0f}s."
+                )
+                self._respawn_at.append(now + delay)
+
+            due = [at for at in self._respawn_at if at <= now]
+            self._respawn_at = [at for at in self._respawn_at if at > now]
+            for _ in due:
+                self._spawn()
+
+        for worker_id, job_id in failed_jobs:
+            self.job_queue.finish(
+                job_id,
+                JOB_FAILED,
+                error={"error": f"Worker {worker_id} exited unexpectedly."},
+            )
@@ -25,10 +25,8 @@ from moviepy import (
 )
 
 # for text to speech
-from kokoro import KPipeline
 import soundfile as sf
 
-import torch
 import numpy as np
 import warnings
 
@@ -48,21 +46,30 @@ from source.globals import (
     TARGET_OUTPUT_FILE,
     TARGET_SEGMENTS_FOLDER,
     TARGET_SEGMENTS_CONCAT_FILE,
+    TARGET_RUN_MANIFEST_FILE,
+    TARGET_TTS_CACHE_FOLDER,
+    TARGET_PARTS_FOLDER,
+    MAX_PART_DURATION,
+    TARGET_ENCODER_TUNING_FILE,
+    TARGET_MEDIA_FOLDER,
     TARGET_FRAMERATE,
     SOURCE_BACKGROUND_CLIP,
+    SOURCE_BACKGROUND_FOLDER,
+    SOURCE_BACKGROUND_INDEX_FILE,
+    SOCIAL_OUTPUT_VARIANTS,
 )
 from source.generator import BrainrotClipGenerator
 from source.redditscraper import RedditScraperBot
-
-
-# ---------------------------------------------------------------- #
-
-
-print("Using MPS backend for Torch:", torch.backends.mps.is_available())
-assert (
-    torch.backends.mps.is_available()
-), "Torch is not using MPS backend. Please ensure you have the correct setup for MPS."
-
+from source.pipeline import RunManifest
+from source.stages import build_video_pipeline
+from source.backgrounds import BackgroundLibrary
+from source.effects import BOUNCE_POP_EFFECT
+from source.parts import render_parts
+from source.ttscache import TTSCache
+from source.ttspool import KokoroPool
+from source.ttsservice import connect_tts_service
+from source.tuning import EncoderTuner
+from source.media import MediaStore
 
 # ---------------------------------------------------------------------- #
 
@@ -94,7 +101,6 @@ SIMULATION_LANGUAGE = BrainrotClipGenerator.KOKORO_LANGUAGES["british"]
 
 
 if __name__ == "__main__":
-    # exit()
 
     # ---------------------------------------------------------------- #
     # create reddit scraper instance
@@ -104,65 +110,55 @@ if __name__ == "__main__":
         user_agent=os.getenv("REDDIT_USER_AGENT"),
     )
 
-    # grab top 10 posts from the AITAH subreddit
-    top_posts = reddit_scraper.get_top_subreddit_posts(SUBREDDIT_NAME, limit=10)
-    print(f"Fetched {len(top_posts)} posts from {SUBREDDIT_NAME} subreddit.")
-    the_chosen_one = top_posts[0]  # just take the first one for now
-    print(f"Chosen post: {the_chosen_one.title}")
-
-    # exxtract post information
-    post_details = reddit_scraper.extract_post_details(the_chosen_one)
-    print("Post details:", post_details)
-
-    # check if it has an image
-    post_media = reddit_scraper.extract_post_media(the_chosen_one)
-    if post_media:
-        print("Post has media:", post_media)
-    else:
-        print("Post has no media.")
-
-    # extract post content
-    post_content = the_chosen_one.selftext
-    if not post_content:
-        print("Post has no content. Exiting instead.")
-        sys.exit(0)
-    SIMULATION_TEXT = post_content
+    # if you want to manually select input text, set this instead of
+    # fetching the top post of SUBREDDIT_NAME
+    MANUAL_TEXT = None
+    # MANUAL_TEXT = """
+    # This is a test text for the BrainrotClipGenerator.
+    # I just have to say Ethan is kinda dumb.
+    # Andrew is amazing and hot and beautiful!!
+    # I love this man.
+    # """
 
-    # print out final results from this stage
-    print("Final simulation text:\n", SIMULATION_TEXT)
+    # split long posts into several videos
+    SPLIT_INTO_PARTS = True
 
-    exit()
+    # synthesize in the background TTS service (started on first use), which
+    # keeps kokoro warm across runs and out of this process
+    USE_TTS_SERVICE = True
 
     # ---------------------------------------------------------------- #
-    # if you want to manually select input text
 
-    SIMULATION_TEXT = """
-This is a test text for the BrainrotClipGenerator.
-I just have to say Ethan is kinda dumb.
-Andrew is amazing and hot and beautiful!!
-I love this man.
-    """
+    # create kokoro instance, one model shared by every language, with all
+    # voice packs loaded up front
+    if USE_TTS_SERVICE:
+        tts_pool = connect_tts_service(device="mps", debug_output=True)
+    else:
+        # kokoro runs in this process, torch is only needed here
+        import torch
 
-    # ---------------------------------------------------------------- #
+        print("Using MPS backend for Torch:", torch.backends.mps.is_available())
+        assert (
+            torch.backends.mps.is_available()
+        ), "Torch is not using MPS backend. Please ensure you have the correct setup for MPS."
 
-    # create kokoro instance
-    kokoro_pipeline = KPipeline(lang_code=SIMULATION_LANGUAGE, device="mps")
-    SIMULATION_TEXT = clean_text(SIMULATION_TEXT)  # wooooooow
+        tts_pool = KokoroPool(device="mps")
+    tts_pool.preload(BrainrotClipGenerator.KOKORO_VOICES, debug_output=True)
 
     # create an instance of the BrainrotClipGenerator
     video_generator = BrainrotClipGenerator(
-        video_text=SIMULATION_TEXT,
+        video_text="",
         video_file=SOURCE_BACKGROUND_CLIP,
-        kokoro_model=kokoro_pipeline,
+        tts_pool=tts_pool,
         debug_output=True,
         framerate=TARGET_FRAMERATE,
         inter_segment_delay=0.1,
-    )
-
-    # split text into segments
-    video_generator.split_text_into_segments(
-        max_words=10,
-        max_chars=1e9,
+        # synthesized sentences are reused across runs and parts
+        tts_cache=TTSCache(TARGET_TTS_CACHE_FOLDER),
+        # encoder preset benchmarked once for this machine
+        encoder_tuner=EncoderTuner(TARGET_ENCODER_TUNING_FILE, debug_output=True),
+        # create captions only while they are on screen, for very long stories
+        low_memory=False,
     )
 
     # generate audio segments
@@ -177,52 +173,93 @@ I love this man.
         text_settings["height"] = TARGET_VIDEO_HEIGHT * 0.2
         return text_settings
 
-    video_generator.generate_segments(
-        TARGET_SEGMENTS_FOLDER,
-        SIMULATION_VOICE,
-    )
+    # ---------------------------------------------------------------------- #
+    # extract only up until the audio length
+    # and reduce framerate to 24fps
+    moviepy.config.FFMPEG_BINARY = "ffmpeg"
 
     # ---------------------------------------------------------------- #
-    # modify the text clips to add a pop effect
-    # Bouncy pop effect - more playful animation
-    def bounce_pop(t):
-        if t < 0.1:
-            # Quick initial growth
-            return 0.98 + 2 * t  # 0.98 to 1.0 in first 0.1s
-        elif t < 0.3:
-            # Overshoot and bounce
-            return 1.0 + 0.05 * np.sin(3.14 / 0.2 * (t - 0.1))
-        else:
-            # Settle to final size
-            return 1.0
-
-    def modifier_func(segment: dict) -> dict:
-        """
-        Modify the text clip in the segment to apply a bounce pop effect.
-        """
-        segment["text_clip"] = segment["text_clip"].resized(bounce_pop)
-        return segment
-
-    # apply the text effect to all segments
-    video_generator.apply_text_effect(modifier_func)
+    # pick a fresh window from the background library if there is one,
+    # otherwise SOURCE_BACKGROUND_CLIP is used from the start
+    background_library = None
+    media_store = None
+    if os.path.isdir(SOURCE_BACKGROUND_FOLDER):
+        background_library = BackgroundLibrary(
+            SOURCE_BACKGROUND_FOLDER,
+            SOURCE_BACKGROUND_INDEX_FILE,
+            debug_output=True,
+        )
+        background_library.scan()
+        # videos attached to posts are downloaded and added to the library
+        media_store = MediaStore(TARGET_MEDIA_FOLDER, debug_output=True)
 
     # ---------------------------------------------------------------- #
+    # long stories are split into parts of at most MAX_PART_DURATION
+    # seconds, every part is rendered concurrently with its own manifest
+    if SPLIT_INTO_PARTS:
+        parts = render_parts(
+            video_generator,
+            TARGET_PARTS_FOLDER,
+            output_file=TARGET_OUTPUT_FILE,
+            voice=SIMULATION_VOICE,
+            max_duration=MAX_PART_DURATION,
+            source_text=MANUAL_TEXT,
+            reddit_scraper=reddit_scraper,
+            subreddit_name=SUBREDDIT_NAME,
+            text_cleaner=clean_text,
+            max_words=10,
+            max_chars=1e9,
+            text_effect=BOUNCE_POP_EFFECT,
+            background_library=background_library,
+            media_store=media_store,
+            outputs=SOCIAL_OUTPUT_VARIANTS,
+            # parts whose text was edited re-encode only the changed GOPs
+            partial_rerender=True,
+        )
+        for part in parts:
+            print(f"Part {part['index']} ({part['duration']:.1f}s): {part['files']}")
+        sys.exit(0)
 
-    # concatenate all the audio segment files into a single file
-    video_generator.concat_audio_segment_files(
-        TARGET_SEGMENTS_CONCAT_FILE,  # audio_segments=audio_segments
+    # ---------------------------------------------------------------- #
+    # every stage is recorded in the run manifest, rerunning this script
+    # skips all stages whose inputs did not change (e.g. after a crash
+    # during render, only the render is repeated)
+    run_manifest = RunManifest(TARGET_RUN_MANIFEST_FILE)
+    pipeline = build_video_pipeline(
+        video_generator,
+        run_manifest,
+        segments_folder=TARGET_SEGMENTS_FOLDER,
+        concat_file=TARGET_SEGMENTS_CONCAT_FILE,
+        output_file=TARGET_OUTPUT_FILE,
+        voice=SIMULATION_VOICE,
+        source_text=MANUAL_TEXT,
+        reddit_scraper=reddit_scraper,
+        subreddit_name=SUBREDDIT_NAME,
+        text_cleaner=clean_text,  # wooooooow
+        max_words=10,
+        max_chars=1e9,
+        # bouncy pop effect, precomputed once per caption instead of
+        # resizing the caption on every frame
+        text_effect=BOUNCE_POP_EFFECT,
+        background_library=background_library,
+        media_store=media_store,
+        # composite once, encode 9:16, 1:1 and a preview from the same frames
+        outputs=SOCIAL_OUTPUT_VARIANTS,
+        # cut kokoro's leading / trailing silence, keep 50ms around the speech
+        trim_options={"padding": 0.05},
+        # after editing a caption, rerunning re-synthesizes only the changed
+        # segments and re-encodes only the GOPs they appear in
+        partial_rerender=True,
     )
 
-    # ---------------------------------------------------------------------- #
-    # extract only up until the audio length
-    # and reduce framerate to 24fps
-    moviepy.config.FFMPEG_BINARY = "ffmpeg"
-    moviepy.config.IMAGEMAGICK_BINARY = "magick"
-
-    # setup editor
-    video_generator.setup()
-    video_generator.composite_clips()
-
-    # render the final video
-    video_generator.render(TARGET_OUTPUT_FILE)
-    video_generator.cleanup()
+    try:
+        pipeline.run()
+        trim_report = pipeline.resolve("trim")["report"]
+        if trim_report:
+            print(
+                f"Silence trimming saved {trim_report['seconds_saved']:.2f}s "
+                f"({trim_report['frames_saved']} frames)"
+            )
+    finally:
+        print(f"Stages run: {pipeline.executed}, skipped: {pipeline.skipped}")
+        video_generator.cleanup(keep_files=run_manifest.artifacts())
@@ -0,0 +1,429 @@
+import os
+import json
+import time
+import fcntl
+import random
+import threading
+import subprocess
+from contextlib import contextmanager
+
+import numpy as np
+
+# ---------------------------------------------------------------- #
+
+FFMPEG_BINARY = "ffmpeg"
+FFPROBE_BINARY = "ffprobe"
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".webm", ".m4v")
+INDEX_VERSION = 1
+
+
+def probe_video(video_file: str) -> dict:
+    """
+    Read duration, dimensions, frame rate and keyframe timestamps of a video.
+
+    Only keyframes are decoded (-skip_frame nokey), so this is fast even for
+    long clips.
+
+    :param video_file: Path to the video file.
+    :return: Dictionary with duration, width, height, fps and keyframes.
+    """
+    output = subprocess.run(
+        [
+            FFPROBE_BINARY,
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "stream=width,height,avg_frame_rate:format=duration",
+            "-of",
+            "json",
+            video_file,
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    info = json.loads(output)
+    stream = info["streams"][0]
+    numerator, denominator = stream["avg_frame_rate"].split("/")
+
+    keyframes = subprocess.run(
+        [
+            FFPROBE_BINARY,
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-skip_frame",
+            "nokey",
+            "-show_entries",
+            "frame=pts_time",
+            "-of",
+            "csv=p=0",
+            video_file,
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+
+    return {
+        "duration": float(info["format"]["duration"]),
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "fps": float(numerator) / float(denominator or 1),
+        "keyframes": [
+            float(line) for line in keyframes.split() if line and line != "N/A"
+        ],
+    }
+
+
+def read_analysis_frames(
+    video_file: str, analysis_fps: float, analysis_size: tuple
+) -> np.ndarray:
+    """
+    Decode a video as tiny grayscale frames for scene analysis.
+
+    ffmpeg drops frames to analysis_fps and scales them down before they reach
+    Python, so a whole clip fits in a few MB.
+
+    :return: Array of shape (frames, height, width), dtype uint8.
+    """
+    width, height = analysis_size
+    output = subprocess.run(
+        [
+            FFMPEG_BINARY,
+            "-v",
+            "error",
+            "-i",
+            video_file,
+            "-an",
+            "-vf",
+            f"fps={analysis_fps},scale={width}:{height},format=gray",
+            "-f",
+            "rawvideo",
+            "-",
+        ],
+        capture_output=True,
+        check=True,
+    ).stdout
+    frame_count = len(output) // (width * height)
+    return np.frombuffer(
+        output[: frame_count * width * height], dtype=np.uint8
+    ).reshape(frame_count, height, width)
+
+
+def detect_scene_cuts(
+    frames: np.ndarray,
+    analysis_fps: float,
+    threshold: float = 30.0,
+    sensitivity: float = 4.0,
+    min_scene_length: float = 1.0,
+) -> list:
+    """
+    Find scene cuts from the mean absolute difference of consecutive frames.
+
+    A frame counts as a cut when its difference to the previous frame is above
+    the fixed threshold and stands out from the clip's typical motion
+    (median + sensitivity * MAD), so fast but continuous footage does not
+    produce a cut on every frame.
+
+    :param frames: Output of read_analysis_frames().
+    :param analysis_fps: Frame rate the frames were sampled at.
+    :param threshold: Minimum mean pixel difference (0-255) of a cut.
+    :param sensitivity: How far above the typical difference a cut must be.
+    :param min_scene_length: Minimum seconds between two cuts.
+    :return: Cut timestamps in seconds.
+    """
+    if len(frames) < 2:
+        return []
+
+    differences = np.abs(np.diff(frames.astype(np.int16), axis=0)).mean(axis=(1, 2))
+    median = np.median(differences)
+    mad = np.median(np.abs(differences - median))
+    limit = max(threshold, median + sensitivity * mad)
+
+    candidates = np.flatnonzero(differences > limit) + 1
+    cuts = []
+    for frame_index in candidates:
+        timestamp = frame_index / analysis_fps
+        if not cuts or timestamp - cuts[-1] >= min_scene_length:
+            cuts.append(float(timestamp))
+    return cuts
+
+
+# ---------------------------------------------------------------- #
+
+
+class BackgroundLibrary:
+    """
+    Index of the background clips in a folder.
+
+    For every clip the index stores its duration, keyframe timestamps and scene
+    cuts. The index and the history of used windows are kept in a JSON file,
+    so clips are only analyzed again when they change, and choosing a window
+    at render time never decodes any footage.
+
+    Several processes may share the index file (e.g. the backend workers),
+    every update locks it and merges what the others wrote.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        index_file: str,
+        analysis_fps: float = 4.0,
+        analysis_size: tuple = (64, 36),
+        history_size: int = 50,
+        debug_output=False,
+    ):
+        """
+        :param folder: Folder containing the background clips.
+        :param index_file: Path of the JSON index.
+        :param analysis_fps: Frame rate used for scene detection.
+        :param analysis_size: Frame size used for scene detection.
+        :param history_size: Number of used windows remembered.
+        :param debug_output: If True, will print debug information.
+        """
+        self.folder = folder
+        self.index_file = index_file
+        self.analysis_fps = analysis_fps
+        self.analysis_size = tuple(analysis_size)
+        self.history_size = history_size
+        self.debug_output = debug_output
+
+        self._clips = {}
+        self._history = []
+        # parts rendered in parallel share one library
+        self._lock = threading.RLock()
+        self._load()
+
+    # ---------------------------------------------------- #
+    # index
+
+    def scan(self) -> dict:
+        """
+        Index every new or changed clip in the folder and drop removed ones.
+
+        :return: The clip index, keyed by file path.
+        """
+        with self._lock:
+            if not os.path.isdir(self.folder):
+                raise FileNotFoundError(f"Background folder not found: {self.folder}")
+
+            found = set()
+            for name in sorted(os.listdir(self.folder)):
+                if not name.lower().endswith(VIDEO_EXTENSIONS):
+                    continue
+                path = os.path.join(self.folder, name)
+                found.add(path)
+
+                stat = os.stat(path)
+                entry = self._clips.get(path)
+                if (
+                    entry
+                    and entry["size"] == stat.st_size
+                    and entry["mtime"] == stat.st_mtime
+                ):
+                    continue
+
+                if self.debug_output:
+                    print(f"Indexing background clip: {path}")
+                self._clips[path] = self._index_clip(path, stat)
+
+            for path in set(self._clips) - found:
+                del self._clips[path]
+
+            self._save()
+            return self._clips
+
+    def clips(self) -> dict:
+        return self._clips
+
+    def _index_clip(self, path: str, stat: os.stat_result) -> dict:
+        info = probe_video(path)
+        frames = read_analysis_frames(path, self.analysis_fps, self.analysis_size)
+        info["scene_cuts"] = detect_scene_cuts(frames, self.analysis_fps)
+        info["size"] = stat.st_size
+        info["mtime"] = stat.st_mtime
+        if self.debug_output:
+            print(
+                f"  {info['duration']:.1f}s, {len(info['keyframes'])} keyframes, "
+                f"{len(info['scene_cuts'])} scene cuts"
+            )
+        return info
+
+    # ---------------------------------------------------- #
+    # window selection
+
+    def select_window(self, duration: float, seed=None) -> dict:
+        """
+        Choose a window of the given length that starts at a scene cut (or the
+        start of a clip) and does not overlap any recently used window.
+
+        Windows are preferred from clips used least recently; if every
+        candidate overlaps recent history, the least recently used one wins.
+        The choice is recorded in the history.
+
+        :param duration: Required window length in seconds.
+        :param seed: Optional random seed for a reproducible choice.
+        :return: Dictionary with file, start and end.
+        """
+        with self._lock:
+            if not self._clips:
+                self.scan()
+
+            # hold the index lock until the choice is saved, so other
+            # processes see it before they choose
+            with self._index_lock():
+                self._merge_saved()
+                window = self._choose_window(duration, seed)
+                self._write()
+
+            if self.debug_output:
+                print(
+                    f"Selected background window: {window['file']} "
+                    f"[{window['start']:.2f}s - {window['end']:.2f}s]"
+                )
+            return window
+
+    def _choose_window(self, duration: float, seed) -> dict:
+        candidates = []
+        for path, clip in self._clips.items():
+            for start in [0.0] + clip["scene_cuts"]:
+                if start + duration <= clip["duration"]:
+                    candidates.append((path, start))
+        if not candidates:
+            raise ValueError(
+                f"No background clip in {self.folder} is at least {duration:.2f}s long."
+            )
+
+        last_used = {}
+        for i, used in enumerate(self._history):
+            last_used[used["file"]] = i
+
+        def overlaps_recent(path: str, start: float) -> bool:
+            return any(
+                used["file"] == path
+                and start < used["end"]
+                and used["start"] < start + duration
+                for used in self._history
+            )
+
+        fresh = [c for c in candidates if not overlaps_recent(*c)]
+        if fresh:
+            # least recently used clip first, random start within it
+            oldest = min(last_used.get(path, -1) for path, _ in fresh)
+            pool = [c for c in fresh if last_used.get(c[0], -1) == oldest]
+        else:
+            oldest = min(last_used.get(path, -1) for path, _ in candidates)
+            pool = [c for c in candidates if last_used.get(c[0], -1) == oldest]
+
+        path, start = random.Random(seed).choice(pool)
+        window = {
+            "file": path,
+            "start": start,
+            "end": start + duration,
+            "keyframe": self._keyframe_before(path, start),
+        }
+        self._history.append({**window, "used_at": time.time()})
+        self._history = self._history[-self.history_size :]
+        return window
+
+    def _keyframe_before(self, path: str, timestamp: float) -> float:
+        """
+        Last keyframe at or before a timestamp, where decoding has to begin.
+        """
+        keyframes = np.asarray(self._clips[path]["keyframes"] or [0.0])
+        index = np.searchsorted(keyframes, timestamp, side="right") - 1
+        return float(keyframes[max(index, 0)])
+
+    # ---------------------------------------------------- #
+    # persistence
+
+    def _load(self):
+        data = self._read()
+        if data is None:
+            return
+        if self._same_analysis(data):
+            self._clips = data.get("clips", {})
+        # scene cuts depend on the analysis settings, the history does not
+        self._history = data.get("history", [])
+
+    def _read(self):
+        if not os.path.exists(self.index_file):
+            return None
+        try:
+            with open(self.index_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != INDEX_VERSION:
+            return None
+        return data
+
+    def _same_analysis(self, data: dict) -> bool:
+        return (
+            tuple(data.get("analysis_size", ())) == self.analysis_size
+            and data.get("analysis_fps") == self.analysis_fps
+        )
+
+    def _merge_saved(self):
+        """
+        Merge what other processes saved since this library was loaded: clips
+        they indexed and windows they used. Must be called with the index lock
+        held.
+        """
+        data = self._read()
+        if data is None:
+            return
+        if self._same_analysis(data):
+            for path, clip in data.get("clips", {}).items():
+                if path not in self._clips and os.path.exists(path):
+                    self._clips[path] = clip
+
+        history = {
+            (used["file"], used["start"], used.get("used_at")): used
+            for used in data.get("history", []) + self._history
+        }
+        self._history = sorted(
+            history.values(), key=lambda used: used.get("used_at", 0.0)
+        )[-self.history_size :]
+
+    @contextmanager
+    def _index_lock(self):
+        """
+        Exclusive lock on the index file across processes.
+        """
+        folder = os.path.dirname(self.index_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        with open(f"{self.index_file}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self):
+        with self._index_lock():
+            self._merge_saved()
+            self._write()
+
+    def _write(self):
+        temp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(
+                {
+                    "version": INDEX_VERSION,
+                    "analysis_fps": self.analysis_fps,
+                    "analysis_size": list(self.analysis_size),
+                    "clips": self._clips,
+                    "history": self._history,
+                },
+                f,
+                indent=2,
+            )
+        os.replace(temp_file, self.index_file)
@@ -0,0 +1,318 @@
+import io
+import threading
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageColor
+from moviepy import ImageClip
+
+from source.globals import SOURCE_FONT_FILE, TARGET_VIDEO_WIDTH, TARGET_VIDEO_HEIGHT
+
+# ---------------------------------------------------------------- #
+
+
+class Glyph:
+    """
+    One pre-rendered character: fill and stroke coverage (0-255) plus where
+    they sit relative to the pen position.
+    """
+
+    __slots__ = ("fill", "stroke", "x", "y", "advance")
+
+    def __init__(self, fill: np.ndarray, stroke: np.ndarray, x: int, y: int, advance):
+        self.fill = fill
+        self.stroke = stroke
+        self.x = x
+        self.y = y
+        self.advance = advance
+
+
+class GlyphAtlas:
+    """
+    Glyphs of one font at one size and stroke width, rasterized on first use
+    and reused for every caption afterwards.
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont, stroke_width: int):
+        self.font = font
+        self.stroke_width = stroke_width
+        ascent, descent = font.getmetrics()
+        self.line_height = ascent + descent
+
+        self._glyphs = {}
+        self._lock = threading.Lock()
+
+    def glyph(self, char: str) -> Glyph:
+        glyph = self._glyphs.get(char)
+        if glyph is None:
+            with self._lock:
+                glyph = self._glyphs.get(char) or self._rasterize(char)
+                self._glyphs[char] = glyph
+        return glyph
+
+    def measure(self, text: str) -> float:
+        return sum(self.glyph(char).advance for char in text)
+
+    def _rasterize(self, char: str) -> Glyph:
+        advance = self.font.getlength(char)
+        left, top, right, bottom = self.font.getbbox(
+            char, anchor="ls", stroke_width=self.stroke_width
+        )
+        if right <= left or bottom <= top:
+            # whitespace only moves the pen
+            empty = np.zeros((0, 0), dtype=np.uint8)
+            return Glyph(empty, empty, 0, 0, advance)
+
+        size = (right - left, bottom - top)
+        origin = (-left, -top)
+        fill = Image.new("L", size, 0)
+        ImageDraw.Draw(fill).text(origin, char, font=self.font, fill=255, anchor="ls")
+        stroke = Image.new("L", size, 0)
+        ImageDraw.Draw(stroke).text(
+            origin,
+            char,
+            font=self.font,
+            fill=255,
+            anchor="ls",
+            stroke_width=self.stroke_width,
+            stroke_fill=255,
+        )
+        return Glyph(np.asarray(fill), np.asarray(stroke), left, top, advance)
+
+
+# ---------------------------------------------------------------- #
+
+
+def _color(value) -> tuple:
+    """
+    RGBA tuple of a color name, hex string or tuple.
+    """
+    if value is None:
+        return (0, 0, 0, 0)
+    if isinstance(value, str):
+        value = ImageColor.getrgb(value)
+    return tuple(value) + (255,) * (4 - len(value))
+
+
+def _box_size(settings: dict) -> tuple:
+    width, height = settings.get("size") or (None, None)
+    return settings.get("width") or width, settings.get("height") or height
+
+
+class CaptionRenderer:
+    """
+    Renders captions without TextClip (and without ImageMagick).
+
+    Every font file is read once. For each font size and stroke width a
+    GlyphAtlas keeps the fill and stroke bitmaps of the characters already
+    used, so a caption is laid out from cached advances and blitted glyph by
+    glyph into a buffer that is just large enough for the text.
+
+    Supports the keys of BrainrotClipGenerator.DEFAULT_TEXT_CLIP_SETTINGS
+    (plus "width", "height" and "margin"). The caption is positioned in the
+    frame as a TextClip of the same settings centered in the frame would be.
+    """
+
+    def __init__(self, frame_size: tuple = (TARGET_VIDEO_WIDTH, TARGET_VIDEO_HEIGHT)):
+        """
+        :param frame_size: (width, height) of the video the captions are placed on.
+        """
+        self.frame_size = frame_size
+
+        self._font_data = {}
+        self._atlases = {}
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------------- #
+
+    def atlas(self, font_file: str, font_size: int, stroke_width: int) -> GlyphAtlas:
+        key = (font_file, int(font_size), int(stroke_width))
+        with self._lock:
+            if key not in self._atlases:
+                if font_file not in self._font_data:
+                    with open(font_file, "rb") as f:
+                        self._font_data[font_file] = f.read()
+                font = ImageFont.truetype(
+                    io.BytesIO(self._font_data[font_file]), int(font_size)
+                )
+                self._atlases[key] = GlyphAtlas(font, int(stroke_width))
+            return self._atlases[key]
+
+    def render(self, text: str, settings: dict) -> tuple:
+        """
+        Rasterize a caption.
+
+        :param text: Caption text.
+        :param settings: Text clip settings.
+        :return: (rgba, (x, y)) - the caption as an RGBA array and its
+            position in the frame.
+        """
+        box_width, box_height = _box_size(settings)
+        margin = settings.get("margin") or (0, 0)
+        stroke_width = int(settings.get("stroke_width") or 0)
+        atlas = self.atlas(
+            settings.get("font") or SOURCE_FONT_FILE,
+            settings.get("font_size") or 80,
+            stroke_width,
+        )
+
+        wrap_width = None
+        if settings.get("method", "caption") == "caption" and box_width:
+            wrap_width = box_width - 2 * margin[0] - 2 * stroke_width
+        lines = self.wrap(text, atlas, wrap_width)
+
+        line_step = atlas.line_height + (settings.get("interline") or 0)
+        widths = [atlas.measure(line) for line in lines]
+        text_width = int(np.ceil(max(widths, default=0))) + 2 * stroke_width
+        text_height = line_step * (len(lines) - 1) + atlas.line_height
+        text_height += 2 * stroke_width
+
+        # the buffer is tight around the text unless a background is drawn
+        background = _color(settings.get("bg_color"))
+        fill_box = background[3] > 0 and box_width and box_height
+        if fill_box:
+            width, height = int(box_width), int(box_height)
+        else:
+            width, height = text_width, text_height
+
+        fill = np.zeros((height, width), dtype=np.uint8)
+        stroke = np.zeros((height, width), dtype=np.uint8)
+        text_x, text_y = 0, 0
+        if fill_box:
+            text_x = self._align(settings.get("horizontal_align"), width, text_width)
+            text_y = self._align(settings.get("vertical_align"), height, text_height)
+
+        ascent = atlas.font.getmetrics()[0]
+        for i, (line, line_width) in enumerate(zip(lines, widths)):
+            pen_x = (
+                text_x
+                + stroke_width
+                + self._align(
+                    settings.get("text_align"),
+                    text_width - 2 * stroke_width,
+                    line_width,
+                )
+            )
+            baseline = text_y + stroke_width + ascent + i * line_step
+            for char in line:
+                glyph = atlas.glyph(char)
+                if glyph.fill.size:
+                    x = int(round(pen_x)) + glyph.x
+                    y = baseline + glyph.y
+                    self._blit(fill, glyph.fill, x, y)
+                    self._blit(stroke, glyph.stroke, x, y)
+                pen_x += glyph.advance
+
+        rgba = self._compose(
+            fill,
+            stroke if stroke_width else fill,
+            _color(settings.get("color", "white")),
+            _color(settings.get("stroke_color")) if stroke_width else None,
+            background,
+        )
+        return rgba, self._position((width, height), settings, fill_box)
+
+    def clip(self, text: str, settings: dict) -> ImageClip:
+        """
+        Caption clip for a segment, positioned in the frame.
+        """
+        rgba, position = self.render(text, settings)
+        transparent = settings.get("transparent", True)
+        return ImageClip(rgba, transparent=transparent).with_position(position)
+
+    # ---------------------------------------------------- #
+    # layout
+
+    @staticmethod
+    def wrap(text: str, atlas: GlyphAtlas, max_width: float = None) -> list:
+        """
+        Split text into lines no wider than max_width, breaking between words.
+        """
+        lines = []
+        for paragraph in text.split("\n"):
+            words = paragraph.split()
+            if max_width is None or not words:
+                lines.append(" ".join(words))
+                continue
+
+            space = atlas.measure(" ")
+            line, line_width = [], 0.0
+            for word in words:
+                word_width = atlas.measure(word)
+                if line and line_width + space + word_width > max_width:
+                    lines.append(" ".join(line))
+                    line, line_width = [], 0.0
+                line_width += (space if line else 0.0) + word_width
+                line.append(word)
+            lines.append(" ".join(line))
+        return lines
+
+    @staticmethod
+    def _align(align: str, available: float, used: float) -> int:
+        if align in ("left", "top"):
+            return 0
+        if align in ("right", "bottom"):
+            return int(available - used)
+        return int((available - used) / 2)
+
+    def _position(self, size: tuple, settings: dict, fill_box: bool) -> tuple:
+        """
+        Frame position of the buffer: the settings' box is centered in the
+        frame and the text aligned inside it.
+        """
+        frame_width, frame_height = self.frame_size
+        box_width, box_height = _box_size(settings)
+        box_width, box_height = box_width or size[0], box_height or size[1]
+        box_x = (frame_width - box_width) / 2
+        box_y = (frame_height - box_height) / 2
+        if fill_box:
+            return int(box_x), int(box_y)
+        return (
+            int(
+                box_x
+                + self._align(settings.get("horizontal_align"), box_width, size[0])
+            ),
+            int(
+                box_y + self._align(settings.get("vertical_align"), box_height, size[1])
+            ),
+        )
+
+    # ---------------------------------------------------- #
+    # rasterization
+
+    @staticmethod
+    def _blit(target: np.ndarray, source: np.ndarray, x: int, y: int):
+        height, width = source.shape
+        x0, y0 = max(x, 0), max(y, 0)
+        x1 = min(x + width, target.shape[1])
+        y1 = min(y + height, target.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            return
+        region = target[y0:y1, x0:x1]
+        np.maximum(region, source[y0 - y : y1 - y, x0 - x : x1 - x], out=region)
+
+    @staticmethod
+    def _compose(
+        fill: np.ndarray,
+        stroke: np.ndarray,
+        color: tuple,
+        stroke_color: tuple,
+        background: tuple,
+    ) -> np.ndarray:
+        """
+        Fill over stroke over background, as straight alpha RGBA.
+        """
+        fill_alpha = fill.astype(np.float32)[..., None] / 255 * (color[3] / 255)
+        stroke_alpha = stroke.astype(np.float32)[..., None] / 255
+        rgb = np.asarray(color[:3], np.float32) * fill_alpha
+        alpha = fill_alpha
+        if stroke_color is not None:
+            stroke_alpha = stroke_alpha * (stroke_color[3] / 255) * (1 - fill_alpha)
+            rgb = rgb + np.asarray(stroke_color[:3], np.float32) * stroke_alpha
+            alpha = alpha + stroke_alpha
+        if background[3] > 0:
+            background_alpha = (background[3] / 255) * (1 - alpha)
+            rgb = rgb + np.asarray(background[:3], np.float32) * background_alpha
+            alpha = alpha + background_alpha
+
+        rgb = np.divide(rgb, alpha, out=np.zeros_like(rgb), where=alpha > 0)
+        return np.concatenate([rgb, alpha * 255], axis=2).round().astype(np.uint8)
@@ -0,0 +1,160 @@
+import math
+
+import numpy as np
+from PIL import Image
+from moviepy import VideoClip
+
+from source.pipeline import fingerprint_callable
+
+# ---------------------------------------------------------------- #
+
+
+def bounce_pop(t: float) -> float:
+    """
+    Bouncy pop scale curve - quick growth, small overshoot, then settle at 1.0.
+    """
+    if t < 0.1:
+        # Quick initial growth
+        return 0.98 + 2 * t  # 0.98 to 1.0 in first 0.1s
+    elif t < 0.3:
+        # Overshoot and bounce
+        return 1.0 + 0.05 * np.sin(3.14 / 0.2 * (t - 0.1))
+    else:
+        # Settle to final size
+        return 1.0
+
+
+# ---------------------------------------------------------------- #
+
+
+class ScaleEffect:
+    """
+    Time based scale animation for caption clips, precomputed ahead of time.
+
+    Instead of resampling the caption on every output frame (what
+    clip.resized(curve) does), the curve is sampled once at exactly the times
+    the composite will request frames. Each distinct scale is rendered a single
+    time and the frames after settle_time reuse the unscaled caption bitmap, so
+    an animated caption costs a dictionary lookup per frame.
+
+    Pass an instance to BrainrotClipGenerator.apply_text_effect().
+    """
+
+    def __init__(self, curve: callable, settle_time: float, precision: int = 3):
+        """
+        :param curve: Function mapping clip time (s) to a scale factor.
+        :param settle_time: Time after which the curve stays at 1.0.
+        :param precision: Decimals the scale is rounded to, scales that round to
+            the same value share one bitmap.
+        """
+        self.curve = curve
+        self.settle_time = settle_time
+        self.precision = precision
+
+    def __repr__(self) -> str:
+        # stable across runs, used to fingerprint pipeline stages
+        return (
+            f"ScaleEffect(curve={fingerprint_callable(self.curve)}, "
+            f"settle_time={self.settle_time}, precision={self.precision})"
+        )
+
+    def __call__(self, segment: dict, fps: float) -> dict:
+        segment["text_clip"] = self.apply(segment["text_clip"], fps)
+        return segment
+
+    # ---------------------------------------------------- #
+
+    def sample_scales(self, start: float, fps: float) -> tuple:
+        """
+        Sample the curve at the clip times of the output frames.
+
+        A clip starting at `start` is asked for local times
+        (ceil(start * fps) + k) / fps - start, which is generally not a
+        multiple of 1 / fps.
+
+        :return: (phase, scales) - local time of the first frame and the
+            rounded scale of each frame before the curve settles.
+        """
+        phase = math.ceil(start * fps - 1e-9) / fps - start
+        frame_count = max(0, math.ceil((self.settle_time - phase) * fps))
+        scales = [
+            round(float(self.curve(phase + k / fps)), self.precision)
+            for k in range(frame_count)
+        ]
+        return phase, scales
+
+    def apply(self, text_clip: VideoClip, fps: float) -> VideoClip:
+        """
+        Create the animated version of a caption clip.
+
+        :param text_clip: Static caption clip (with mask).
+        :param fps: Output frame rate of the render.
+        :return: Clip with the same start, duration and position.
+        """
+        base_frame = text_clip.get_frame(0)
+        base_mask = text_clip.mask.get_frame(0) if text_clip.mask is not None else None
+        phase, scales = self.sample_scales(text_clip.start or 0.0, fps)
+
+        frames = {1.0: (base_frame, base_mask)}
+        for scale in scales:
+            if scale not in frames:
+                frames[scale] = (
+                    _scale_image(base_frame, scale),
+                    _scale_image(base_mask, scale) if base_mask is not None else None,
+                )
+        frame_scales = [frames[scale] for scale in scales]
+
+        def lookup(t: float) -> tuple:
+            index = int(round((t - phase) * fps))
+            if 0 <= index < len(frame_scales):
+                return frame_scales[index]
+            return frames[1.0]
+
+        animated = VideoClip(
+            frame_function=lambda t: lookup(t)[0],
+            duration=text_clip.duration,
+            has_constant_size=False,
+        )
+        if base_mask is not None:
+            mask = VideoClip(
+                frame_function=lambda t: lookup(t)[1],
+                is_mask=True,
+                duration=text_clip.duration,
+                has_constant_size=False,
+            )
+            animated = animated.with_mask(mask)
+
+        animated = animated.with_start(text_clip.start)
+        animated.relative_pos = text_clip.relative_pos
+        base_height, base_width = base_frame.shape[:2]
+
+        def position(t: float):
+            x, y = text_clip.pos(t)
+            if text_clip.relative_pos or isinstance(x, str) or isinstance(y, str):
+                # relative and named positions are resolved per frame size
+                return x, y
+            # keep the scaled caption centered on the unscaled one
+            height, width = lookup(t)[0].shape[:2]
+            return x + (base_width - width) / 2, y + (base_height - height) / 2
+
+        animated.pos = position
+        return animated
+
+
+def _scale_image(image: np.ndarray, scale: float) -> np.ndarray:
+    """
+    Resize an RGB frame (uint8) or a mask (float 0-1) by a scale factor.
+    """
+    height, width = image.shape[:2]
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    if image.dtype == np.uint8:
+        resized = Image.fromarray(image).resize(size, Image.Resampling.BILINEAR)
+        return np.asarray(resized)
+
+    resized = Image.fromarray(image.astype(np.float32), mode="F").resize(
+        size, Image.Resampling.BILINEAR
+    )
+    return np.asarray(resized)
+
+
+BOUNCE_POP_EFFECT = ScaleEffect(bounce_pop, settle_time=0.3)
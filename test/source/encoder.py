@@ -0,0 +1,384 @@
+import os
+import glob
+import subprocess
+
+import numpy as np
+
+from source.pipeline import hash_file, hash_value
+from source.globals import DEFAULT_RENDER_OPTIONS
+
+# ---------------------------------------------------------------- #
+
+FFMPEG_BINARY = "ffmpeg"
+
+
+def resolve_output_file(output_file: str, spec: dict) -> str:
+    """
+    File of an output spec, "<output_file>_<name>.<ext>" if it has none.
+    """
+    if spec.get("file"):
+        return spec["file"]
+    if not spec.get("name"):
+        raise ValueError("Output specs need a 'file' or a 'name'.")
+    base, ext = os.path.splitext(output_file)
+    return f"{base}_{spec['name']}{ext or '.mp4'}"
+
+
+def _even(value: float) -> int:
+    # yuv420p needs even dimensions
+    return max(2, int(value) // 2 * 2)
+
+
+def build_video_filter(source_size: tuple, spec: dict) -> str:
+    """
+    Crop + scale filter chain of one output spec.
+
+    "crop" may be an explicit (x, y, width, height) region. Otherwise, when the
+    target "size" has a different aspect ratio than the source, the largest
+    centered region with the target aspect ratio is used, e.g. a 1:1 square
+    from the middle of a 9:16 frame.
+    """
+    source_width, source_height = source_size
+    target_width, target_height = spec.get("size") or source_size
+
+    if spec.get("crop"):
+        x, y, crop_width, crop_height = spec["crop"]
+    else:
+        target_aspect = target_width / target_height
+        if source_width / source_height > target_aspect:
+            crop_width, crop_height = source_height * target_aspect, source_height
+        else:
+            crop_width, crop_height = source_width, source_width / target_aspect
+        x = (source_width - crop_width) / 2
+        y = (source_height - crop_height) / 2
+
+    filters = []
+    crop_width, crop_height = _even(crop_width), _even(crop_height)
+    if (crop_width, crop_height) != (source_width, source_height):
+        filters.append(f"crop={crop_width}:{crop_height}:{int(x)}:{int(y)}")
+    if (_even(target_width), _even(target_height)) != (crop_width, crop_height):
+        filters.append(f"scale={_even(target_width)}:{_even(target_height)}")
+    filters.append("format=yuv420p")
+    return ",".join(filters)
+
+
+# render() options that also apply to every output spec
+SPEC_OPTION_KEYS = (
+    "codec",
+    "preset",
+    "bitrate",
+    "crf",
+    "threads",
+    "ffmpeg_params",
+    "audio_codec",
+    "audio_bitrate",
+    "audio_fps",
+)
+
+
+def build_encoder_args(spec: dict) -> list:
+    """
+    ffmpeg encoder arguments of one output spec, defaults from DEFAULT_RENDER_OPTIONS.
+    """
+    args = [
+        "-c:v",
+        spec.get("codec", DEFAULT_RENDER_OPTIONS["codec"]),
+        "-preset",
+        spec.get("preset", DEFAULT_RENDER_OPTIONS["preset"]),
+    ]
+    if spec.get("bitrate"):
+        args += ["-b:v", spec["bitrate"]]
+    if spec.get("crf") is not None:
+        args += ["-crf", str(spec["crf"])]
+    if spec.get("threads"):
+        args += ["-threads", str(spec["threads"])]
+    args += list(spec.get("ffmpeg_params", []))
+    return args
+
+
+def audio_settings(spec: dict) -> tuple:
+    """
+    (codec, bitrate, sample rate) of the audio track of an output spec.
+    """
+    return (
+        spec.get("audio_codec", DEFAULT_RENDER_OPTIONS["audio_codec"]),
+        spec.get("audio_bitrate", DEFAULT_RENDER_OPTIONS["audio_bitrate"]),
+        spec.get("audio_fps", DEFAULT_RENDER_OPTIONS["audio_fps"]),
+    )
+
+
+def video_only_file(output_file: str) -> str:
+    base, ext = os.path.splitext(output_file)
+    return f"{base}.video{ext or '.mp4'}"
+
+
+def encoded_audio_files(audio_file: str) -> list:
+    """
+    Tracks AudioEncode stored for an audio file, in any version or setting.
+    """
+    return glob.glob(f"{glob.escape(os.path.splitext(audio_file)[0])}.*.mka")
+
+
+class AudioEncode:
+    """
+    Encodes a narration into the audio track of the outputs in a separate
+    ffmpeg process, started before the video frames are produced.
+
+    Encoded tracks are named by the content hash of the source audio and the
+    encoder settings, and stored next to it. Rendering the same narration
+    again (e.g. after only the captions changed) reuses the track without
+    starting ffmpeg.
+    """
+
+    def __init__(
+        self,
+        audio_file: str,
+        codec: str = DEFAULT_RENDER_OPTIONS["audio_codec"],
+        bitrate: str = DEFAULT_RENDER_OPTIONS["audio_bitrate"],
+        sample_rate: int = DEFAULT_RENDER_OPTIONS["audio_fps"],
+        debug_output=False,
+    ):
+        """
+        :param audio_file: Source audio, e.g. the concatenated narration.
+        :param codec: ffmpeg audio encoder.
+        :param bitrate: Audio bitrate.
+        :param sample_rate: Sample rate of the encoded track.
+        :param debug_output: If True, will print debug information.
+        """
+        base = os.path.splitext(audio_file)[0]
+        content_hash = hash_file(audio_file)[:16]
+        settings_hash = hash_value([codec, bitrate, sample_rate])[:8]
+        # matroska holds any codec and is stream copied into the outputs
+        self.file = f"{base}.{content_hash}.{settings_hash}.mka"
+        self.debug_output = debug_output
+        self._temp_file = f"{self.file}.{os.getpid()}.tmp.mka"
+        self._process = None
+
+        if os.path.exists(self.file):
+            if debug_output:
+                print(f"Reusing encoded audio {self.file}")
+            return
+
+        # encodes of an earlier version of this narration are stale now
+        for stale_file in encoded_audio_files(audio_file):
+            if not stale_file.startswith(f"{base}.{content_hash}."):
+                os.remove(stale_file)
+
+        command = [
+            FFMPEG_BINARY,
+            "-y",
+            "-loglevel",
+            "error",
+            "-i",
+            audio_file,
+            "-vn",
+            "-c:a",
+            codec,
+            "-b:a",
+            str(bitrate),
+            "-ar",
+            str(sample_rate),
+            self._temp_file,
+        ]
+        if debug_output:
+            print(f"Encoding audio: {' '.join(command)}")
+        self._process = subprocess.Popen(
+            command, stdin=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+
+    def wait(self) -> str:
+        """
+        Wait for the encode to finish.
+
+        :return: Path of the encoded track.
+        """
+        if self._process is None:
+            return self.file
+
+        error = self._process.stderr.read().decode(errors="replace")
+        if self._process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode audio:\n{error}")
+        self._process = None
+        os.replace(self._temp_file, self.file)
+        return self.file
+
+    def cancel(self):
+        """
+        Stop the encode if it is still running, e.g. because the render failed.
+        Does nothing once wait() returned.
+        """
+        if self._process is None:
+            return
+        self._process.kill()
+        self._process.wait()
+        self._process.stderr.close()
+        self._process = None
+        if os.path.exists(self._temp_file):
+            os.remove(self._temp_file)
+
+
+def start_audio_encodes(audio_file: str, specs: list, debug_output=False) -> list:
+    """
+    One AudioEncode per distinct audio setting of the specs.
+
+    :return: The AudioEncode of every spec, in order.
+    """
+    encodes = {}
+    for spec in specs:
+        settings = audio_settings(spec)
+        if settings not in encodes:
+            encodes[settings] = AudioEncode(
+                audio_file, *settings, debug_output=debug_output
+            )
+    return [encodes[audio_settings(spec)] for spec in specs]
+
+
+def mux_audio(
+    video_file: str, audio_file: str, output_file: str, shortest: bool = False
+):
+    """
+    Combine a video-only file and an encoded audio track without re-encoding
+    either of them.
+    """
+    command = [
+        FFMPEG_BINARY,
+        "-y",
+        "-loglevel",
+        "error",
+        "-i",
+        video_file,
+        "-i",
+        audio_file,
+        "-map",
+        "0:v",
+        "-map",
+        "1:a",
+        "-c",
+        "copy",
+    ]
+    if shortest:
+        command.append("-shortest")
+    command += ["-movflags", "+faststart", output_file]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(
+            f"ffmpeg failed to mux {output_file}:\n"
+            f"{result.stderr.decode(errors='replace')}"
+        )
+
+
+def build_fanout_command(
+    source_size: tuple,
+    fps: float,
+    outputs: list,
+) -> list:
+    """
+    Build one ffmpeg command that reads raw RGB frames from stdin once and
+    encodes them into every output (video only).
+
+    The frames are duplicated inside ffmpeg with the split filter, so each
+    frame crosses the pipe a single time no matter how many variants there are.
+
+    :param source_size: (width, height) of the piped frames.
+    :param fps: Frame rate of the piped frames.
+    :param outputs: Output specs, each with a resolved "file".
+    :return: The ffmpeg argument list.
+    """
+    width, height = source_size
+    command = [
+        FFMPEG_BINARY,
+        "-y",
+        "-loglevel",
+        "error",
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "rgb24",
+        "-s",
+        f"{width}x{height}",
+        "-r",
+        str(fps),
+        "-i",
+        "-",
+    ]
+
+    labels = [f"v{i}" for i in range(len(outputs))]
+    chains = [
+        f"[0:v]split={len(outputs)}" + "".join(f"[s{i}]" for i in range(len(outputs)))
+    ]
+    for i, spec in enumerate(outputs):
+        chains.append(f"[s{i}]{build_video_filter(source_size, spec)}[{labels[i]}]")
+    command += ["-filter_complex", ";".join(chains)]
+
+    for label, spec in zip(labels, outputs):
+        command += ["-map", f"[{label}]"]
+        command += build_encoder_args(spec)
+        command += ["-an", "-movflags", "+faststart", spec["file"]]
+    return command
+
+
+def write_video_variants(
+    clip,
+    outputs: list,
+    fps: float,
+    audio_file: str = None,
+    debug_output=False,
+) -> list:
+    """
+    Composite every frame of a clip once and encode it into several outputs.
+
+    The audio track is encoded by separate processes while the frames are
+    produced, and muxed into each output afterwards with a stream copy.
+
+    :param clip: The composite clip.
+    :param outputs: Output specs, each with a resolved "file".
+    :param fps: Frame rate to render at.
+    :param audio_file: Optional audio track for every output.
+    :param debug_output: If True, will print debug information.
+    :return: Paths of the written files.
+    """
+    for spec in outputs:
+        folder = os.path.dirname(spec["file"])
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+    files = [spec["file"] for spec in outputs]
+    audio_encodes = []
+    if audio_file:
+        audio_encodes = start_audio_encodes(audio_file, outputs, debug_output)
+        outputs = [{**spec, "file": video_only_file(spec["file"])} for spec in outputs]
+
+    command = build_fanout_command(tuple(clip.size), fps, outputs)
+    if debug_output:
+        print(f"Encoding {len(outputs)} outputs: {' '.join(command)}")
+
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    width, height = clip.size
+    buffer = np.empty((height, width, 3), dtype=np.uint8)
+    try:
+        try:
+            for frame in clip.iter_frames(fps=fps, dtype="uint8"):
+                # frames are handed to the pipe without a bytes copy, the buffer
+                # is only used for frames with an alpha channel or a strided view
+                if frame.shape[2] != 3 or not frame.flags.c_contiguous:
+                    np.copyto(buffer, frame[:, :, :3])
+                    frame = buffer
+                process.stdin.write(memoryview(frame).cast("B"))
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        error = process.stderr.read().decode(errors="replace")
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode outputs:\n{error}")
+
+        for spec, audio_encode, output_file in zip(outputs, audio_encodes, files):
+            mux_audio(spec["file"], audio_encode.wait(), output_file, shortest=True)
+            os.remove(spec["file"])
+    finally:
+        # a failed composite must not leave ffmpeg processes behind
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        for audio_encode in audio_encodes:
+            audio_encode.cancel()
+    return files
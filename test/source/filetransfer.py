@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import threading
+import mimetypes
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from source.pipeline import hash_file
+
+# ---------------------------------------------------------------- #
+
+GEMINI_API_BASE_URL = "https://generativelanguage.googleapis.com"
+INDEX_VERSION = 1
+
+# chunks must be multiples of 256 KiB, except for the last one
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_GRANULARITY = 256 * 1024
+
+# uploaded files are deleted by the API after 48 hours, stop reusing them
+# a bit earlier so a prompt never references a file that expires mid-request
+REMOTE_FILE_LIFETIME = 47 * 60 * 60
+
+
+def _is_retryable(error: urllib.error.HTTPError) -> bool:
+    return error.code == 429 or error.code >= 500
+
+
+class GeminiFileTransfer:
+    """
+    Streaming, resumable and deduplicated uploads to the Gemini Files API.
+
+    Files are sent in fixed size chunks with the resumable upload protocol, so
+    only one chunk is in memory at a time and an interrupted upload continues
+    at the last offset the server confirmed. A local JSON index maps the
+    content hash of every uploaded file to its remote handle, so sending the
+    same bytes again (under any path) reuses the uploaded file.
+
+    base_url can point at a local stub server implementing the same protocol,
+    it defaults to $GEMINI_API_BASE_URL or the public endpoint.
+    """
+
+    def __init__(
+        self,
+        index_file: str,
+        api_key: str = None,
+        base_url: str = None,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        max_retries: int = 3,
+        timeout: float = 60.0,
+        debug_output=False,
+    ):
+        """
+        :param index_file: Path of the JSON index of uploaded files.
+        :param api_key: Gemini API key, defaults to $GEMINI_API_KEY.
+        :param base_url: API endpoint, defaults to $GEMINI_API_BASE_URL.
+        :param chunk_size: Bytes sent per request, rounded to 256 KiB.
+        :param max_retries: Attempts to resume a failed upload before giving up,
+            only after connection errors, 5xx and 429 responses.
+        :param timeout: Timeout of a single request in seconds.
+        :param debug_output: If True, will print debug information.
+        """
+        self.index_file = index_file
+        self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
+        self.base_url = (
+            base_url or os.environ.get("GEMINI_API_BASE_URL") or GEMINI_API_BASE_URL
+        ).rstrip("/")
+        self.chunk_size = max(
+            UPLOAD_GRANULARITY, chunk_size // UPLOAD_GRANULARITY * UPLOAD_GRANULARITY
+        )
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.debug_output = debug_output
+
+        # files: content hash -> remote file, pending: content hash -> session,
+        # paths: path -> (size, mtime, content hash) so files are hashed once
+        self._files = {}
+        self._pending = {}
+        self._paths = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    # ---------------------------------------------------- #
+    # public api
+
+    def upload(self, file_path: str, mime_type: str = None) -> dict:
+        """
+        Upload a file, or return the remote file of an earlier upload of the
+        same content.
+
+        :param file_path: Path to the file.
+        :param mime_type: Mime type, guessed from the extension if not given.
+        :return: Remote file with name, uri, mime_type and size.
+        """
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        if mime_type is None:
+            mime_type, _ = mimetypes.guess_type(file_path)
+            mime_type = mime_type or "application/octet-stream"
+
+        content_hash = self.content_hash(file_path)
+        remote = self._files.get(content_hash)
+        if remote and remote["expires_at"] > time.time():
+            if self.debug_output:
+                print(f"Reusing uploaded file {remote['name']} for {file_path}")
+            return remote
+
+        size = os.path.getsize(file_path)
+        for attempt in range(self.max_retries + 1):
+            try:
+                remote = self._upload(file_path, content_hash, size, mime_type)
+                break
+            except (urllib.error.URLError, ConnectionError, TimeoutError) as e:
+                # HTTPError is a URLError too, but a client error (bad key, bad
+                # request) fails the same way again, only the server is retried
+                if isinstance(e, urllib.error.HTTPError) and not _is_retryable(e):
+                    raise RuntimeError(f"Upload of {file_path} failed: {e}") from e
+                if attempt == self.max_retries:
+                    raise RuntimeError(
+                        f"Upload of {file_path} failed after {attempt + 1} attempts: {e}"
+                    ) from e
+                if self.debug_output:
+                    print(f"Upload of {file_path} interrupted ({e}), resuming...")
+                time.sleep(min(2**attempt, 10))
+
+        with self._lock:
+            self._files[content_hash] = remote
+            self._pending.pop(content_hash, None)
+            self._save()
+        return remote
+
+    def wait_until_active(
+        self, remote: dict, timeout: float = 300.0, interval: float = 2.0
+    ) -> dict:
+        """
+        Wait until the API has processed an uploaded file (videos take a while
+        before they can be used in a prompt).
+
+        :return: The remote file.
+        """
+        deadline = time.time() + timeout
+        state = remote.get("state", "ACTIVE")
+        while state == "PROCESSING":
+            if time.time() > deadline:
+                raise TimeoutError(f"File {remote['name']} is still processing.")
+            time.sleep(interval)
+            state = self._request("GET", f"/v1beta/{remote['name']}")[1]["state"]
+        if state == "FAILED":
+            raise RuntimeError(f"Processing of file {remote['name']} failed.")
+
+        remote["state"] = state
+        return remote
+
+    def content_hash(self, file_path: str) -> str:
+        """
+        sha256 of a file, only read again when its size or mtime changed.
+        """
+        stat = os.stat(file_path)
+        path = os.path.abspath(file_path)
+        known = self._paths.get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            return known[2]
+
+        content_hash = hash_file(file_path)
+        with self._lock:
+            self._paths[path] = [stat.st_size, stat.st_mtime, content_hash]
+        return content_hash
+
+    def forget(self, content_hash: str):
+        """
+        Drop a remote file from the index, e.g. after it was deleted remotely.
+        """
+        with self._lock:
+            self._files.pop(content_hash, None)
+            self._pending.pop(content_hash, None)
+            self._save()
+
+    # ---------------------------------------------------- #
+    # resumable upload protocol
+
+    def _upload(
+        self, file_path: str, content_hash: str, size: int, mime_type: str
+    ) -> dict:
+        session = self._pending.get(content_hash)
+        offset = 0
+        if session:
+            offset = self._query_offset(session["upload_url"])
+            if offset is None:
+                session = None
+            elif self.debug_output:
+                print(f"Resuming upload of {file_path} at {offset}/{size} bytes")
+
+        if not session:
+            session = {
+                "upload_url": self._start_session(file_path, size, mime_type),
+                "size": size,
+            }
+            offset = 0
+            with self._lock:
+                self._pending[content_hash] = session
+                self._save()
+
+        with open(file_path, "rb") as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(self.chunk_size)
+                last = offset + len(chunk) >= size
+                headers = {
+                    "X-Goog-Upload-Command": ("upload, finalize" if last else "upload"),
+                    "X-Goog-Upload-Offset": str(offset),
+                    "Content-Length": str(len(chunk)),
+                }
+                _, body = self._request(
+                    "POST", session["upload_url"], data=chunk, headers=headers
+                )
+                offset += len(chunk)
+                if last:
+                    break
+
+        remote = body["file"]
+        if self.debug_output:
+            print(f"Uploaded {file_path} ({size} bytes) as {remote['name']}")
+        return {
+            "name": remote["name"],
+            "uri": remote["uri"],
+            "mime_type": remote.get("mimeType", mime_type),
+            "size": size,
+            "state": remote.get("state", "ACTIVE"),
+            "expires_at": time.time() + REMOTE_FILE_LIFETIME,
+        }
+
+    def _start_session(self, file_path: str, size: int, mime_type: str) -> str:
+        headers, _ = self._request(
+            "POST",
+            "/upload/v1beta/files",
+            data=json.dumps(
+                {"file": {"display_name": os.path.basename(file_path)}}
+            ).encode("utf-8"),
+            headers={
+                "X-Goog-Upload-Protocol": "resumable",
+                "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(size),
+                "X-Goog-Upload-Header-Content-Type": mime_type,
+                "Content-Type": "application/json",
+            },
+        )
+        upload_url = headers.get("X-Goog-Upload-URL")
+        if not upload_url:
+            raise RuntimeError("Upload session response has no X-Goog-Upload-URL.")
+        return upload_url
+
+    def _query_offset(self, upload_url: str) -> int:
+        """
+        Bytes the server received for an upload session, None if the session
+        is gone.
+        """
+        try:
+            headers, _ = self._request(
+                "POST", upload_url, headers={"X-Goog-Upload-Command": "query"}
+            )
+        except urllib.error.HTTPError:
+            return None
+        if headers.get("X-Goog-Upload-Status") != "active":
+            return None
+        return int(headers.get("X-Goog-Upload-Size-Received", 0))
+
+    def _request(
+        self, method: str, url: str, data: bytes = None, headers: dict = None
+    ) -> tuple:
+        if url.startswith("/"):
+            url = self.base_url + url
+        if self.api_key:
+            separator = "&" if "?" in url else "?"
+            url += f"{separator}key={urllib.parse.quote(self.api_key)}"
+
+        request = urllib.request.Request(
+            url, data=data if data is not None else b"", method=method
+        )
+        for name, value in (headers or {}).items():
+            request.add_header(name, value)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            payload = response.read()
+            return response.headers, json.loads(payload) if payload else {}
+
+    # ---------------------------------------------------- #
+    # persistence
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") != INDEX_VERSION or data.get("base_url") != (
+            self.base_url
+        ):
+            return
+        self._files = data.get("files", {})
+        self._pending = data.get("pending", {})
+        self._paths = data.get("paths", {})
+
+    def _save(self):
+        folder = os.path.dirname(self.index_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        temp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(
+                {
+                    "version": INDEX_VERSION,
+                    "base_url": self.base_url,
+                    "files": self._files,
+                    "pending": self._pending,
+                    "paths": self._paths,
+                },
+                f,
+                indent=2,
+            )
+        os.replace(temp_file, self.index_file)
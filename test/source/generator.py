@@ -1,15 +1,41 @@
-from moviepy import TextClip
-from kokoro import KPipeline
+from typing import TYPE_CHECKING
 
 
 import re
 import os
+import shutil
+import threading
 import numpy as np
 import soundfile as sf
 import scipy.signal as signal
 
 import moviepy
 
+from source.timeline import Timeline
+from source.silence import speech_bounds
+from source.rerender import (
+    MAX_SPLICE_FRACTION,
+    changed_ranges,
+    keep_timing,
+    match_segments,
+    splice_video,
+)
+from source.effects import ScaleEffect
+from source.encoder import (
+    SPEC_OPTION_KEYS,
+    AudioEncode,
+    encoded_audio_files,
+    mux_audio,
+    resolve_output_file,
+    start_audio_encodes,
+    video_only_file,
+    write_video_variants,
+)
+from source.ttscache import TTSCache
+from source.captions import CaptionRenderer
+from source.streaming import StreamingCompositeClip
+from source.ttspool import KokoroPool, voice_language
+from source.tuning import EncoderTuner, tuned_options
 from source.globals import (
     TARGET_VIDEO_WIDTH,
     TARGET_VIDEO_HEIGHT,
@@ -17,9 +43,16 @@ from source.globals import (
     DEFAULT_RENDER_OPTIONS,
 )
 
+if TYPE_CHECKING:
+    # torch is only loaded by whoever creates the kokoro pipeline, a generator
+    # using a TTSClient never imports it
+    from kokoro import KPipeline
 
 # ---------------------------------------------------------------- #
 
+# samples read and written at a time when concatenating segments
+AUDIO_BLOCK_SIZE = 65536
+
 
 class BrainrotClipGenerator:
 
@@ -27,6 +60,7 @@ class BrainrotClipGenerator:
     # constants
 
     KOKORO_SAMPLE_RATE = 24000
+    OUTPUT_SAMPLE_RATE = 44100
 
     KOKORO_LANGUAGES = {
         "american": "a",
@@ -79,30 +113,62 @@ class BrainrotClipGenerator:
         self,
         video_text: str,
         video_file: str,
-        kokoro_model: KPipeline,
+        kokoro_model: "KPipeline" = None,
         debug_output=False,
         framerate=30,
         inter_segment_delay=0.1,
+        video_start=0.0,
+        tts_cache: TTSCache = None,
+        tts_lock: threading.Lock = None,
+        tts_pool: KokoroPool = None,
+        encoder_tuner: EncoderTuner = None,
+        caption_renderer: CaptionRenderer = None,
+        low_memory: bool = False,
     ):
         """
         Initialize the BrainrotClipGenerator with a video file and debug output option.
 
         :param video_file: Path to the video file.
         :param debug_output: If True, will print debug information.
+        :param video_start: Second of the video file the background starts at.
+        :param tts_cache: Optional cache of synthesized segment audio.
+        :param tts_lock: Lock held while kokoro synthesizes, pass the same lock
+            to generators that share one kokoro model across threads.
+        :param tts_pool: Optional KokoroPool (or TTSClient of the TTS service),
+            segments are then synthesized in the pipeline of their voice's
+            language instead of kokoro_model.
+        :param encoder_tuner: Optional EncoderTuner, render() then uses the
+            encoder settings tuned for this machine.
+        :param caption_renderer: CaptionRenderer drawing the captions, share one
+            between generators to share its glyph atlases.
+        :param low_memory: If True, composite_clips() creates every caption only
+            while it is on screen and composites into one reused frame buffer,
+            so memory does not grow with the length of the story.
 
         """
+        if kokoro_model is None and tts_pool is None:
+            raise ValueError("Either kokoro_model or tts_pool is required.")
+
         self._video_text = video_text
         self.video_file = video_file
         self.debug_output = debug_output
         self.kokoro_model = kokoro_model
         self.framerate = framerate
+        self.video_start = video_start
+        self.tts_cache = tts_cache
+        self.tts_pool = tts_pool
+        self.tts_lock = tts_lock or (tts_pool.lock if tts_pool else threading.Lock())
+        self.encoder_tuner = encoder_tuner
+        self.caption_renderer = caption_renderer or CaptionRenderer()
+        self.low_memory = low_memory
 
         self._inter_segment_delay = inter_segment_delay
         self._generated_text_segments = []
         self._video_clip = None
         self._video_dimensions = [0, 0]
         self._scale_factor = 1.0
-        self._video_segments = {}
+        self._timeline = None
+        self._text_effects = []
 
         self._concatenated_audio_duration = 0.0
         self._concatenated_audio_file = ""
@@ -136,12 +202,18 @@ class BrainrotClipGenerator:
         # calculate scale factor
         self._scale_factor = TARGET_VIDEO_HEIGHT / self._video_dimensions[1]
         __new_width = int(self._video_dimensions[0] * self._scale_factor)
-        self._video_clip = self._video_clip.resized(height=TARGET_VIDEO_HEIGHT)
-        if self.debug_output:
-            print(
-                f"Video clip resized to: {__new_width}x{TARGET_VIDEO_HEIGHT} "
-                f"(scale factor: {self._scale_factor:.2f})"
-            )
+        if self._video_dimensions == [TARGET_VIDEO_WIDTH, TARGET_VIDEO_HEIGHT]:
+            # already in the output format (e.g. normalized by a MediaStore),
+            # skip the per frame resize
+            if self.debug_output:
+                print("Video clip already has the target size, not resizing.")
+        else:
+            self._video_clip = self._video_clip.resized(height=TARGET_VIDEO_HEIGHT)
+            if self.debug_output:
+                print(
+                    f"Video clip resized to: {__new_width}x{TARGET_VIDEO_HEIGHT} "
+                    f"(scale factor: {self._scale_factor:.2f})"
+                )
 
         # crop to target width
         if __new_width > TARGET_VIDEO_WIDTH:
@@ -164,14 +236,44 @@ class BrainrotClipGenerator:
                     f"(x_offset: 0)"
                 )
 
-        # get audio to be (audio length + 1)
+        # get audio to be (audio length + 1), starting at video_start
+        # (ffmpeg seeks there directly, earlier footage is never decoded)
         self._video_clip = self._video_clip.subclipped(
-            0, self._concatenated_audio_duration + 1
+            self.video_start,
+            self.video_start + self._concatenated_audio_duration + 1,
         )
 
         # set target fps
         self._video_clip = self._video_clip.with_fps(self.framerate)
 
+    def set_background(self, video_file: str, video_start: float = 0.0):
+        """
+        Use a different background clip, e.g. a window chosen from a
+        BackgroundLibrary. Must be called before setup().
+
+        :param video_file: Path to the video file.
+        :param video_start: Second of the video file the background starts at.
+        """
+        self.video_file = video_file
+        self.video_start = video_start
+
+    def set_video_text(self, video_text: str):
+        """
+        Replace the input text, e.g. once it has been fetched and cleaned.
+
+        :param video_text: The new input text.
+        """
+        self._video_text = video_text
+        self._generated_text_segments = []
+
+    def set_text_segments(self, segments: list):
+        """
+        Use an already split list of text segments, e.g. from a previous run.
+
+        :param segments: List of text segments.
+        """
+        self._generated_text_segments = list(segments)
+
     def split_text_into_segments(self, max_words: int, max_chars: int) -> list:
         """
         Split the input text into manageable segments with constraints on:
@@ -253,59 +355,81 @@ class BrainrotClipGenerator:
     def generate_segments(
         self,
         folder_path: str,
-        voice: str,
+        voice,
         text_clip_settings: dict = None,
         text_clip_modifier: callable = None,
-    ) -> list:
+        previous_timeline: Timeline = None,
+    ) -> Timeline:
         """
-        Segment the input text into manageable chunks.
-        This is a placeholder function; you can implement your own logic.
+        Synthesize audio for every text segment and lay them out on a timeline.
+
+        Segments are synthesized grouped by voice, so every voice pack is
+        switched to once, and placed on the timeline in text order. Text clips
+        are not rendered here; the timeline creates each one the first time it
+        is needed.
+
+        With a previous timeline, the segment list is diffed against it and
+        the audio of every unchanged segment (same text, voice and language)
+        is taken over from its file; only changed segments are synthesized.
+
+        :param folder_path: Folder the segment audio files are written to.
+        :param voice: Kokoro voice for every segment, a list with one voice per
+            segment, or a function called as voice(text, index).
+        :param text_clip_settings: Settings for the text clips.
+        :param text_clip_modifier: Optional function called as
+            modifier(settings, text, index) to adjust a clip's settings.
+        :param previous_timeline: Untrimmed timeline of an earlier
+            generate_segments() call, e.g. before a caption was edited.
+        :return: The timeline of generated segments.
         """
 
-        # Normalize clip settings
-        if text_clip_settings is None:
-            text_clip_settings = BrainrotClipGenerator.DEFAULT_TEXT_CLIP_SETTINGS.copy()
-        elif not isinstance(text_clip_settings, dict):
-            raise ValueError(
-                "text_clip_settings must be a dictionary. "
-                "Use BrainrotClipGenerator.DEFAULT_TEXT_CLIP_SETTINGS as a template."
-            )
-
         # create the folder if it does not exist
         if not os.path.exists(folder_path):
             os.makedirs(folder_path)
-        for key in BrainrotClipGenerator.DEFAULT_TEXT_CLIP_SETTINGS:
-            if key not in text_clip_settings:
-                text_clip_settings[key] = (
-                    BrainrotClipGenerator.DEFAULT_TEXT_CLIP_SETTINGS[key]
-                )
+
+        texts = self._generated_text_segments
+        voices = self._segment_voices(voice, texts)
+        target_rate = BrainrotClipGenerator.OUTPUT_SAMPLE_RATE
+
+        first_use = {}
+        for i, segment_voice in enumerate(voices):
+            first_use.setdefault(segment_voice, i)
+        order = sorted(range(len(texts)), key=lambda i: (first_use[voices[i]], i))
+
+        sample_counts = {}
+        if previous_timeline is not None:
+            sample_counts = self._reuse_segments(
+                previous_timeline, folder_path, texts, voices
+            )
 
         # generate all the audio files
-        segments = {}
-        duration = 0.0
-        for i, text in enumerate(self._generated_text_segments):
+        for i in order:
+            if i in sample_counts:
+                continue
+            text, segment_voice = texts[i], voices[i]
+            language = self.language_of(segment_voice)
+            segment_file = os.path.join(folder_path, f"segment_{i}.wav")
 
-            # generate audio for the text segment
-            audio_segment = self.kokoro_model(text, voice=voice)
-            if not audio_segment:
+            # reuse audio synthesized before (by any run, part or job)
+            cache_key = None
+            if self.tts_cache is not None:
+                cache_key = self.tts_cache.key(
+                    text, segment_voice, language, target_rate
+                )
+                sample_count = self.tts_cache.copy_to(cache_key, segment_file)
+                if sample_count is not None:
+                    sample_counts[i] = sample_count
+                    if self.debug_output:
+                        print(f"Loaded segment {i} from TTS cache: {text}")
+                    continue
+
+            raw_audio = self._synthesize(text, segment_voice)
+            if not len(raw_audio):
                 if self.debug_output:
                     print(f"Warning: No audio generated for segment {i}. Skipping.")
                 continue
 
-            concat = []
-            for _, _, aseg in audio_segment:
-                # Ensure aseg is a tensor or numpy array
-                if hasattr(aseg, "numpy"):
-                    audio_segment = aseg.numpy()
-                else:
-                    audio_segment = aseg
-                concat.append(audio_segment)
-
-            # Concatenate the segments
-            raw_audio = np.concatenate(concat, axis=0)
-
             # Resample to 44100Hz
-            target_rate = 44100
             new_length = int(
                 len(raw_audio) * target_rate / BrainrotClipGenerator.KOKORO_SAMPLE_RATE
             )
@@ -321,111 +445,291 @@ class BrainrotClipGenerator:
                 resampled_audio = resampled_audio / max_amplitude * 0.8
 
             # Save audio segment directly at 44100Hz
-            segment_file = os.path.join(folder_path, f"segment_{i}.wav")
             sf.write(segment_file, resampled_audio, target_rate)
-            resampled_duration = len(resampled_audio) / target_rate
-
-            # Use resampled duration for timing
-            segment_duration = resampled_duration
-            duration += segment_duration
+            if cache_key is not None:
+                self.tts_cache.store(cache_key, segment_file)
+            sample_counts[i] = len(resampled_audio)
 
-            # create a text clip + run a modifier function if required
-            text_settings_instance = text_clip_settings.copy()
-            if text_clip_modifier:
-                if not callable(text_clip_modifier):
-                    raise ValueError("text_clip_modifier must be a callable function.")
-
-                # call the function
-                text_settings_instance = text_clip_modifier(
-                    text_settings_instance, text, i
+            if self.debug_output:
+                print(
+                    f"Generated segment {i} ({segment_voice}): {text} "
+                    f"({len(resampled_audio) / target_rate:.2f}s) saved to {segment_file}"
                 )
 
-            # generate text clip
-            text_clip = (
-                TextClip(text=text, **text_settings_instance)
-                .with_position(("center", "center"), relative=True)
-                .with_start(duration - segment_duration + self._inter_segment_delay * i)
-                .with_duration(segment_duration)
+        timeline = Timeline(sample_rate=target_rate, gap=self._inter_segment_delay)
+        for i, text in enumerate(texts):
+            if i not in sample_counts:
+                continue
+            timeline.append(
+                text,
+                str(os.path.join(folder_path, f"segment_{i}.wav")),
+                sample_counts[i],
+                voice=voices[i],
+                language=self.language_of(voices[i]),
             )
 
-            # Append segment information
-            segments[i] = {
-                "index": i,
-                "text": text,
-                "file": str(segment_file),
-                "duration": segment_duration,
-                "start_time": duration - segment_duration,
-                "end_time": duration,
-                "kokoro_voice": voice,
-                "kokoro_language": self.kokoro_model.lang_code,
-                "text_clip": text_clip,
-            }
-
-            if self.debug_output:
-                print(
-                    f"Generated segment {i}: {text} ({segment_duration:.2f}s) "
-                    f"saved to {segment_file}"
-                )
         if self.debug_output:
             print(
-                f"Generated {len(segments)} segments with total duration: {duration:.2f}s"
+                f"Generated {len(timeline)} segments with {len(first_use)} voices, "
+                f"total duration: {timeline.total_duration:.2f}s"
             )
 
-        self._video_segments = segments
-        return segments
+        self._set_timeline(timeline, text_clip_settings, text_clip_modifier)
+        return timeline
 
-    def concat_audio_segment_files(
-        self, target_file: str, segments: list = None
-    ) -> float:
-        if segments is None:
-            segments = self._video_segments
+    def _reuse_segments(
+        self, previous: Timeline, folder_path: str, texts: list, voices: list
+    ) -> dict:
+        """
+        Move the files of the segments that did not change since the previous
+        timeline to their new index.
 
-        if not segments:
-            raise ValueError("No segments to concatenate.")
+        :return: Dictionary segment index -> sample count of the reused files.
+        """
+        keys = [
+            (text, voice, self.language_of(voice)) for text, voice in zip(texts, voices)
+        ]
+        matches = match_segments(
+            list(zip(previous.texts, previous.voices, previous.languages)), keys
+        )
+
+        # files are moved through temporary names first, so a file is never
+        # overwritten before it has been moved itself
+        moved = {}
+        for i, j in matches.items():
+            source_file = previous.files[j]
+            segment_file = os.path.join(folder_path, f"segment_{i}.wav")
+            if not os.path.exists(source_file):
+                continue
+            if os.path.abspath(source_file) == os.path.abspath(segment_file):
+                moved[i] = segment_file
+                continue
+            temp_file = f"{segment_file}.reuse.wav"
+            if os.path.dirname(os.path.abspath(source_file)) == os.path.abspath(
+                folder_path
+            ):
+                os.replace(source_file, temp_file)
+            else:
+                shutil.copyfile(source_file, temp_file)
+            moved[i] = temp_file
+
+        sample_counts = {}
+        for i, file in moved.items():
+            segment_file = os.path.join(folder_path, f"segment_{i}.wav")
+            if file != segment_file:
+                os.replace(file, segment_file)
+            sample_counts[i] = sf.info(segment_file).frames
+            if self.debug_output:
+                print(f"Reused segment {i} from previous run: {texts[i]}")
+        return sample_counts
 
-        raw_audio = []
-        target_rate = 44100  # Use 44100Hz consistently
+    def language_of(self, voice: str) -> str:
+        """
+        Kokoro language code a voice is synthesized with.
+        """
+        if self.tts_pool is not None:
+            return voice_language(voice)
+        return self.kokoro_model.lang_code
 
-        # Create silence array for the delay (filled with zeros)
-        silence_samples = int(
-            self._inter_segment_delay * target_rate
-        )  # Use target_rate
-        silence = np.zeros((silence_samples,), dtype=np.float32)
-        duration = 0.0
+    def _segment_voices(self, voice, texts: list) -> list:
+        """
+        One voice per segment from a voice name, a list or a function.
+        """
+        if isinstance(voice, str):
+            return [voice] * len(texts)
+        if callable(voice):
+            return [voice(text, i) for i, text in enumerate(texts)]
+        voices = list(voice)
+        if len(voices) != len(texts):
+            raise ValueError(
+                f"Got {len(voices)} voices for {len(texts)} text segments."
+            )
+        return voices
 
-        for i, segment in segments.items():
-            segment_file = segment["file"]
+    def _synthesize(self, text: str, voice: str) -> np.ndarray:
+        """
+        Raw kokoro audio of one segment, empty if nothing was generated.
+        """
+        if self.tts_pool is not None:
+            return self.tts_pool.synthesize(text, voice)
+
+        # kokoro synthesizes lazily while the results are iterated, so the
+        # lock has to cover the loop
+        concat = []
+        with self.tts_lock:
+            for _, _, aseg in self.kokoro_model(text, voice=voice):
+                # Ensure aseg is a tensor or numpy array
+                if hasattr(aseg, "numpy"):
+                    audio_segment = aseg.numpy()
+                else:
+                    audio_segment = aseg
+                concat.append(audio_segment)
+
+        if not concat:
+            return np.zeros((0,), dtype=np.float32)
+        return np.concatenate(concat, axis=0)
+
+    def load_timeline(
+        self,
+        timeline_data: dict,
+        text_clip_settings: dict = None,
+        text_clip_modifier: callable = None,
+    ) -> Timeline:
+        """
+        Restore the timeline produced by a previous generate_segments() call
+        without running TTS again.
+
+        :param timeline_data: Timeline.to_dict() output, e.g. from a run manifest.
+        :param text_clip_settings: Settings for the text clips.
+        :param text_clip_modifier: Optional modifier, same as generate_segments().
+        :return: The restored timeline.
+        """
+        timeline = Timeline.from_dict(timeline_data)
+        for segment_file in timeline.files:
             if not os.path.exists(segment_file):
-                if self.debug_output:
-                    print(
-                        f"Warning: Segment file {segment_file} does not exist. Skipping."
-                    )
-                continue
+                raise FileNotFoundError(f"Segment file not found: {segment_file}")
 
-            # Load the audio file
-            audio_data, sample_rate = sf.read(segment_file)
-            if sample_rate != target_rate:
-                if self.debug_output:
-                    print(
-                        f"Warning: Sample rate mismatch in segment {i} ({sample_rate}Hz vs {target_rate}Hz)"
-                    )
+        self._generated_text_segments = list(timeline.texts)
+        self._set_timeline(timeline, text_clip_settings, text_clip_modifier)
+        if self.debug_output:
+            print(f"Restored {len(timeline)} segments from previous run.")
+        return timeline
 
-            raw_audio.append(audio_data)
+    def trim_silence(
+        self,
+        padding: float = 0.05,
+        gap: float = None,
+        threshold_db: float = -40.0,
+        timeline: Timeline = None,
+    ) -> dict:
+        """
+        Cut the leading and trailing near-silence kokoro leaves around every
+        segment, found with a short-time energy detector (see source.silence).
+
+        The segment files are not modified, the timeline only uses the speech
+        part of each file, so caption timing and the concatenated audio follow.
+
+        :param padding: Seconds kept before and after the speech of a segment.
+        :param gap: Silence between two segments, defaults to the current
+            inter_segment_delay.
+        :param threshold_db: Speech level relative to the loudest part of a
+            segment.
+        :param timeline: Timeline to trim, defaults to the generated one.
+        :return: Report with the duration before and after, and the seconds
+            and frames saved.
+        """
+        if timeline is None:
+            timeline = self._timeline
+        if timeline is None or not len(timeline):
+            raise ValueError("No segments to trim.")
+
+        duration_before = timeline.total_duration
+        for i, segment_file in enumerate(timeline.files):
+            # bounds are found on the whole file, so trimming again is a no-op
+            audio_data, sample_rate = sf.read(segment_file, dtype="float32")
+            if audio_data.ndim > 1:
+                audio_data = audio_data.mean(axis=1)
+            start, end = speech_bounds(audio_data, sample_rate, threshold_db, padding)
+            timeline.trim(i, start, end - start)
+        if gap is not None:
+            timeline.set_gap(gap)
+
+        duration_after = timeline.total_duration
+        seconds_saved = duration_before - duration_after
+        report = {
+            "duration_before": duration_before,
+            "duration_after": duration_after,
+            "seconds_saved": seconds_saved,
+            "frames_saved": int(round(seconds_saved * self.framerate)),
+        }
+        if self.debug_output:
+            print(
+                f"Trimmed silence: {duration_before:.2f}s -> {duration_after:.2f}s, "
+                f"saved {seconds_saved:.2f}s ({report['frames_saved']} frames)"
+            )
+        return report
 
-            # Add silence after each segment (except the last one)
-            if i < len(segments) - 1:
-                raw_audio.append(silence)
+    def keep_segment_timing(
+        self, previous_timeline: Timeline, timeline: Timeline = None
+    ) -> list:
+        """
+        Keep the captions after an edited segment where they were in the
+        previous timeline: a segment whose new audio is shorter is padded
+        with silence to its previous length (see source.rerender.keep_timing),
+        so rerender() only has to re-encode the edited segment's frames.
+
+        :param previous_timeline: Trimmed timeline of the previous render.
+        :param timeline: Timeline to adjust, defaults to the generated one.
+        :return: Indices of the padded segments.
+        """
+        if timeline is None:
+            timeline = self._timeline
+        if timeline is None or not len(timeline):
+            raise ValueError("No segments to adjust.")
+
+        padded = keep_timing(previous_timeline, timeline)
+        if self.debug_output and padded:
+            print(f"Padded segments {padded} to keep the later captions in place")
+        return padded
+
+    def concat_audio_segment_files(
+        self, target_file: str, timeline: Timeline = None
+    ) -> float:
+        """
+        Write all segment audio files, separated by the inter segment delay,
+        into a single audio file.
+
+        :param target_file: Path of the concatenated audio file.
+        :param timeline: Timeline to concatenate, defaults to the generated one.
+        :return: Duration of the concatenated audio in seconds.
+        """
+        if timeline is None:
+            timeline = self._timeline
+
+        if timeline is None or not len(timeline):
+            raise ValueError("No segments to concatenate.")
+
+        # segments are streamed from disk in blocks and written one after the
+        # other, the gaps (and missing samples) are written as silence, so
+        # memory does not depend on the length of the narration
+        target_rate = timeline.sample_rate
+        counts = timeline.sample_counts
+        written = 0
+
+        with sf.SoundFile(
+            target_file, "w", samplerate=target_rate, channels=1
+        ) as target:
+            for i, segment_file in enumerate(timeline.files):
+                offset = int(timeline.sample_offsets[i])
+                self._write_silence(target, offset - written)
+                written = offset
+                if not os.path.exists(segment_file):
+                    if self.debug_output:
+                        print(
+                            f"Warning: Segment file {segment_file} does not exist. Skipping."
+                        )
+                    continue
+
+                with sf.SoundFile(segment_file) as source:
+                    if source.samplerate != target_rate and self.debug_output:
+                        print(
+                            f"Warning: Sample rate mismatch in segment {i} ({source.samplerate}Hz vs {target_rate}Hz)"
+                        )
+                    source.seek(timeline.trim_starts[i])
+                    for block in source.blocks(
+                        blocksize=AUDIO_BLOCK_SIZE,
+                        frames=int(counts[i]),
+                        dtype="float32",
+                        always_2d=True,
+                    ):
+                        target.write(block.mean(axis=1))
+                        written += len(block)
+            self._write_silence(target, timeline.total_samples - written)
 
-        # Save the concatenated audio with target_rate
-        sf.write(target_file, np.concatenate(raw_audio, axis=0), target_rate)
         if self.debug_output:
             print(f"Saved concatenated audio at {target_rate}Hz")
 
-        # Calculate the total duration
-        duration = (
-            sum(segment["duration"] for segment in segments.values())
-            + (len(segments) - 1) * self._inter_segment_delay
-        )
+        duration = timeline.total_duration
 
         self._concatenated_audio_file = target_file
         self._concatenated_audio_duration = duration
@@ -435,6 +739,29 @@ class BrainrotClipGenerator:
             )
         return duration
 
+    @staticmethod
+    def _write_silence(target: sf.SoundFile, sample_count: int):
+        silence = np.zeros((AUDIO_BLOCK_SIZE,), dtype=np.float32)
+        while sample_count > 0:
+            length = min(sample_count, AUDIO_BLOCK_SIZE)
+            target.write(silence[:length])
+            sample_count -= length
+
+    def load_concatenated_audio(self, audio_file: str, duration: float) -> float:
+        """
+        Restore the concatenated audio produced by a previous
+        concat_audio_segment_files() call.
+
+        :param audio_file: Path to the concatenated audio file.
+        :param duration: Duration of the audio file in seconds.
+        :return: The audio duration.
+        """
+        if not os.path.exists(audio_file):
+            raise FileNotFoundError(f"Audio file not found: {audio_file}")
+        self._concatenated_audio_file = audio_file
+        self._concatenated_audio_duration = duration
+        return duration
+
     # ---------------------------------------------------- #
     # rendering functions
 
@@ -446,26 +773,29 @@ class BrainrotClipGenerator:
         if self._video_clip is None:
             raise ValueError("Video clip not set up. Call setup() first.")
 
-        if not self._video_segments:
+        if self._timeline is None or not len(self._timeline):
             raise ValueError("No segments generated. Call generate_segments() first.")
 
         if self.debug_output:
             print("Rendering video with segments...")
 
-        text_clips = [
-            segment["text_clip"] for key, segment in self._video_segments.items()
-        ]
+        if self.low_memory:
+            composite_clip = StreamingCompositeClip(self._video_clip, self._timeline)
+            self._composite_clip = composite_clip
+            if self.debug_output:
+                print(
+                    f"Streaming composite clip created for {len(self._timeline)} "
+                    f"segments and duration {composite_clip.duration:.2f}s"
+                )
+            return composite_clip
+
+        text_clips = self._timeline.text_clips()
         composite_clip = moviepy.CompositeVideoClip([self._video_clip] + text_clips)
 
-        # add audio to video
-        if self._concatenated_audio_file:
-            audio_clip = moviepy.AudioFileClip(self._concatenated_audio_file)
-            composite_clip = composite_clip.with_audio(audio_clip)
-            if self.debug_output:
-                print("Added audio to video clip.")
-        else:
-            if self.debug_output:
-                print("No audio file found. Video will be silent.")
+        # the narration is not attached to the clip, render() encodes it in a
+        # separate process and muxes it into the finished video
+        if not self._concatenated_audio_file and self.debug_output:
+            print("No audio file found. Video will be silent.")
 
         # return the composite clip
         self._composite_clip = composite_clip
@@ -476,32 +806,253 @@ class BrainrotClipGenerator:
             )
         return composite_clip
 
-    def render(self, output_file: str, **options: dict):
+    def render(self, output_file: str, outputs: list = None, **options: dict):
         """
         Render the composite video clip to a file.
 
+        With `outputs`, the composite is rendered once and every frame is fanned
+        out to one encoder per output spec, so N variants cost about one
+        composite plus N encodes. The other options are defaults of every
+        spec. A spec is a dictionary with:
+
+            file or name   output path, or suffix appended to output_file
+            size           (width, height), center cropped to its aspect ratio
+            crop           optional explicit (x, y, width, height) region
+            codec, preset, bitrate, crf, threads, audio_bitrate, ffmpeg_params
+
+        With an encoder_tuner, preset, crf and threads default to the values
+        tuned for this machine and output profile (benchmarked on this
+        composite the first time); explicitly given values still win.
+
+        The narration is encoded (audio_codec, audio_bitrate, audio_fps) by a
+        separate ffmpeg process while the frames are rendered and muxed in
+        with a stream copy. Its encode is reused as long as the narration is
+        unchanged.
+
         :param output_file: Path to the output video file.
+        :param outputs: Optional list of output specs.
+        :return: List of the written files.
         """
         if self._composite_clip is None:
             raise ValueError(
                 "Composite clip not created. Call composite_clips() first."
             )
-        # Ensure all options are set
-        for key in DEFAULT_RENDER_OPTIONS:
-            if key not in options:
-                options[key] = DEFAULT_RENDER_OPTIONS[key]
+
+        fps = options.get("fps", self.framerate)
+        if outputs:
+            outputs = self._output_specs(output_file, outputs, fps, options)
+            if self.debug_output:
+                print(
+                    f"Rendering composite clip to {len(outputs)} outputs: "
+                    f"{[spec['file'] for spec in outputs]}..."
+                )
+            files = write_video_variants(
+                self._composite_clip,
+                outputs,
+                fps,
+                audio_file=self._concatenated_audio_file or None,
+                debug_output=self.debug_output,
+            )
+            if self.debug_output:
+                print(f"Video rendered successfully to {len(files)} outputs.")
+            return files
+
+        options = self._render_options(options, fps)
         if self.debug_output:
             print(f"Rendering composite clip to {output_file}...")
 
+        audio_encode = None
+        if self._concatenated_audio_file:
+            audio_encode = AudioEncode(
+                self._concatenated_audio_file,
+                options.pop("audio_codec"),
+                options.pop("audio_bitrate"),
+                options.pop("audio_fps"),
+                debug_output=self.debug_output,
+            )
+
         # Write the video file
-        self._composite_clip.write_videofile(output_file, **options)
+        video_file = video_only_file(output_file) if audio_encode else output_file
+        try:
+            self._composite_clip.write_videofile(video_file, audio=False, **options)
+            if audio_encode is not None:
+                mux_audio(video_file, audio_encode.wait(), output_file)
+                os.remove(video_file)
+        finally:
+            if audio_encode is not None:
+                audio_encode.cancel()
         if self.debug_output:
             print(f"Video rendered successfully to {output_file}.")
+        return [output_file]
+
+    def rerender(
+        self,
+        output_file: str,
+        previous_timeline: Timeline,
+        outputs: list = None,
+        max_fraction: float = MAX_SPLICE_FRACTION,
+        **options: dict,
+    ):
+        """
+        Update the files of a previous render() after some segments changed.
+
+        The timeline is diffed against the one the files were rendered from.
+        Only the GOPs (keyframe to keyframe) of every file that contain a
+        changed caption are encoded from the composite, all other GOPs are
+        stream copied from the previous file and the new narration is muxed
+        in (also when no caption changed, the voice may have). Falls back to
+        render() when a file is missing or more than max_fraction of its
+        frames changed.
+
+        The background, caption settings and output options have to be the
+        ones the previous files were rendered with.
+
+        :param output_file: Path of the output video file, see render().
+        :param previous_timeline: Trimmed timeline of the previous render.
+        :param outputs: Optional list of output specs, see render().
+        :param max_fraction: Largest share of re-encoded frames of a file.
+        :return: List of the written files.
+        """
+        if self._composite_clip is None:
+            raise ValueError(
+                "Composite clip not created. Call composite_clips() first."
+            )
+
+        fps = options.get("fps", self.framerate)
+        if outputs:
+            specs = self._output_specs(output_file, outputs, fps, options)
+        else:
+            render_options = self._render_options(dict(options), fps)
+            specs = [
+                {
+                    "file": output_file,
+                    **{
+                        key: render_options[key]
+                        for key in (
+                            "codec",
+                            "preset",
+                            "bitrate",
+                            "threads",
+                            "ffmpeg_params",
+                            "audio_codec",
+                            "audio_bitrate",
+                            "audio_fps",
+                        )
+                        if render_options.get(key) is not None
+                    },
+                }
+            ]
+        if not all(os.path.exists(spec["file"]) for spec in specs):
+            return self.render(output_file, outputs=outputs, **options)
+
+        ranges = changed_ranges(previous_timeline, self._timeline)
+        if self.debug_output:
+            if ranges:
+                print(
+                    f"Changed ranges: {[(round(a, 2), round(b, 2)) for a, b in ranges]}"
+                )
+            else:
+                print("No caption changed since the previous render.")
+
+        audio_encodes = [None] * len(specs)
+        if self._concatenated_audio_file:
+            audio_encodes = start_audio_encodes(
+                self._concatenated_audio_file, specs, self.debug_output
+            )
+
+        try:
+            for spec, audio_encode in zip(specs, audio_encodes):
+                spliced = splice_video(
+                    self._composite_clip,
+                    spec["file"],
+                    spec,
+                    fps,
+                    ranges,
+                    audio_file=audio_encode.wait() if audio_encode else None,
+                    # variants are cut to the narration, a single output is not
+                    shortest=bool(outputs),
+                    max_fraction=max_fraction,
+                    debug_output=self.debug_output,
+                )
+                if not spliced:
+                    return self.render(output_file, outputs=outputs, **options)
+        finally:
+            for audio_encode in audio_encodes:
+                if audio_encode is not None:
+                    audio_encode.cancel()
+        return [spec["file"] for spec in specs]
+
+    def _output_specs(
+        self, output_file: str, outputs: list, fps: float, options: dict = None
+    ) -> list:
+        """
+        Output specs with resolved files and, with an encoder_tuner, the
+        settings tuned for this machine.
+
+        Render options (codec, preset, bitrate, ...) are the defaults of every
+        spec, options that cannot apply to a spec raise ValueError.
+        """
+        options = {key: value for key, value in (options or {}).items() if key != "fps"}
+        unsupported = sorted(set(options) - set(SPEC_OPTION_KEYS))
+        if unsupported:
+            raise ValueError(
+                f"Render options {unsupported} are not supported with outputs, "
+                f"expected {SPEC_OPTION_KEYS}."
+            )
+        outputs = [
+            {**options, **spec, "file": resolve_output_file(output_file, spec)}
+            for spec in outputs
+        ]
+        if self.encoder_tuner is not None:
+            tuned = self.encoder_tuner.tune(self._composite_clip, outputs, fps)
+            outputs = [
+                {**tuned_options(settings), **spec}
+                for settings, spec in zip(tuned, outputs)
+            ]
+        return outputs
+
+    def _render_options(self, options: dict, fps: float) -> dict:
+        """
+        write_videofile() options of a single output render, with the tuned
+        encoder settings and the defaults filled in.
+        """
+        if self.encoder_tuner is not None:
+            fixed = {
+                key: options[key] for key in ("preset", "threads") if key in options
+            }
+            spec = {"codec": options.get("codec", DEFAULT_RENDER_OPTIONS["codec"])}
+            if options.get("bitrate"):
+                # rate controlled by the bitrate, no CRF is tuned on top of it
+                spec["bitrate"] = options["bitrate"]
+            tuned = self.encoder_tuner.tune(
+                self._composite_clip, [{**spec, **fixed}], fps
+            )
+            options.update({**tuned_options(tuned[0]), **fixed})
+            if "crf" in options:
+                # write_videofile() has no crf argument
+                ffmpeg_params = options.get(
+                    "ffmpeg_params", DEFAULT_RENDER_OPTIONS["ffmpeg_params"]
+                )
+                options["ffmpeg_params"] = list(ffmpeg_params) + [
+                    "-crf",
+                    str(options.pop("crf")),
+                ]
+
+        # Ensure all options are set
+        for key in DEFAULT_RENDER_OPTIONS:
+            if key not in options:
+                options[key] = DEFAULT_RENDER_OPTIONS[key]
+        return options
 
-    def cleanup(self):
+    def cleanup(self, keep_files: set = None):
         """
         Clean up resources used by the generator.
+
+        :param keep_files: Paths that must not be deleted, e.g. the artifacts
+            recorded in a run manifest so the next run can reuse them.
         """
+        keep_files = {os.path.abspath(path) for path in (keep_files or ())}
+
         if self._video_clip:
             self._video_clip.close()
             self._video_clip = None
@@ -515,10 +1066,20 @@ class BrainrotClipGenerator:
                 print("Composite clip resources cleaned up.")
 
         # delete generated audio files
-        if self._concatenated_audio_file and os.path.exists(
+        if (
+            self._concatenated_audio_file
+            and os.path.abspath(self._concatenated_audio_file) in keep_files
+        ):
+            if self.debug_output:
+                print(
+                    f"Keeping concatenated audio file: {self._concatenated_audio_file}"
+                )
+        elif self._concatenated_audio_file and os.path.exists(
             self._concatenated_audio_file
         ):
             os.remove(self._concatenated_audio_file)
+            for encoded_file in encoded_audio_files(self._concatenated_audio_file):
+                os.remove(encoded_file)
             if self.debug_output:
                 print(
                     f"Removed concatenated audio file: {self._concatenated_audio_file}"
@@ -527,9 +1088,12 @@ class BrainrotClipGenerator:
             if self.debug_output:
                 print("No concatenated audio file to remove.")
         # delete all segment files
-        for segment in self._video_segments.values():
-            segment_file = segment["file"]
-            if os.path.exists(segment_file):
+        segment_files = self._timeline.files if self._timeline is not None else []
+        for segment_file in segment_files:
+            if os.path.abspath(segment_file) in keep_files:
+                if self.debug_output:
+                    print(f"Keeping segment file: {segment_file}")
+            elif os.path.exists(segment_file):
                 os.remove(segment_file)
                 if self.debug_output:
                     print(f"Removed segment file: {segment_file}")
@@ -538,29 +1102,127 @@ class BrainrotClipGenerator:
                     print(f"Segment file does not exist: {segment_file}")
 
         # Clear segments
-        self._video_segments = {}
+        self._timeline = None
+        self._text_effects = []
         if self.debug_output:
             print("Video segments cleared.")
 
-        print("Cleanup complete. All temporary files removed.")
+        if keep_files:
+            print("Cleanup complete. Temporary files removed, pipeline artifacts kept.")
+        else:
+            print("Cleanup complete. All temporary files removed.")
 
     # ---------------------------------------------------- #
     # misc tools
 
+    def _normalize_text_clip_settings(self, text_clip_settings: dict) -> dict:
+        """
+        Fill in any missing text clip settings with the defaults.
+        """
+        if text_clip_settings is None:
+            text_clip_settings = BrainrotClipGenerator.DEFAULT_TEXT_CLIP_SETTINGS.copy()
+        elif not isinstance(text_clip_settings, dict):
+            raise ValueError(
+                "text_clip_settings must be a dictionary. "
+                "Use BrainrotClipGenerator.DEFAULT_TEXT_CLIP_SETTINGS as a template."
+            )
+
+        for key in BrainrotClipGenerator.DEFAULT_TEXT_CLIP_SETTINGS:
+            if key not in text_clip_settings:
+                text_clip_settings[key] = (
+                    BrainrotClipGenerator.DEFAULT_TEXT_CLIP_SETTINGS[key]
+                )
+        return text_clip_settings
+
+    def _create_text_clip(
+        self,
+        text: str,
+        index: int,
+        start: float,
+        duration: float,
+        text_clip_settings: dict,
+        text_clip_modifier: callable = None,
+    ) -> moviepy.ImageClip:
+        """
+        Create the caption clip for a single segment.
+        """
+        text_settings_instance = text_clip_settings.copy()
+        if text_clip_modifier:
+            if not callable(text_clip_modifier):
+                raise ValueError("text_clip_modifier must be a callable function.")
+
+            # call the function
+            text_settings_instance = text_clip_modifier(
+                text_settings_instance, text, index
+            )
+
+        return (
+            self.caption_renderer.clip(text, text_settings_instance)
+            .with_start(start)
+            .with_duration(duration)
+        )
+
     def apply_text_effect(self, apply_func: callable, **kwargs) -> None:
         """
         Apply a text effect to the video clip.
 
-        :param apply_func: Function to apply the effect.
+        :param apply_func: Function to apply the effect, called as
+            apply_func(segment, **kwargs) and returning the segment. A
+            ScaleEffect (see source.effects) is precomputed at the generator's
+            framerate instead of being evaluated on every frame.
         :param kwargs: Additional arguments for the effect function.
         """
 
         # output a warning if no segments exist
-        if not self._video_segments:
+        if self._timeline is None or not len(self._timeline):
             print("Warning: No video segments available. Cannot apply text effect.")
+            return
         if self.debug_output:
-            print(f"Applying text effect with {apply_func.__name__}...")
+            print(
+                f"Applying text effect with "
+                f"{getattr(apply_func, '__name__', repr(apply_func))}..."
+            )
+
+        # precomputed effects are sampled at the output frame rate
+        if isinstance(apply_func, ScaleEffect):
+            kwargs.setdefault("fps", self.framerate)
+
+        # text clips are created lazily, the effect is applied to every clip
+        # at creation time (see _set_timeline); clips that already exist are
+        # dropped so they get recreated with the effect
+        self._text_effects.append((apply_func, kwargs))
+        for i in range(len(self._timeline)):
+            self._timeline.release_text_clip(i)
 
-        # for all segments generated, apply the text effect
-        for key, val in self._video_segments.items():
-            self._video_segments[key] = apply_func(val, **kwargs)
+    def _set_timeline(
+        self,
+        timeline: Timeline,
+        text_clip_settings: dict = None,
+        text_clip_modifier: callable = None,
+    ):
+        """
+        Use a timeline and create its text clips (with all text effects) on demand.
+        """
+        text_clip_settings = self._normalize_text_clip_settings(text_clip_settings)
+
+        def create_text_clip(timeline: Timeline, index: int) -> moviepy.ImageClip:
+            text_clip = self._create_text_clip(
+                timeline.texts[index],
+                index,
+                float(timeline.starts[index]),
+                float(timeline.durations[index]),
+                text_clip_settings,
+                text_clip_modifier,
+            )
+            if not self._text_effects:
+                return text_clip
+
+            # effects receive the segment as a dictionary, like before
+            timeline.set_text_clip(index, text_clip)
+            segment = timeline.segment(index)
+            for apply_func, kwargs in self._text_effects:
+                segment = apply_func(segment, **kwargs)
+            return segment["text_clip"]
+
+        timeline.set_clip_factory(create_text_clip)
+        self._timeline = timeline
@@ -1,9 +1,21 @@
 SOURCE_BACKGROUND_CLIP = "assets/bgclip1.mp4"
+SOURCE_BACKGROUND_FOLDER = "assets/backgrounds"
+SOURCE_BACKGROUND_INDEX_FILE = "assets/backgrounds/index.json"
 SOURCE_FONT_FILE = "assets/Roboto-Bold.ttf"
 
 TARGET_OUTPUT_FILE = "assets/target_output.mp4"
 TARGET_SEGMENTS_FOLDER = "assets/segments"
 TARGET_SEGMENTS_CONCAT_FILE = "assets/concatenated_audio.wav"
+TARGET_RUN_MANIFEST_FILE = "assets/run_manifest.json"
+TARGET_JOBS_FOLDER = "assets/jobs"
+TARGET_TTS_CACHE_FOLDER = "assets/tts_cache"
+TARGET_PARTS_FOLDER = "assets/parts"
+TARGET_UPLOAD_INDEX_FILE = "assets/uploads.json"
+TARGET_ENCODER_TUNING_FILE = "assets/encoder_tuning.json"
+TARGET_MEDIA_FOLDER = "assets/media"
+
+# longer stories are split into parts of at most this many seconds
+MAX_PART_DURATION = 60.0
 
 # instagram video dimensions
 TARGET_VIDEO_WIDTH = 1080
@@ -24,3 +36,19 @@ DEFAULT_RENDER_OPTIONS = {
         "+faststart",  # Optimize for web streaming
     ],  # Force audio params
 }
+
+# variants rendered from a single composite pass, see BrainrotClipGenerator.render()
+SOCIAL_OUTPUT_VARIANTS = [
+    # 9:16 for reels / shorts
+    {"name": "vertical", "size": (TARGET_VIDEO_WIDTH, TARGET_VIDEO_HEIGHT)},
+    # 1:1 center crop
+    {"name": "square", "size": (TARGET_VIDEO_WIDTH, TARGET_VIDEO_WIDTH)},
+    # low bitrate preview
+    {
+        "name": "preview",
+        "size": (TARGET_VIDEO_WIDTH // 2, TARGET_VIDEO_HEIGHT // 2),
+        "bitrate": "800k",
+        "preset": "veryfast",
+        "audio_bitrate": "64k",
+    },
+]
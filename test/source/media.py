@@ -0,0 +1,363 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import mimetypes
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from source.pipeline import hash_file
+from source.globals import TARGET_VIDEO_WIDTH, TARGET_VIDEO_HEIGHT, TARGET_FRAMERATE
+
+# ---------------------------------------------------------------- #
+
+FFMPEG_BINARY = "ffmpeg"
+INDEX_VERSION = 1
+
+DOWNLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+
+
+class _RangesIgnored(Exception):
+    """
+    A range request was answered with the whole file (200 instead of 206).
+    """
+
+
+class MediaStore:
+    """
+    Downloads media (e.g. the reddit_video of a post) into a content
+    addressed local store.
+
+    Servers that support HTTP ranges are downloaded in chunks by several
+    threads at once; the finished chunks are recorded next to the partial
+    file, so an interrupted download only fetches the missing chunks. Files
+    are stored by the sha256 of their content, so the same media behind
+    different URLs is kept once, and a URL that was downloaded before is not
+    requested again.
+
+    Stored videos are normalized once to the generator's output format
+    (TARGET_VIDEO_WIDTH x TARGET_VIDEO_HEIGHT at TARGET_FRAMERATE, center
+    cropped), so they can be used as backgrounds without scaling at render
+    time.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        max_workers: int = 4,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        timeout: float = 30.0,
+        debug_output=False,
+    ):
+        """
+        :param folder: Folder of the store.
+        :param max_workers: Concurrent range requests (and downloads).
+        :param chunk_size: Bytes per range request.
+        :param timeout: Timeout of a single request in seconds.
+        :param debug_output: If True, will print debug information.
+        """
+        self.folder = folder
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.debug_output = debug_output
+
+        self.index_file = os.path.join(folder, "index.json")
+        self._urls = {}
+        self._lock = threading.Lock()
+        self._url_locks = {}
+        for name in ("objects", "downloads", "normalized"):
+            os.makedirs(os.path.join(folder, name), exist_ok=True)
+        self._load()
+
+    # ---------------------------------------------------- #
+    # public api
+
+    def fetch(self, url: str, normalize: bool = True) -> str:
+        """
+        Download a URL (unless stored already) and optionally normalize it.
+
+        :param url: URL of the media.
+        :param normalize: If True, return the normalized video.
+        :return: Path of the stored (or normalized) file.
+        """
+        stored_file = self.download(url)
+        return self.normalize(stored_file) if normalize else stored_file
+
+    def fetch_many(self, urls: list, normalize: bool = True) -> list:
+        """
+        Fetch several URLs concurrently.
+
+        :return: Paths in the order of urls.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda url: self.fetch(url, normalize), urls))
+
+    def download(self, url: str) -> str:
+        """
+        Download a URL into the store.
+
+        :return: Path of the stored file, named by its content hash.
+        """
+        with self._lock:
+            url_lock = self._url_locks.setdefault(url, threading.Lock())
+        with url_lock:
+            return self._download(url)
+
+    def _download(self, url: str) -> str:
+        entry = self._urls.get(url)
+        if entry and os.path.exists(self.object_path(entry["hash"], entry["ext"])):
+            if self.debug_output:
+                print(f"Media already stored: {url}")
+            return self.object_path(entry["hash"], entry["ext"])
+
+        url_key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:24]
+        part_file = os.path.join(self.folder, "downloads", f"{url_key}.part")
+        info = self._head(url)
+
+        if info["ranges"] and info["size"]:
+            self._download_ranges(url, part_file, info)
+        else:
+            self._download_stream(url, part_file)
+
+        content_hash = hash_file(part_file)
+        ext = self._extension(url, info["content_type"])
+        stored_file = self.object_path(content_hash, ext)
+        os.makedirs(os.path.dirname(stored_file), exist_ok=True)
+        if os.path.exists(stored_file):
+            os.remove(part_file)
+        else:
+            os.replace(part_file, stored_file)
+        state_file = f"{part_file}.json"
+        if os.path.exists(state_file):
+            os.remove(state_file)
+
+        with self._lock:
+            self._urls[url] = {
+                "hash": content_hash,
+                "ext": ext,
+                "size": os.path.getsize(stored_file),
+            }
+            self._save()
+        if self.debug_output:
+            print(f"Stored {url} as {stored_file}")
+        return stored_file
+
+    def normalize(
+        self,
+        stored_file: str,
+        size: tuple = (TARGET_VIDEO_WIDTH, TARGET_VIDEO_HEIGHT),
+        fps: float = TARGET_FRAMERATE,
+    ) -> str:
+        """
+        Convert a stored video to the output format (scaled to cover, center
+        cropped, constant frame rate, no audio). Done once per file and format.
+
+        :return: Path of the normalized video.
+        """
+        width, height = size
+        content_hash = os.path.splitext(os.path.basename(stored_file))[0]
+        normalized_file = os.path.join(
+            self.folder, "normalized", f"{content_hash}_{width}x{height}_{fps}.mp4"
+        )
+        if os.path.exists(normalized_file):
+            return normalized_file
+
+        temp_file = f"{normalized_file}.{threading.get_ident()}.tmp.mp4"
+        subprocess.run(
+            [
+                FFMPEG_BINARY,
+                "-y",
+                "-loglevel",
+                "error",
+                "-i",
+                stored_file,
+                "-an",
+                "-vf",
+                f"scale={width}:{height}:force_original_aspect_ratio=increase,"
+                f"crop={width}:{height},fps={fps},format=yuv420p",
+                "-c:v",
+                "libx264",
+                "-preset",
+                "veryfast",
+                "-crf",
+                "20",
+                "-movflags",
+                "+faststart",
+                temp_file,
+            ],
+            capture_output=True,
+            check=True,
+        )
+        os.replace(temp_file, normalized_file)
+        if self.debug_output:
+            print(f"Normalized {stored_file} to {normalized_file}")
+        return normalized_file
+
+    def add_to_library(self, normalized_file: str, background_library) -> str:
+        """
+        Make a normalized video available as a background clip.
+
+        :param normalized_file: Output of normalize().
+        :param background_library: BackgroundLibrary to add the clip to.
+        :return: Path of the clip in the library folder.
+        """
+        target_file = os.path.join(
+            background_library.folder, os.path.basename(normalized_file)
+        )
+        if not os.path.exists(target_file):
+            try:
+                os.link(normalized_file, target_file)
+            except OSError:
+                shutil.copyfile(normalized_file, target_file)
+        background_library.scan()
+        return target_file
+
+    def object_path(self, content_hash: str, ext: str) -> str:
+        return os.path.join(
+            self.folder, "objects", content_hash[:2], f"{content_hash}{ext}"
+        )
+
+    # ---------------------------------------------------- #
+    # http
+
+    def _open(self, url: str, method: str = "GET", headers: dict = None):
+        request = urllib.request.Request(url, method=method, headers=headers or {})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def _head(self, url: str) -> dict:
+        try:
+            with self._open(url, "HEAD") as response:
+                headers = response.headers
+        except urllib.error.HTTPError:
+            # some servers reject HEAD, the download then streams the body
+            return {"size": None, "ranges": False, "etag": None, "content_type": None}
+        size = headers.get("Content-Length")
+        return {
+            "size": int(size) if size else None,
+            "ranges": headers.get("Accept-Ranges", "").lower() == "bytes",
+            "etag": headers.get("ETag"),
+            "content_type": headers.get("Content-Type"),
+        }
+
+    def _download_stream(self, url: str, part_file: str):
+        with self._open(url) as response, open(part_file, "wb") as f:
+            shutil.copyfileobj(response, f, READ_SIZE)
+            length = response.headers.get("Content-Length")
+            received = f.tell()
+        if length and received != int(length):
+            raise urllib.error.ContentTooShortError(
+                f"Download of {url} ended after {received} of {length} bytes", None
+            )
+
+    def _download_ranges(self, url: str, part_file: str, info: dict):
+        """
+        Download a file as concurrent range requests, resuming the chunks a
+        previous attempt already finished. Falls back to a single stream when
+        the server answers a range request with the whole file.
+        """
+        size = info["size"]
+        state_file = f"{part_file}.json"
+        state = {
+            "url": url,
+            "size": size,
+            "etag": info["etag"],
+            "chunk_size": self.chunk_size,
+            "done": [],
+        }
+        if os.path.exists(state_file) and os.path.exists(part_file):
+            try:
+                with open(state_file, "r") as f:
+                    previous = json.load(f)
+                if all(
+                    previous.get(key) == state[key]
+                    for key in ("url", "size", "etag", "chunk_size")
+                ):
+                    state = previous
+            except (OSError, ValueError):
+                pass
+
+        chunk_count = (size + self.chunk_size - 1) // self.chunk_size
+        done = set(state["done"])
+        missing = [i for i in range(chunk_count) if i not in done]
+        if not done:
+            with open(part_file, "wb") as f:
+                f.truncate(size)
+        if self.debug_output:
+            print(
+                f"Downloading {url}: {len(missing)}/{chunk_count} chunks "
+                f"({size} bytes, {self.max_workers} connections)"
+            )
+
+        state_lock = threading.Lock()
+
+        def download_chunk(index: int):
+            start = index * self.chunk_size
+            end = min(size, start + self.chunk_size) - 1
+            with self._open(url, headers={"Range": f"bytes={start}-{end}"}) as response:
+                if response.status != 206:
+                    raise _RangesIgnored(url)
+                with open(part_file, "r+b") as f:
+                    f.seek(start)
+                    shutil.copyfileobj(response, f, READ_SIZE)
+                    received = f.tell() - start
+            # read() returns short at a dropped connection instead of raising
+            if received != end - start + 1:
+                raise urllib.error.ContentTooShortError(
+                    f"Chunk {index} of {url} ended after {received} of "
+                    f"{end - start + 1} bytes",
+                    None,
+                )
+
+            with state_lock:
+                done.add(index)
+                state["done"] = sorted(done)
+                temp_file = f"{state_file}.tmp"
+                with open(temp_file, "w") as f:
+                    json.dump(state, f)
+                os.replace(temp_file, state_file)
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # list() re-raises the first failed chunk, finished ones are kept
+                list(executor.map(download_chunk, missing))
+        except _RangesIgnored:
+            # HEAD advertised ranges but GET sends the whole file, so start
+            # over from byte 0 as a single stream
+            if self.debug_output:
+                print(f"Server ignored the range requests for {url}, streaming it")
+            if os.path.exists(state_file):
+                os.remove(state_file)
+            self._download_stream(url, part_file)
+
+    @staticmethod
+    def _extension(url: str, content_type: str) -> str:
+        ext = os.path.splitext(urllib.parse.urlparse(url).path)[1]
+        if not ext and content_type:
+            ext = mimetypes.guess_extension(content_type.split(";")[0].strip()) or ""
+        return ext.lower()
+
+    # ---------------------------------------------------- #
+    # persistence
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return
+        try:
+            with open(self.index_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == INDEX_VERSION:
+            self._urls = data.get("urls", {})
+
+    def _save(self):
+        temp_file = f"{self.index_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"version": INDEX_VERSION, "urls": self._urls}, f, indent=2)
+        os.replace(temp_file, self.index_file)
@@ -0,0 +1,318 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from source.pipeline import RunManifest
+from source.generator import BrainrotClipGenerator
+from source.stages import build_video_pipeline
+
+# ---------------------------------------------------------------- #
+
+# narration speed used before a segment has been synthesized
+WORDS_PER_SECOND = 2.5
+SENTENCE_END = re.compile(r"[.?!][\"')\]]*$")
+# plans made with measured durations before render_parts() gives up
+MAX_PLAN_ATTEMPTS = 3
+
+
+def part_card(index: int, count: int) -> str:
+    """
+    Text of the card segment every part starts with, index is 1-based.
+    """
+    return f"Part {index} of {count}."
+
+
+def estimate_duration(text: str, words_per_second: float = WORDS_PER_SECOND) -> float:
+    return max(1, len(text.split())) / words_per_second
+
+
+def plan_parts(
+    segments: list,
+    max_duration: float,
+    duration_of: callable = estimate_duration,
+    gap: float = 0.1,
+    add_cards: bool = True,
+) -> list:
+    """
+    Pack consecutive text segments into parts of at most max_duration seconds.
+
+    Parts end at a sentence boundary when possible; only a sentence that does
+    not fit into a part on its own is cut at a segment boundary. The card
+    ("Part 1 of 3.") counts towards the duration of its part.
+
+    :param segments: Output of split_text_into_segments().
+    :param max_duration: Maximum narration length of one part in seconds.
+    :param duration_of: Function returning the duration of one segment text.
+    :param gap: Silence between two segments in seconds.
+    :param add_cards: If True, every part starts with a part card.
+    :return: List of parts, each a list of segment texts (including the card).
+    """
+    if not segments:
+        return []
+
+    durations = [duration_of(text) for text in segments]
+    # sentences as (first, last) segment index, a sentence ends at .?!
+    sentences = []
+    first = 0
+    for i, text in enumerate(segments):
+        if SENTENCE_END.search(text) or i == len(segments) - 1:
+            sentences.append((first, i))
+            first = i + 1
+
+    # the card text depends on the part count, which depends on the packing,
+    # so repeat until the count is stable (it almost always is after one pass)
+    count = 1
+    for _ in range(5):
+        card_duration = duration_of(part_card(count, count)) + gap if add_cards else 0.0
+        budget = max_duration - card_duration
+        if budget <= 0:
+            raise ValueError(
+                f"max_duration {max_duration:.2f}s is too short for the part card."
+            )
+
+        parts = []
+        current, current_duration = [], 0.0
+
+        def close():
+            nonlocal current, current_duration
+            if current:
+                parts.append(current)
+            current, current_duration = [], 0.0
+
+        for first, last in sentences:
+            sentence = list(range(first, last + 1))
+            length = sum(durations[i] + gap for i in sentence) - gap
+            if current and current_duration + gap + length <= budget:
+                current += sentence
+                current_duration += gap + length
+                continue
+            close()
+            if length <= budget:
+                current, current_duration = sentence, length
+                continue
+
+            # a single sentence longer than a part, cut between its segments
+            for i in sentence:
+                extra = durations[i] + (gap if current else 0.0)
+                if current and current_duration + extra > budget:
+                    close()
+                    extra = durations[i]
+                current.append(i)
+                current_duration += extra
+        close()
+
+        if len(parts) == count or not add_cards:
+            break
+        count = len(parts)
+
+    if not add_cards:
+        return [[segments[i] for i in part] for part in parts]
+    return [
+        [part_card(index + 1, len(parts))] + [segments[i] for i in part]
+        for index, part in enumerate(parts)
+    ]
+
+
+# ---------------------------------------------------------------- #
+
+
+def _part_generator(generator: BrainrotClipGenerator) -> BrainrotClipGenerator:
+    """
+    Independent generator for one part, sharing the kokoro model (or pool),
+    its lock, the TTS cache and the glyph atlases of the template generator.
+    """
+    return BrainrotClipGenerator(
+        video_text="",
+        video_file=generator.video_file,
+        kokoro_model=generator.kokoro_model,
+        debug_output=generator.debug_output,
+        framerate=generator.framerate,
+        inter_segment_delay=generator._inter_segment_delay,
+        video_start=generator.video_start,
+        tts_cache=generator.tts_cache,
+        tts_lock=generator.tts_lock,
+        tts_pool=generator.tts_pool,
+        encoder_tuner=generator.encoder_tuner,
+        caption_renderer=generator.caption_renderer,
+        low_memory=generator.low_memory,
+    )
+
+
+def render_parts(
+    generator: BrainrotClipGenerator,
+    parts_folder: str,
+    output_file: str,
+    voice,
+    max_duration: float,
+    max_workers: int = None,
+    source_text: str = None,
+    reddit_scraper=None,
+    subreddit_name: str = None,
+    post_index: int = 0,
+    post_id: str = None,
+    text_cleaner: callable = None,
+    max_words: int = 10,
+    max_chars: int = 1e9,
+    add_cards: bool = True,
+    progress_callback: callable = None,
+    **pipeline_options,
+) -> list:
+    """
+    Split a story into parts of at most max_duration seconds and render every
+    part as an independent pipeline, all parts concurrently.
+
+    The text is fetched, cleaned and split once. Each part then gets its own
+    generator, run manifest and segment folder below parts_folder, so parts
+    resume independently. Parts share the kokoro model (synthesis is
+    serialized on the generator's tts_lock), the TTS cache and any
+    background_library passed in pipeline_options.
+
+    The plan is based on estimated durations. Once every part is synthesized
+    the real durations are checked, and if a part came out too long the story
+    is planned again with the measured durations; segments synthesized before
+    come from the TTS cache, so this costs no extra TTS. If a part is still
+    too long after MAX_PLAN_ATTEMPTS plans, ValueError is raised.
+
+    With partial_rerender in pipeline_options, a part whose text was edited
+    since the last run only re-encodes the GOPs of its changed captions.
+
+    :param generator: Template generator, its settings are used for every part.
+    :param parts_folder: Folder for the per part manifests and audio.
+    :param output_file: Output path, parts are written as "<name>_part<N>.<ext>".
+    :param voice: Kokoro voice, or voice(text, index), see build_video_pipeline().
+    :param max_duration: Maximum narration length of one part in seconds.
+    :param max_workers: Number of parts rendered at the same time.
+    :param add_cards: If True, every part starts with "Part N of M.".
+    :param progress_callback: Called with (part_index, stage_name, status).
+    :param pipeline_options: Extra arguments for build_video_pipeline().
+    :return: One dictionary per part with index, segments, duration and files.
+    """
+    if not os.path.exists(parts_folder):
+        os.makedirs(parts_folder)
+
+    # fetch -> clean -> segment (and the post's media), once for the whole story
+    media_store = pipeline_options.pop("media_store", None)
+    story = build_video_pipeline(
+        generator,
+        RunManifest(os.path.join(parts_folder, "story_manifest.json")),
+        segments_folder=os.path.join(parts_folder, "story"),
+        concat_file=os.path.join(parts_folder, "story.wav"),
+        output_file=output_file,
+        voice=voice,
+        source_text=source_text,
+        reddit_scraper=reddit_scraper,
+        subreddit_name=subreddit_name,
+        post_index=post_index,
+        post_id=post_id,
+        text_cleaner=text_cleaner,
+        max_words=max_words,
+        max_chars=max_chars,
+        background_library=pipeline_options.get("background_library"),
+        media_store=media_store,
+    )
+    segments = story.run(target="segment")["segments"]
+    if "media" in story.stage_names():
+        story.run(target="media")
+
+    gap = generator._inter_segment_delay
+    base, ext = os.path.splitext(output_file)
+
+    def duration_of(text: str) -> float:
+        # measured duration if the segment was synthesized before
+        if generator.tts_cache is not None and isinstance(voice, str):
+            key = generator.tts_cache.key(
+                text,
+                voice,
+                generator.language_of(voice),
+                BrainrotClipGenerator.OUTPUT_SAMPLE_RATE,
+            )
+            sample_count = generator.tts_cache.sample_count(key)
+            if sample_count is not None:
+                return sample_count / BrainrotClipGenerator.OUTPUT_SAMPLE_RATE
+        return estimate_duration(text)
+
+    def build_part(index: int, part_segments: list, attempt: int) -> dict:
+        part_folder = os.path.join(parts_folder, f"part_{index + 1}")
+        part_generator = _part_generator(generator)
+        callback = None
+        if progress_callback is not None:
+            callback = lambda stage, status: progress_callback(index, stage, status)
+        options = dict(pipeline_options)
+        if attempt > 0:
+            # the manifest now holds the rejected plan of this run, keeping
+            # its segment timing would make the parts too long again
+            options["partial_rerender"] = False
+
+        pipeline = build_video_pipeline(
+            part_generator,
+            RunManifest(os.path.join(part_folder, "run_manifest.json")),
+            segments_folder=os.path.join(part_folder, "segments"),
+            concat_file=os.path.join(part_folder, "audio.wav"),
+            output_file=f"{base}_part{index + 1}{ext or '.mp4'}",
+            voice=voice,
+            # one segment per line, split_text_into_segments() keeps them as is
+            source_text="\n".join(part_segments),
+            max_words=max_words,
+            max_chars=max_chars,
+            progress_callback=callback,
+            **options,
+        )
+        return {
+            "index": index + 1,
+            "segments": part_segments,
+            "generator": part_generator,
+            "pipeline": pipeline,
+        }
+
+    def run_all(parts: list, target: str = None) -> list:
+        with ThreadPoolExecutor(max_workers=max_workers or len(parts)) as executor:
+            return list(
+                executor.map(lambda part: part["pipeline"].run(target=target), parts)
+            )
+
+    parts = []
+    for attempt in range(MAX_PLAN_ATTEMPTS):
+        plan = plan_parts(segments, max_duration, duration_of, gap, add_cards)
+        if generator.debug_output:
+            print(f"Planned {len(plan)} parts (max {max_duration:.1f}s each).")
+
+        parts = [build_part(index, part, attempt) for index, part in enumerate(plan)]
+        concats = run_all(parts, target="concat")
+        for part, concat in zip(parts, concats):
+            part["duration"] = concat["duration"]
+
+        too_long = [part for part in parts if part["duration"] > max_duration]
+        if not too_long:
+            break
+        for part in parts:
+            part["generator"].cleanup()
+        if attempt == MAX_PLAN_ATTEMPTS - 1:
+            raise ValueError(
+                ", ".join(
+                    f"Part {part['index']} is {part['duration']:.2f}s long"
+                    for part in too_long
+                )
+                + f", more than max_duration {max_duration:.2f}s after "
+                f"{MAX_PLAN_ATTEMPTS} plans (a single segment may be too long)."
+            )
+        if generator.debug_output:
+            print(
+                f"Parts {[part['index'] for part in too_long]} exceed "
+                f"{max_duration:.1f}s, planning again with measured durations..."
+            )
+
+    try:
+        renders = run_all(parts)
+    finally:
+        for part in parts:
+            part["generator"].cleanup(keep_files=part["pipeline"].manifest.artifacts())
+
+    return [
+        {
+            "index": part["index"],
+            "segments": part["segments"],
+            "duration": part["duration"],
+            "files": render["files"],
+        }
+        for part, render in zip(parts, renders)
+    ]
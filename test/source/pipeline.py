@@ -0,0 +1,362 @@
+import os
+import json
+import time
+import hashlib
+import inspect
+
+# ---------------------------------------------------------------- #
+
+MANIFEST_VERSION = 1
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_value(value) -> str:
+    """
+    Create a stable content hash for a JSON-serializable value.
+
+    :param value: Value to hash (dicts are hashed with sorted keys).
+    :return: Hex sha256 digest.
+    """
+    encoded = json.dumps(value, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Create a content hash for a file, reading it in chunks.
+
+    :param file_path: Path to the file.
+    :return: Hex sha256 digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ---------------------------------------------------------------- #
+
+
+class RunManifest:
+    """
+    Persistent record of every completed pipeline stage.
+
+    Each entry stores the input key the stage was run with, its JSON result,
+    and the files it produced (with size, mtime and content hash) so reruns
+    can tell whether the stored output is still valid.
+    """
+
+    def __init__(self, manifest_file: str):
+        self.manifest_file = manifest_file
+        self._stages = {}
+        self.load()
+
+    # ---------------------------------------------------- #
+
+    def load(self):
+        """
+        Load the manifest from disk. A missing or unreadable manifest starts empty.
+        """
+        self._stages = {}
+        if not os.path.exists(self.manifest_file):
+            return
+        try:
+            with open(self.manifest_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == MANIFEST_VERSION:
+            self._stages = data.get("stages", {})
+
+    def save(self):
+        """
+        Write the manifest atomically so a crash never leaves a half-written file.
+        """
+        folder = os.path.dirname(self.manifest_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        temp_file = self.manifest_file + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(
+                {"version": MANIFEST_VERSION, "stages": self._stages}, f, indent=2
+            )
+        os.replace(temp_file, self.manifest_file)
+
+    # ---------------------------------------------------- #
+
+    def get(self, stage_name: str) -> dict:
+        return self._stages.get(stage_name)
+
+    def record(self, stage_name: str, key: str, result, artifacts: list):
+        """
+        Record a completed stage and persist the manifest immediately.
+
+        :param stage_name: Name of the stage.
+        :param key: Hash of the stage inputs.
+        :param result: JSON-serializable stage result.
+        :param artifacts: List of file paths produced by the stage.
+        """
+        self._stages[stage_name] = {
+            "key": key,
+            # round trip so the stored result matches what a later run loads
+            "result": json.loads(json.dumps(result)),
+            "artifacts": {path: self._describe_file(path) for path in artifacts},
+            "completed_at": time.time(),
+        }
+        self.save()
+
+    def invalidate(self, stage_name: str = None):
+        """
+        Forget a single stage, or every stage if no name is given.
+        """
+        if stage_name is None:
+            self._stages = {}
+        else:
+            self._stages.pop(stage_name, None)
+        self.save()
+
+    def is_valid(self, stage_name: str, key: str) -> bool:
+        """
+        Check whether a recorded stage matches the given key and its artifacts
+        are still on disk and unchanged.
+        """
+        entry = self._stages.get(stage_name)
+        if entry is None or entry["key"] != key:
+            return False
+
+        touched = False
+        for path, info in entry["artifacts"].items():
+            if not os.path.exists(path):
+                return False
+            stat = os.stat(path)
+            if stat.st_size == info["size"] and stat.st_mtime == info["mtime"]:
+                continue
+            # file was touched, only trust it if the content is identical
+            if stat.st_size != info["size"] or hash_file(path) != info["sha256"]:
+                return False
+            info["mtime"] = stat.st_mtime
+            touched = True
+        if touched:
+            # remember the new mtime so the file is not hashed on every run
+            self.save()
+        return True
+
+    def artifacts(self) -> set:
+        """
+        Every file currently owned by a recorded stage.
+        """
+        return {path for entry in self._stages.values() for path in entry["artifacts"]}
+
+    def result_digest(self, stage_name: str) -> str:
+        """
+        Content hash of a stage's output: its result plus the hashes of its files.
+        """
+        entry = self._stages[stage_name]
+        return hash_value(
+            {
+                "result": entry["result"],
+                "artifacts": {
+                    path: info["sha256"] for path, info in entry["artifacts"].items()
+                },
+            }
+        )
+
+    # ---------------------------------------------------- #
+
+    @staticmethod
+    def _describe_file(path: str) -> dict:
+        stat = os.stat(path)
+        return {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha256": hash_file(path),
+        }
+
+
+# ---------------------------------------------------------------- #
+
+
+class PipelineStage:
+    """
+    A single named step of the video pipeline.
+
+    :param name: Unique stage name.
+    :param run: Callable receiving the results of its dependencies as keyword
+        arguments (by stage name) and returning the stage result.
+    :param depends_on: Names of the stages whose results this stage consumes.
+    :param params: JSON-serializable settings that affect the stage output.
+    :param artifacts: Callable mapping the stage result to the list of files
+        it produced. Only used for cacheable stages.
+    :param cacheable: If False the stage result is an in-memory object which is
+        never stored; the stage runs whenever a downstream stage has to run.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run: callable,
+        depends_on: list = None,
+        params: dict = None,
+        artifacts: callable = None,
+        cacheable: bool = True,
+    ):
+        self.name = name
+        self.run = run
+        self.depends_on = list(depends_on or [])
+        self.params = params or {}
+        self.artifacts = artifacts
+        self.cacheable = cacheable
+
+
+class Pipeline:
+    """
+    Build-system style runner for pipeline stages.
+
+    A stage is keyed by a hash of its params and the output digests of the
+    stages it depends on. When the manifest holds a valid entry for that key
+    the stored result is reused and the stage (and everything only it needs)
+    is skipped, so a crashed run resumes at the first stage that did not finish.
+    """
+
+    def __init__(
+        self,
+        manifest: RunManifest,
+        debug_output=False,
+        progress_callback: callable = None,
+    ):
+        """
+        :param manifest: Manifest holding the outputs of previous runs.
+        :param debug_output: If True, will print debug information.
+        :param progress_callback: Optional function called as
+            progress_callback(stage_name, status) with status being one of
+            "running", "skipped" or "finished".
+        """
+        self.manifest = manifest
+        self.debug_output = debug_output
+        self.progress_callback = progress_callback
+        self._stages = {}
+        self._results = {}
+        self._keys = {}
+        self.executed = []
+        self.skipped = []
+
+    # ---------------------------------------------------- #
+
+    def add_stage(self, stage: PipelineStage) -> PipelineStage:
+        for dependency in stage.depends_on:
+            if dependency not in self._stages:
+                raise ValueError(
+                    f"Stage '{stage.name}' depends on unknown stage '{dependency}'."
+                )
+        if stage.name in self._stages:
+            raise ValueError(f"Stage '{stage.name}' already exists.")
+        self._stages[stage.name] = stage
+        return stage
+
+    def run(self, target: str = None):
+        """
+        Resolve a stage (by default the last one added) and everything it needs.
+
+        :param target: Name of the stage to resolve.
+        :return: Result of the target stage.
+        """
+        if not self._stages:
+            raise ValueError("Pipeline has no stages.")
+        if target is None:
+            target = list(self._stages)[-1]
+        return self.resolve(target)
+
+    def resolve(self, name: str):
+        """
+        Return the result of a stage, running it only if its stored output is stale.
+        """
+        if name in self._results:
+            return self._results[name]
+
+        stage = self._stages[name]
+        key = self.key(name)
+        if stage.cacheable and self.manifest.is_valid(name, key):
+            if self.debug_output:
+                print(f"[pipeline] {name}: up to date, skipping.")
+            self.skipped.append(name)
+            self._notify(name, "skipped")
+            self._results[name] = self.manifest.get(name)["result"]
+            return self._results[name]
+
+        inputs = {
+            dependency: self.resolve(dependency) for dependency in stage.depends_on
+        }
+        if self.debug_output:
+            print(f"[pipeline] {name}: running...")
+        self._notify(name, "running")
+        start = time.time()
+        result = stage.run(**inputs)
+        if stage.cacheable:
+            artifacts = stage.artifacts(result) if stage.artifacts else []
+            self.manifest.record(name, key, result, artifacts)
+            result = self.manifest.get(name)["result"]
+        if self.debug_output:
+            print(f"[pipeline] {name}: finished in {time.time() - start:.2f}s")
+
+        self.executed.append(name)
+        self._notify(name, "finished")
+        self._results[name] = result
+        return result
+
+    def stage_names(self) -> list:
+        return list(self._stages)
+
+    def key(self, name: str) -> str:
+        """
+        Hash of everything a stage's output depends on.
+
+        Cacheable dependencies contribute the digest of their actual output, so an
+        upstream stage that reran but produced identical content does not
+        invalidate anything downstream. In-memory dependencies contribute their
+        own key instead, which means they never need to run just to be hashed.
+        """
+        if name in self._keys:
+            return self._keys[name]
+
+        stage = self._stages[name]
+        dependencies = {}
+        for dependency in stage.depends_on:
+            if self._stages[dependency].cacheable:
+                self.resolve(dependency)
+                dependencies[dependency] = self.manifest.result_digest(dependency)
+            else:
+                dependencies[dependency] = self.key(dependency)
+
+        self._keys[name] = hash_value(
+            {"stage": name, "params": stage.params, "dependencies": dependencies}
+        )
+        return self._keys[name]
+
+    def _notify(self, name: str, status: str):
+        if self.progress_callback is not None:
+            self.progress_callback(name, status)
+
+
+# ---------------------------------------------------------------- #
+
+
+def fingerprint_callable(func: callable) -> str:
+    """
+    Hash a callable by its source so editing an effect or modifier function
+    invalidates the stages that use it.
+
+    :param func: Function to fingerprint (None is allowed).
+    :return: Hex sha256 digest, or None.
+    """
+    if func is None:
+        return None
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        # builtins and functions defined in an interactive session
+        code = getattr(func, "__code__", None)
+        source = [code.co_code.hex(), repr(code.co_consts)] if code else repr(func)
+    return hash_value(
+        {"name": getattr(func, "__qualname__", repr(func)), "source": source}
+    )
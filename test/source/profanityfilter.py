@@ -5,6 +5,8 @@ from dotenv import load_dotenv
 from typing import List, Union, Dict
 import mimetypes
 
+from source.filetransfer import GeminiFileTransfer
+from source.globals import TARGET_UPLOAD_INDEX_FILE
 
 # -------------------------------------------------------------------- #
 
@@ -26,17 +28,26 @@ def init_genai():
 
 
 class GeminiModel:
-    def __init__(self, model_name: str):
+    def __init__(self, model_name: str, file_transfer: GeminiFileTransfer = None):
+        """
+        :param model_name: Gemini model to use.
+        :param file_transfer: Upload layer for files sent with prompts, by
+            default uploads are indexed in TARGET_UPLOAD_INDEX_FILE.
+        """
         self.model = genai.GenerativeModel(model_name)
+        self.file_transfer = file_transfer
 
     # -------------------------------------------------------------------- #
 
     def _prepare_file(self, file_path: str) -> Dict:
         """
-        Prepare a file for sending to Gemini by determining mime type and reading binary data.
+        Prepare a file for sending to Gemini by uploading it (streamed, in
+        chunks) and referencing the uploaded file.
+
+        Files whose content was uploaded before are not sent again.
 
         :param file_path: Path to the file
-        :return: Dictionary with mime_type and data
+        :return: Dictionary with the file_data part
         """
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File not found: {file_path}")
@@ -47,11 +58,14 @@ class GeminiModel:
             # Default to binary if we can't determine the type
             mime_type = "application/octet-stream"
 
-        # Read file as binary
-        with open(file_path, "rb") as f:
-            data = f.read()
+        if self.file_transfer is None:
+            self.file_transfer = GeminiFileTransfer(TARGET_UPLOAD_INDEX_FILE)
+        remote = self.file_transfer.upload(file_path, mime_type)
+        remote = self.file_transfer.wait_until_active(remote)
 
-        return {"mime_type": mime_type, "data": data}
+        return {
+            "file_data": {"mime_type": remote["mime_type"], "file_uri": remote["uri"]}
+        }
 
     # -------------------------------------------------------------------- #
 
@@ -76,8 +90,8 @@ class GeminiModel:
             except Exception as e:
                 print(f"Warning: Failed to process file {file_path}: {e}")
 
-        # Send prompt with files
-        return self.model.generate_content(prompt, files=prepared_files)
+        # Send prompt with files, as parts of the same content
+        return self.model.generate_content([prompt] + prepared_files)
 
 
 # -------------------------------------------------------------------- #
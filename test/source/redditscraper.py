@@ -1,8 +1,12 @@
 # change cwd to base directory of repo
 import os
 import sys
+import time
+import heapq
+from collections import OrderedDict
 from pathlib import Path
 import praw
+from praw.models import MoreComments
 
 from dotenv import load_dotenv
 
@@ -11,14 +15,34 @@ load_dotenv()
 # ---------------------------------------------------------------- #
 
 
+COMMENT_SORT = "top"
+SKIPPED_COMMENT_BODIES = ("[deleted]", "[removed]")
+
+
 class RedditScraperBot:
-    def __init__(self, client_id: str, client_secret: str, user_agent: str, **kwargs):
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        user_agent: str,
+        comment_cache_size: int = 32,
+        comment_cache_ttl: float = 600.0,
+        **kwargs,
+    ):
+        """
+        :param comment_cache_size: Number of posts whose comment pages are kept.
+        :param comment_cache_ttl: Seconds after which cached comment pages are
+            fetched again.
+        """
         self.client = praw.Reddit(
             client_id=client_id,
             client_secret=client_secret,
             user_agent=user_agent,
             **kwargs,
         )
+        self.comment_cache_size = comment_cache_size
+        self.comment_cache_ttl = comment_cache_ttl
+        self._comment_pages = OrderedDict()
 
     # ---------------------------------------------------------------- #
 
@@ -53,6 +77,14 @@ class RedditScraperBot:
         subreddit = self.client.subreddit(subreddit_name)
         return list(subreddit.hot(limit=limit))
 
+    def get_post(self, post_id: str):
+        """
+        Fetches a single post by its ID.
+        :param post_id: ID of the post (e.g. "1abcde").
+        :return: The post.
+        """
+        return self.client.submission(id=post_id)
+
     # ---------------------------------------------------------------- #
 
     def extract_post_details(self, post):
@@ -70,16 +102,180 @@ class RedditScraperBot:
             "num_comments": post.num_comments,
         }
 
-    def extract_post_comments(self, post, limit: int = 10):
+    def extract_post_comments(self, post, limit: int = 10, **kwargs):
         """
-        Extracts comments from a Reddit post.
+        Extracts the highest scored comments from a Reddit post.
         :param post: A Reddit post object.
         :param limit: Number of comments to fetch.
-        :return: List of comments.
+        :param kwargs: Cutoffs passed to get_top_comments().
+        :return: List of comment bodies, highest score first.
+        """
+        return [
+            comment["body"] for comment in self.get_top_comments(post, limit, **kwargs)
+        ]
+
+    def get_top_comments(
+        self,
+        post,
+        limit: int = 10,
+        max_depth: int = 1,
+        min_score: int = None,
+        max_more: int = 0,
+        max_visited: int = 500,
+    ) -> list:
+        """
+        Finds the top comments of a post by score without flattening the tree.
+
+        The comment forest is walked lazily and the best `limit` comments are
+        kept in a bounded min-heap. Comments are fetched sorted by score, so
+        once a comment on the deepest visited level cannot beat the heap's
+        minimum, the rest of its siblings are skipped. A reply can outscore
+        its parent, so the replies of a low comment are still visited. The
+        walk stops after max_visited comments.
+        :param post: A Reddit post object.
+        :param limit: Number of comments to return.
+        :param max_depth: Deepest reply level visited (0 = top level only).
+        :param min_score: Comments below this score are skipped.
+        :param max_more: "Load more comments" pages that may be fetched.
+        :param max_visited: Maximum number of comments looked at.
+        :return: List of comment dictionaries, highest score first.
+        """
+        heap = []
+
+        def threshold():
+            if len(heap) >= limit:
+                # a comment has to beat the lowest kept score
+                return heap[0][0] + 1
+            return min_score
+
+        for order, comment in enumerate(
+            self.stream_comments(
+                post, max_depth, min_score, max_more, max_visited, threshold
+            )
+        ):
+            entry = (comment["score"], -order, comment)
+            if len(heap) < limit:
+                heapq.heappush(heap, entry)
+            else:
+                heapq.heappushpop(heap, entry)
+
+        return [entry[2] for entry in sorted(heap, reverse=True)]
+
+    def stream_comments(
+        self,
+        post,
+        max_depth: int = 1,
+        min_score: int = None,
+        max_more: int = 0,
+        max_visited: int = None,
+        threshold: callable = None,
+    ):
         """
-        post.comments.replace_more(limit=0)
-        comments = post.comments.list()
-        return [comment.body for comment in comments[:limit]]
+        Lazily walks the comment forest of a post, depth first.
+
+        Nothing is flattened: replies are only visited down to max_depth, and
+        "load more comments" stubs are only expanded (one API call each) while
+        max_more allows it. Fetched pages are cached per post.
+        :param post: A Reddit post object.
+        :param max_depth: Deepest reply level visited (0 = top level only).
+        :param min_score: Comments below this score are skipped, their
+            replies are still visited.
+        :param max_more: "Load more comments" pages that may be fetched.
+        :param max_visited: Stop after this many comments.
+        :param threshold: Optional function returning the current minimum
+            score, replaces min_score while walking.
+        :return: Generator of comment dictionaries.
+        """
+        pages = self._get_comment_pages(post)
+        stack = [(0, iter(pages["root"]))]
+        visited = 0
+        more_left = max_more
+
+        while stack:
+            depth, siblings = stack[-1]
+            item = next(siblings, None)
+            if item is None:
+                stack.pop()
+                continue
+
+            if isinstance(item, MoreComments):
+                if more_left > 0:
+                    more_left -= 1
+                    stack.append((depth, iter(self._expand_more(pages, item))))
+                continue
+
+            cutoff = threshold() if threshold is not None else min_score
+            qualifies = cutoff is None or item.score >= cutoff
+            if not qualifies and depth >= max_depth:
+                # siblings are in score order (COMMENT_SORT) and their replies
+                # are not visited, none of the rest qualify
+                stack.pop()
+                continue
+
+            visited += 1
+            if (
+                qualifies
+                and item.body not in SKIPPED_COMMENT_BODIES
+                and not item.stickied
+            ):
+                yield {
+                    "id": item.id,
+                    "author": str(item.author),
+                    "body": item.body,
+                    "score": item.score,
+                    "depth": depth,
+                }
+            if max_visited is not None and visited >= max_visited:
+                return
+            if depth < max_depth:
+                stack.append((depth + 1, iter(self._get_replies(pages, item))))
+
+    def _get_comment_pages(self, post) -> dict:
+        """
+        Cached comment pages of a post, the first page is fetched on demand.
+        """
+        pages = self._comment_pages.get(post.id)
+        if (
+            pages is not None
+            and time.time() - pages["fetched_at"] < self.comment_cache_ttl
+        ):
+            self._comment_pages.move_to_end(post.id)
+            return pages
+
+        # a new submission every time: the sort only applies before the
+        # comments are loaded, and a refetch after the TTL must not reuse the
+        # forest the given post object already holds
+        submission = self.client.submission(id=post.id)
+        submission.comment_sort = COMMENT_SORT
+        pages = {
+            "root": list(submission.comments),
+            # replies of comments that came from expanded "load more" pages
+            "children": {},
+            "fetched_at": time.time(),
+        }
+        self._comment_pages[post.id] = pages
+        while len(self._comment_pages) > self.comment_cache_size:
+            self._comment_pages.popitem(last=False)
+        return pages
+
+    def _expand_more(self, pages: dict, more: MoreComments) -> list:
+        """
+        Comments of a "load more comments" stub, fetched once per cached post.
+        """
+        comments = more.comments()
+        by_parent = {}
+        for comment in comments:
+            if isinstance(comment, MoreComments):
+                continue
+            by_parent.setdefault(comment.parent_id, []).append(comment)
+        for parent_id, replies in by_parent.items():
+            if parent_id != more.parent_id:
+                pages["children"].setdefault(parent_id, replies)
+        return by_parent.get(more.parent_id, [])
+
+    def _get_replies(self, pages: dict, comment) -> list:
+        replies = list(comment.replies)
+        return replies or pages["children"].get(comment.fullname, [])
 
     def extract_post_media(self, post):
         """
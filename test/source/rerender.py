@@ -0,0 +1,349 @@
+import os
+import shutil
+import difflib
+import subprocess
+
+import numpy as np
+
+from source.timeline import Timeline
+from source.backgrounds import probe_video
+from source.encoder import mux_audio, video_only_file, write_video_variants
+
+# ---------------------------------------------------------------- #
+
+FFMPEG_BINARY = "ffmpeg"
+
+# above this share of re-encoded frames a full render is about as fast
+MAX_SPLICE_FRACTION = 0.5
+
+# a replaced segment is only padded when it is an edit of the old text (a
+# fixed typo), not a different sentence that happens to take its place
+MIN_TEXT_SIMILARITY = 0.6
+
+
+def match_segments(previous: list, current: list) -> dict:
+    """
+    Pair every unchanged segment of the current list with the same segment
+    of the previous list, in order (segments may have been inserted or
+    removed in between).
+
+    :param previous: Keys of the previous segments, e.g. (text, voice, language).
+    :param current: Keys of the current segments.
+    :return: Dictionary current index -> previous index.
+    """
+    matcher = difflib.SequenceMatcher(None, previous, current, autojunk=False)
+    matches = {}
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            matches.update(zip(range(j1, j2), range(i1, i2)))
+    return matches
+
+
+def is_edit(old_text: str, new_text: str) -> bool:
+    """
+    Whether new_text is an edit of old_text rather than a different text.
+    """
+    ratio = difflib.SequenceMatcher(None, old_text, new_text).ratio()
+    return ratio >= MIN_TEXT_SIMILARITY
+
+
+def keep_timing(previous: Timeline, timeline: Timeline) -> list:
+    """
+    Pad segments that were replaced by shorter audio (e.g. a fixed typo) to
+    the length of the segment they replace, as long as everything before
+    them is still in place. Every later caption then keeps its start time and
+    only the replaced segment's frames change. Unchanged segments keep the
+    length they were padded to before.
+
+    Only edits are padded: a replaced text has to be at least
+    MIN_TEXT_SIMILARITY similar to the old one, so a different story with
+    the same number of segments keeps its own timing.
+
+    A segment that became longer is left alone, it moves everything after it.
+
+    :return: Indices of the padded segments.
+    """
+    if previous.sample_rate != timeline.sample_rate or previous.gap != timeline.gap:
+        return []
+
+    matcher = difflib.SequenceMatcher(
+        None,
+        list(zip(previous.texts, previous.voices)),
+        list(zip(timeline.texts, timeline.voices)),
+        autojunk=False,
+    )
+    padded = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag not in ("equal", "replace") or i2 - i1 != j2 - j1:
+            continue
+        for i, j in zip(range(i1, i2), range(j1, j2)):
+            if timeline.sample_offsets[j] != previous.sample_offsets[i]:
+                # an earlier segment moved, nothing to keep in place any more
+                return padded
+            if tag == "replace" and not is_edit(previous.texts[i], timeline.texts[j]):
+                # a different sentence keeps its own length
+                continue
+            old_count = int(previous.sample_counts[i])
+            # equal segments keep the padding of an earlier run, so running
+            # this again on its own result changes nothing
+            if timeline.sample_counts[j] < old_count:
+                timeline.trim(j, timeline.trim_starts[j], old_count)
+                padded.append(j)
+    return padded
+
+
+def changed_ranges(previous: Timeline, timeline: Timeline) -> list:
+    """
+    Time ranges in which the video of two timelines differs.
+
+    A caption looks the same in both when its index, text, start and length
+    are the same, so the ranges are the spans of the captions that only
+    exist in one of them. If the narration length changed, everything from
+    the shorter end on differs as well.
+
+    :return: Sorted, merged list of (start, end) in seconds, end may be inf.
+    """
+    if previous.sample_rate != timeline.sample_rate:
+        return [(0.0, float("inf"))]
+
+    def captions(t: Timeline) -> set:
+        return {
+            (i, t.texts[i], int(t.sample_offsets[i]), int(t.sample_counts[i]))
+            for i in range(len(t))
+        }
+
+    rate = timeline.sample_rate
+    ranges = [
+        (offset / rate, (offset + count) / rate)
+        for _, _, offset, count in captions(previous) ^ captions(timeline)
+    ]
+    if previous.total_samples != timeline.total_samples:
+        shorter = min(previous.total_samples, timeline.total_samples)
+        ranges.append((shorter / rate, float("inf")))
+    return merge_ranges(ranges)
+
+
+def merge_ranges(ranges: list) -> list:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# ---------------------------------------------------------------- #
+
+
+def plan_splice(ranges: list, keyframes: list, fps: float, frame_count: int) -> list:
+    """
+    Widen changed time ranges to whole GOPs of the previous video.
+
+    Every changed range starts at the last keyframe at or before it and ends
+    at the first keyframe after it, so the untouched GOPs around it can be
+    stream copied.
+
+    :param ranges: Changed (start, end) ranges in seconds.
+    :param keyframes: Keyframe timestamps of the previous video.
+    :param fps: Frame rate of both videos.
+    :param frame_count: Number of frames of the new video.
+    :return: Merged list of (first_frame, end_frame) to re-encode.
+    """
+    key_frames = np.unique(np.round(np.asarray(keyframes) * fps).astype(np.int64))
+    if not len(key_frames) or key_frames[0] != 0:
+        key_frames = np.concatenate(([0], key_frames))
+
+    pieces = []
+    for start, end in ranges:
+        first = int(np.floor(start * fps))
+        last = frame_count if end == float("inf") else int(np.ceil(end * fps)) + 1
+        first = int(key_frames[np.searchsorted(key_frames, first, side="right") - 1])
+        later = key_frames[key_frames >= last]
+        last = int(later[0]) if len(later) else frame_count
+        if first < min(last, frame_count):
+            pieces.append((first, min(last, frame_count)))
+    return merge_ranges(pieces)
+
+
+def splice_video(
+    clip,
+    previous_file: str,
+    spec: dict,
+    fps: float,
+    ranges: list,
+    audio_file: str = None,
+    shortest: bool = False,
+    max_fraction: float = MAX_SPLICE_FRACTION,
+    debug_output=False,
+) -> bool:
+    """
+    Update a rendered video in place: the GOPs the changed ranges touch are
+    re-encoded from the new composite, every other GOP is stream copied from
+    the previous video, and the narration is muxed in again. Without changed
+    ranges only the narration is muxed in again.
+
+    The pieces have to be encoded like the rest of the video, so spec must
+    be the output spec the previous video was rendered with.
+
+    :param clip: The new composite clip.
+    :param previous_file: The previously rendered video, replaced on success.
+    :param spec: Output spec of the video, see write_video_variants().
+    :param fps: Frame rate of the video.
+    :param ranges: Changed (start, end) ranges, see changed_ranges().
+    :param audio_file: Encoded audio track muxed into the result.
+    :param shortest: Cut the result to the shorter of video and audio.
+    :param max_fraction: Re-encode at most this share of the frames,
+        otherwise nothing is written and False is returned.
+    :param debug_output: If True, will print debug information.
+    :return: True if the video was spliced.
+    """
+    frame_count = int(clip.duration * fps)
+    base, ext = os.path.splitext(previous_file)
+    ext = ext or ".mp4"
+    if not ranges:
+        # the captions are unchanged, the narration may not be (e.g. another
+        # voice padded to the previous timing), so it is always muxed in again
+        if audio_file:
+            remuxed_file = f"{base}.remux{ext}"
+            mux_audio(previous_file, audio_file, remuxed_file, shortest)
+            os.replace(remuxed_file, previous_file)
+            if debug_output:
+                print(f"Muxed the narration into {previous_file} again.")
+        return True
+
+    keyframes = probe_video(previous_file)["keyframes"]
+    pieces = plan_splice(ranges, keyframes, fps, frame_count)
+    encoded = sum(last - first for first, last in pieces)
+    if encoded > max_fraction * frame_count:
+        if debug_output:
+            print(
+                f"{encoded}/{frame_count} frames of {previous_file} changed, "
+                f"not splicing."
+            )
+        return False
+
+    work_folder = f"{base}.splice"
+    os.makedirs(work_folder, exist_ok=True)
+    try:
+        # the previous video is cut into whole GOPs at every piece boundary,
+        # each part of the result is then either such a chunk or a piece
+        boundaries = sorted(
+            {frame for piece in pieces for frame in piece if 0 < frame < frame_count}
+        )
+        chunks = _split_at_keyframes(
+            previous_file,
+            [boundary / fps for boundary in boundaries],
+            os.path.join(work_folder, f"chunk_%04d{ext}"),
+            fps,
+        )
+        if len(chunks) != len(boundaries) + 1:
+            # a missing chunk would silently drop its frames from the result
+            raise RuntimeError(
+                f"Splitting {previous_file} at {len(boundaries)} keyframes gave "
+                f"{len(chunks)} chunks instead of {len(boundaries) + 1}."
+            )
+
+        files = []
+        for i, first in enumerate([0] + boundaries):
+            last = boundaries[i] if i < len(boundaries) else frame_count
+            if (first, last) not in pieces:
+                files.append(chunks[i])
+                continue
+
+            piece_file = os.path.join(work_folder, f"piece_{i}{ext}")
+            # half a frame more so iter_frames() yields exactly last - first
+            # frames despite rounding
+            piece = clip.subclipped(first / fps).with_duration(
+                (last - first + 0.5) / fps
+            )
+            write_video_variants(piece, [{**spec, "file": piece_file}], fps)
+            files.append(piece_file)
+
+        list_file = os.path.join(work_folder, "pieces.txt")
+        with open(list_file, "w") as f:
+            f.writelines(f"file '{_escape(file)}'\n" for file in files)
+
+        spliced_file = os.path.join(work_folder, f"spliced{ext}")
+        _run(
+            [
+                FFMPEG_BINARY,
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                list_file,
+                "-c",
+                "copy",
+                "-movflags",
+                "+faststart",
+                video_only_file(spliced_file) if audio_file else spliced_file,
+            ],
+            f"ffmpeg failed to splice {previous_file}",
+        )
+        if audio_file:
+            mux_audio(video_only_file(spliced_file), audio_file, spliced_file, shortest)
+        os.replace(spliced_file, previous_file)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    if debug_output:
+        print(
+            f"Spliced {len(pieces)} re-encoded pieces ({encoded}/{frame_count} "
+            f"frames) into {previous_file}"
+        )
+    return True
+
+
+def _split_at_keyframes(video_file: str, times: list, pattern: str, fps: float) -> list:
+    """
+    Stream copy the video track of a file into chunks starting at the
+    keyframes at the given times.
+
+    :return: Paths of the chunks, in order.
+    """
+    # the segment muxer cuts at the first keyframe at or after a time, half
+    # a frame earlier keeps rounded timestamps on the right keyframe
+    command = [
+        FFMPEG_BINARY,
+        "-y",
+        "-loglevel",
+        "error",
+        "-i",
+        video_file,
+        "-map",
+        "0:v",
+        "-c",
+        "copy",
+        "-f",
+        "segment",
+        "-reset_timestamps",
+        "1",
+    ]
+    if times:
+        command += [
+            "-segment_times",
+            ",".join(f"{max(time - 0.5 / fps, 0.0):.6f}" for time in times),
+        ]
+    else:
+        command += ["-segment_time", "1e9"]
+    _run(command + [pattern], f"ffmpeg failed to split {video_file}")
+
+    chunks = []
+    while os.path.exists(pattern % len(chunks)):
+        chunks.append(pattern % len(chunks))
+    return chunks
+
+
+def _escape(path: str) -> str:
+    return os.path.abspath(path).replace("'", "'\\''")
+
+
+def _run(command: list, message: str):
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{message}:\n{result.stderr.decode(errors='replace')}")
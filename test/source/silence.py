@@ -0,0 +1,61 @@
+import numpy as np
+
+# ---------------------------------------------------------------- #
+
+# short-time energy window and hop in seconds
+ENERGY_FRAME_DURATION = 0.02
+ENERGY_HOP_DURATION = 0.005
+
+
+def frame_energy_db(audio: np.ndarray, frame_size: int, hop: int) -> np.ndarray:
+    """
+    Short-time energy (mean square, in dB) of every frame_size window,
+    hop samples apart. Computed from one cumulative sum of the squared
+    samples, so the cost does not depend on the window size.
+
+    :return: One value per window, the first window starts at sample 0.
+    """
+    if len(audio) < frame_size:
+        audio = np.pad(audio, (0, frame_size - len(audio)))
+    squared = np.square(audio, dtype=np.float64)
+    cumulative = np.concatenate(([0.0], np.cumsum(squared)))
+    starts = np.arange(0, len(audio) - frame_size + 1, hop)
+    energy = (cumulative[starts + frame_size] - cumulative[starts]) / frame_size
+    return 10.0 * np.log10(energy + 1e-12)
+
+
+def speech_bounds(
+    audio: np.ndarray,
+    sample_rate: int,
+    threshold_db: float = -40.0,
+    padding: float = 0.05,
+    frame_duration: float = ENERGY_FRAME_DURATION,
+    hop_duration: float = ENERGY_HOP_DURATION,
+) -> tuple:
+    """
+    Sample range of the speech in a segment, without its leading and trailing
+    near-silence.
+
+    A window counts as speech when its energy is within threshold_db of the
+    loudest window of the segment, pauses inside the speech are kept.
+
+    :param audio: Mono samples of the segment.
+    :param sample_rate: Sample rate of the audio.
+    :param threshold_db: Level relative to the loudest window, e.g. -40.
+    :param padding: Seconds kept before the first and after the last speech.
+    :return: (start, end) sample indices, the whole segment if it is silent.
+    """
+    if not len(audio):
+        return 0, 0
+
+    frame_size = max(1, int(frame_duration * sample_rate))
+    hop = max(1, int(hop_duration * sample_rate))
+    energy = frame_energy_db(audio, frame_size, hop)
+    active = np.flatnonzero(energy >= energy.max() + threshold_db)
+    if energy.max() <= -120.0 or not len(active):
+        return 0, len(audio)
+
+    pad = int(padding * sample_rate)
+    start = max(0, int(active[0]) * hop - pad)
+    end = min(len(audio), int(active[-1]) * hop + frame_size + pad)
+    return start, end
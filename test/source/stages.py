@@ -0,0 +1,409 @@
+import os
+import time
+
+from source.pipeline import (
+    Pipeline,
+    PipelineStage,
+    RunManifest,
+    fingerprint_callable,
+    hash_value,
+)
+from source.timeline import Timeline
+from source.generator import BrainrotClipGenerator
+from source.backgrounds import BackgroundLibrary
+from source.media import MediaStore
+from source.globals import DEFAULT_RENDER_OPTIONS
+
+# ---------------------------------------------------------------- #
+
+
+def build_video_pipeline(
+    generator: BrainrotClipGenerator,
+    manifest: RunManifest,
+    segments_folder: str,
+    concat_file: str,
+    output_file: str,
+    voice,
+    source_text: str = None,
+    reddit_scraper=None,
+    subreddit_name: str = None,
+    post_index: int = 0,
+    post_id: str = None,
+    text_cleaner: callable = None,
+    max_words: int = 10,
+    max_chars: int = 1e9,
+    text_clip_settings: dict = None,
+    text_clip_modifier: callable = None,
+    text_effect: callable = None,
+    render_options: dict = None,
+    progress_callback: callable = None,
+    background_library: BackgroundLibrary = None,
+    outputs: list = None,
+    media_store: MediaStore = None,
+    trim_silence: bool = True,
+    trim_options: dict = None,
+    partial_rerender: bool = False,
+    top_post_ttl: float = 3600.0,
+) -> Pipeline:
+    """
+    Model the full video pipeline as cacheable stages:
+
+        fetch -> clean -> segment -> synthesize -> trim -> concat
+              -> [media] -> [select_background] -> background -> composite -> render
+
+    :param generator: Generator instance the stages operate on.
+    :param manifest: Run manifest where stage outputs are recorded.
+    :param segments_folder: Folder for the synthesized segment files.
+    :param concat_file: Path of the concatenated audio file.
+    :param output_file: Path of the rendered video.
+    :param voice: Kokoro voice for every segment, or a function called as
+        voice(text, index) choosing the voice of each segment.
+    :param source_text: Input text. If None, the post is fetched from reddit.
+    :param reddit_scraper: RedditScraperBot used when no source text is given.
+    :param subreddit_name: Subreddit to take the top post from.
+    :param post_index: Which of the top posts to use.
+    :param post_id: Fetch this post instead of a top post of the subreddit.
+    :param text_cleaner: Optional function cleaning the fetched text.
+    :param text_effect: Optional function passed to apply_text_effect().
+    :param render_options: Extra options for render().
+    :param progress_callback: Called with (stage_name, status), see Pipeline.
+    :param background_library: If given, a window of the library is chosen for
+        every video instead of using the generator's video file.
+    :param outputs: Optional output specs, see BrainrotClipGenerator.render().
+        All variants are encoded from a single composite pass.
+    :param media_store: If given together with background_library, the post's
+        video is downloaded, normalized and added to the library.
+    :param trim_silence: If True, the near-silence around every segment is
+        cut before the audio is concatenated.
+    :param trim_options: padding, gap and threshold_db for
+        BrainrotClipGenerator.trim_silence().
+    :param partial_rerender: If True, a rerun after an edit diffs the segments
+        against the previous run in the manifest: only changed segments are
+        synthesized, the previous background window is kept and the previous
+        outputs are updated by re-encoding only the GOPs of the changed
+        captions (see BrainrotClipGenerator.rerender()).
+    :param top_post_ttl: Seconds a fetched top post is reused before the
+        subreddit is asked again (a post fetched by post_id is kept).
+    :return: The pipeline, run it with pipeline.run().
+    """
+    if source_text is None and reddit_scraper is None:
+        raise ValueError("Either source_text or reddit_scraper is required.")
+
+    pipeline = Pipeline(
+        manifest,
+        debug_output=generator.debug_output,
+        progress_callback=progress_callback,
+    )
+    render_options = render_options or {}
+    state = {"timeline": None}
+
+    # results of the previous run, taken before this run records its own
+    previous = {}
+    if partial_rerender:
+        for name in ("synthesize", "trim", "select_background", "render"):
+            entry = manifest.get(name)
+            previous[name] = entry["result"] if entry else None
+
+    # ---------------------------------------------------- #
+    # text stages
+
+    def fetch():
+        if source_text is not None:
+            return {"post_id": None, "title": None, "text": source_text}
+
+        if post_id is not None:
+            post = reddit_scraper.get_post(post_id)
+        else:
+            top_posts = reddit_scraper.get_top_subreddit_posts(
+                subreddit_name, limit=post_index + 1
+            )
+            post = top_posts[post_index]
+        return {
+            "post_id": post.id,
+            "title": post.title,
+            "text": post.selftext,
+            "details": reddit_scraper.extract_post_details(post),
+            "media": reddit_scraper.extract_post_media(post),
+        }
+
+    def clean(fetch):
+        if not fetch["text"]:
+            raise ValueError(f"Post {fetch['post_id']} has no content.")
+        if text_cleaner is None:
+            return {"text": fetch["text"]}
+        return {"text": text_cleaner(fetch["text"])}
+
+    def segment(clean):
+        generator.set_video_text(clean["text"])
+        return {"segments": generator.split_text_into_segments(max_words, max_chars)}
+
+    pipeline.add_stage(
+        PipelineStage(
+            "fetch",
+            fetch,
+            params={
+                "source_text": source_text,
+                "subreddit": subreddit_name,
+                "post_index": post_index,
+                "post_id": post_id,
+                # the top posts change, refetch once per TTL window; an
+                # unchanged post keeps every later stage cached
+                "fresh": (
+                    int(time.time() // top_post_ttl)
+                    if source_text is None and post_id is None
+                    else None
+                ),
+            },
+        )
+    )
+    pipeline.add_stage(
+        PipelineStage(
+            "clean",
+            clean,
+            depends_on=["fetch"],
+            params={"cleaner": fingerprint_callable(text_cleaner)},
+        )
+    )
+    pipeline.add_stage(
+        PipelineStage(
+            "segment",
+            segment,
+            depends_on=["clean"],
+            params={"max_words": max_words, "max_chars": max_chars},
+        )
+    )
+
+    # ---------------------------------------------------- #
+    # audio stages
+
+    def synthesize(segment):
+        generator.set_text_segments(segment["segments"])
+        previous_timeline = None
+        if previous.get("synthesize") is not None:
+            previous_timeline = Timeline.from_dict(previous["synthesize"]["timeline"])
+        timeline = generator.generate_segments(
+            segments_folder,
+            voice,
+            text_clip_settings,
+            text_clip_modifier,
+            previous_timeline=previous_timeline,
+        ).to_dict()
+        state["timeline"] = timeline
+        return {"timeline": timeline}
+
+    def load_timeline(result):
+        # restoring a timeline is cheap, text clips are only created on demand
+        if state["timeline"] != result["timeline"]:
+            generator.load_timeline(
+                result["timeline"], text_clip_settings, text_clip_modifier
+            )
+            state["timeline"] = result["timeline"]
+
+    def trim(synthesize):
+        load_timeline(synthesize)
+        if not trim_silence and previous.get("trim") is None:
+            return {"timeline": synthesize["timeline"], "report": None}
+        report = None
+        if trim_silence:
+            report = generator.trim_silence(**(trim_options or {}))
+        if previous.get("trim") is not None:
+            generator.keep_segment_timing(
+                Timeline.from_dict(previous["trim"]["timeline"])
+            )
+        timeline = generator._timeline.to_dict()
+        state["timeline"] = timeline
+        return {"timeline": timeline, "report": report}
+
+    def concat(trim):
+        load_timeline(trim)
+        duration = generator.concat_audio_segment_files(concat_file)
+        return {"file": concat_file, "duration": duration}
+
+    pipeline.add_stage(
+        PipelineStage(
+            "synthesize",
+            synthesize,
+            depends_on=["segment"],
+            params={
+                "voice": fingerprint_callable(voice) if callable(voice) else voice,
+                "language": getattr(generator.kokoro_model, "lang_code", None),
+                "folder": segments_folder,
+            },
+            artifacts=lambda result: list(result["timeline"]["files"]),
+        )
+    )
+    trim_params = {"enabled": trim_silence, "options": trim_options or {}}
+    if partial_rerender:
+        # keep_segment_timing() pads to the previous trimmed timeline
+        trim_params["previous"] = (
+            hash_value(previous["trim"]["timeline"])
+            if previous.get("trim") is not None
+            else None
+        )
+    pipeline.add_stage(
+        PipelineStage(
+            "trim",
+            trim,
+            depends_on=["synthesize"],
+            params=trim_params,
+        )
+    )
+    pipeline.add_stage(
+        PipelineStage(
+            "concat",
+            concat,
+            depends_on=["trim"],
+            params={
+                "file": concat_file,
+                "inter_segment_delay": generator._inter_segment_delay,
+            },
+            artifacts=lambda result: [result["file"]],
+        )
+    )
+
+    # ---------------------------------------------------- #
+    # video stages, these hold live clips and are never stored
+
+    def media(fetch):
+        if not fetch.get("media"):
+            return {"file": None}
+        return {
+            "file": media_store.add_to_library(
+                media_store.fetch(fetch["media"]), background_library
+            )
+        }
+
+    def select_background(concat, media=None):
+        # the setup() subclip is one second longer than the narration
+        window = previous.get("select_background")
+        if window is not None and window["end"] - window["start"] >= (
+            concat["duration"] + 1
+        ):
+            # same footage as the previous outputs, so they can be spliced
+            return window
+        return background_library.select_window(concat["duration"] + 1)
+
+    def background(concat, select_background=None):
+        generator.load_concatenated_audio(concat["file"], concat["duration"])
+        if select_background is not None:
+            generator.set_background(
+                select_background["file"], select_background["start"]
+            )
+        generator.setup()
+        return generator
+
+    def composite(trim, background):
+        load_timeline(trim)
+        if text_effect is not None:
+            generator.apply_text_effect(text_effect)
+        return generator.composite_clips()
+
+    def render(composite):
+        # everything besides the timeline the rendered frames depend on
+        context = hash_value(
+            {
+                "video_file": generator.video_file,
+                "video_start": generator.video_start,
+                "background": background_params,
+                "composite": composite_params,
+                "render": render_params,
+            }
+        )
+        previous_render = previous.get("render")
+        if previous_render is not None and previous_render.get("context") == context:
+            files = generator.rerender(
+                output_file,
+                Timeline.from_dict(previous_render["timeline"]),
+                outputs=outputs,
+                **dict(render_options),
+            )
+        else:
+            files = generator.render(
+                output_file, outputs=outputs, **dict(render_options)
+            )
+        return {
+            "files": files,
+            "context": context,
+            "timeline": generator._timeline.to_dict(),
+        }
+
+    if background_library is not None:
+        select_dependencies = ["concat"]
+        if media_store is not None:
+            pipeline.add_stage(
+                PipelineStage(
+                    "media",
+                    media,
+                    depends_on=["fetch"],
+                    params={"store": media_store.folder},
+                    artifacts=lambda result: [result["file"]] if result["file"] else [],
+                )
+            )
+            select_dependencies.append("media")
+
+        # the chosen window is stored, so a resumed run keeps the same footage
+        pipeline.add_stage(
+            PipelineStage(
+                "select_background",
+                select_background,
+                depends_on=select_dependencies,
+                params={"folder": background_library.folder},
+            )
+        )
+        background_params = {"framerate": generator.framerate}
+        background_dependencies = ["concat", "select_background"]
+    else:
+        video_stat = (
+            os.stat(generator.video_file)
+            if os.path.exists(generator.video_file)
+            else None
+        )
+        background_params = {
+            "video_file": generator.video_file,
+            "video_start": generator.video_start,
+            "video_size": video_stat.st_size if video_stat else None,
+            "video_mtime": video_stat.st_mtime if video_stat else None,
+            "framerate": generator.framerate,
+        }
+        background_dependencies = ["concat"]
+
+    pipeline.add_stage(
+        PipelineStage(
+            "background",
+            background,
+            depends_on=background_dependencies,
+            params=background_params,
+            cacheable=False,
+        )
+    )
+    composite_params = {
+        "text_clip_settings": text_clip_settings,
+        "text_clip_modifier": fingerprint_callable(text_clip_modifier),
+        "text_effect": fingerprint_callable(text_effect),
+        "inter_segment_delay": generator._inter_segment_delay,
+    }
+    pipeline.add_stage(
+        PipelineStage(
+            "composite",
+            composite,
+            depends_on=["trim", "background"],
+            params=composite_params,
+            cacheable=False,
+        )
+    )
+    render_params = {
+        "output_file": output_file,
+        "render_options": {**DEFAULT_RENDER_OPTIONS, **render_options},
+        "outputs": outputs,
+    }
+    pipeline.add_stage(
+        PipelineStage(
+            "render",
+            render,
+            depends_on=["composite"],
+            params=render_params,
+            artifacts=lambda result: list(result["files"]),
+        )
+    )
+
+    return pipeline
@@ -0,0 +1,100 @@
+import numpy as np
+from moviepy import VideoClip
+
+from source.timeline import Timeline
+
+# ---------------------------------------------------------------- #
+
+
+class StreamingCompositeClip(VideoClip):
+    """
+    Background plus captions, composited into one reused frame buffer.
+
+    Unlike CompositeVideoClip, which keeps every caption layer alive for the
+    whole render, a caption is created through the timeline when it becomes
+    visible and released once it has ended. Memory therefore stays bounded
+    by the captions on screen at the same time, not by the story length.
+
+    The returned frame is the same buffer on every call; it is valid until
+    the next get_frame(). Consumers writing frames straight to an encoder
+    (write_video_variants, write_videofile) are fine with that.
+    """
+
+    def __init__(self, background: VideoClip, timeline: Timeline):
+        """
+        :param background: Background clip, defines size and duration.
+        :param timeline: Timeline with a clip factory for the captions.
+        """
+        super().__init__(duration=background.duration)
+        self.background = background
+        self.timeline = timeline
+        self.size = background.size
+        self.fps = background.fps
+
+        self._starts = np.asarray(timeline.starts)
+        self._ends = np.asarray(timeline.ends)
+        self._active = set()
+        width, height = self.size
+        self._buffer = np.empty((height, width, 3), dtype=np.uint8)
+        self.frame_function = self._compose
+
+    # ---------------------------------------------------- #
+
+    def visible(self, t: float) -> range:
+        """
+        Indices of the segments whose caption is on screen at time t.
+        """
+        first = int(np.searchsorted(self._ends, t, side="right"))
+        last = int(np.searchsorted(self._starts, t, side="right"))
+        return range(first, max(first, last))
+
+    def _compose(self, t: float) -> np.ndarray:
+        visible = self.visible(t)
+        for index in self._active.difference(visible):
+            self.timeline.release_text_clip(index)
+        self._active = set(visible)
+
+        background = self.background.get_frame(t - (self.background.start or 0.0))
+        np.copyto(self._buffer, background[:, :, :3], casting="unsafe")
+        for index in visible:
+            self._blend(self.timeline.text_clip(index), t)
+        return self._buffer
+
+    def _blend(self, clip: VideoClip, t: float):
+        local_t = t - (clip.start or 0.0)
+        image = clip.get_frame(local_t)
+        height, width = image.shape[:2]
+        x, y = self._position(clip, local_t, (width, height))
+
+        frame_height, frame_width = self._buffer.shape[:2]
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, frame_width), min(y + height, frame_height)
+        if x1 <= x0 or y1 <= y0:
+            return
+        source = image[y0 - y : y1 - y, x0 - x : x1 - x, :3]
+        region = self._buffer[y0:y1, x0:x1]
+        if clip.mask is None:
+            region[:] = source
+            return
+
+        alpha = clip.mask.get_frame(local_t)[y0 - y : y1 - y, x0 - x : x1 - x]
+        alpha = alpha[:, :, None].astype(np.float32)
+        region[:] = region + (source - region.astype(np.float32)) * alpha
+
+    def _position(self, clip: VideoClip, local_t: float, size: tuple) -> tuple:
+        """
+        Top left corner of a caption frame, resolving relative and named
+        positions like CompositeVideoClip does.
+        """
+        x, y = clip.pos(local_t)
+        frame_width, frame_height = self.size
+        named = {"left": 0.0, "top": 0.0, "center": 0.5, "right": 1.0, "bottom": 1.0}
+        if isinstance(x, str):
+            x = named[x] * (frame_width - size[0])
+        elif clip.relative_pos:
+            x *= frame_width
+        if isinstance(y, str):
+            y = named[y] * (frame_height - size[1])
+        elif clip.relative_pos:
+            y *= frame_height
+        return int(x), int(y)
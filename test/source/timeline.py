@@ -0,0 +1,215 @@
+import numpy as np
+
+# ---------------------------------------------------------------- #
+
+
+class Timeline:
+    """
+    Timing model of the narrated segments.
+
+    Sample counts are the single source of truth: start offsets, durations and
+    end times are derived from them with one cumulative sum, so the audio
+    concatenation, the caption placement and the composite all agree. Heavy
+    per-segment objects (text clips) live in separate slots and are only
+    created when first requested.
+    """
+
+    def __init__(self, sample_rate: int = 44100, gap: float = 0.0):
+        """
+        :param sample_rate: Sample rate of the segment audio files.
+        :param gap: Silence between two segments in seconds.
+        """
+        self.sample_rate = sample_rate
+        self.gap = gap
+
+        self.texts = []
+        self.files = []
+        self.voices = []
+        self.languages = []
+        # first sample of each file that is used, set by trim()
+        self.trim_starts = []
+        self._sample_counts = []
+
+        self._layout = None
+        self._text_clips = []
+        self._clip_factory = None
+
+    # ---------------------------------------------------- #
+    # building
+
+    def append(
+        self,
+        text: str,
+        file: str,
+        sample_count: int,
+        voice: str = None,
+        language: str = None,
+        trim_start: int = 0,
+    ) -> int:
+        """
+        Add a segment at the end of the timeline.
+
+        :return: Index of the new segment.
+        """
+        self.texts.append(text)
+        self.files.append(file)
+        self.voices.append(voice)
+        self.languages.append(language)
+        self.trim_starts.append(int(trim_start))
+        self._sample_counts.append(int(sample_count))
+        self._text_clips.append(None)
+        self._layout = None
+        return len(self.texts) - 1
+
+    def trim(self, index: int, start: int, sample_count: int):
+        """
+        Use only sample_count samples of a segment's file, starting at start.
+        Every later segment moves accordingly, so their text clips are dropped.
+        """
+        self.trim_starts[index] = int(start)
+        self._sample_counts[index] = int(sample_count)
+        self._text_clips[index:] = [None] * (len(self.texts) - index)
+        self._layout = None
+
+    def set_gap(self, gap: float):
+        self.gap = gap
+        self._text_clips = [None] * len(self.texts)
+        self._layout = None
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    # ---------------------------------------------------- #
+    # layout
+
+    @property
+    def gap_samples(self) -> int:
+        return int(self.gap * self.sample_rate)
+
+    def _compute_layout(self) -> dict:
+        if self._layout is None:
+            counts = np.asarray(self._sample_counts, dtype=np.int64)
+            offsets = np.zeros(len(counts), dtype=np.int64)
+            if len(counts) > 1:
+                np.cumsum(counts[:-1] + self.gap_samples, out=offsets[1:])
+
+            durations = counts / self.sample_rate
+            starts = offsets / self.sample_rate
+            self._layout = {
+                "sample_counts": counts,
+                "sample_offsets": offsets,
+                "durations": durations,
+                "starts": starts,
+                "ends": starts + durations,
+            }
+        return self._layout
+
+    @property
+    def sample_counts(self) -> np.ndarray:
+        return self._compute_layout()["sample_counts"]
+
+    @property
+    def sample_offsets(self) -> np.ndarray:
+        return self._compute_layout()["sample_offsets"]
+
+    @property
+    def durations(self) -> np.ndarray:
+        return self._compute_layout()["durations"]
+
+    @property
+    def starts(self) -> np.ndarray:
+        return self._compute_layout()["starts"]
+
+    @property
+    def ends(self) -> np.ndarray:
+        return self._compute_layout()["ends"]
+
+    @property
+    def total_samples(self) -> int:
+        if not self.texts:
+            return 0
+        return int(self.sample_offsets[-1] + self.sample_counts[-1])
+
+    @property
+    def total_duration(self) -> float:
+        return self.total_samples / self.sample_rate
+
+    # ---------------------------------------------------- #
+    # lazily created text clips
+
+    def set_clip_factory(self, factory: callable):
+        """
+        Set the function creating a segment's text clip on first access.
+
+        :param factory: Called as factory(timeline, index), returns the clip.
+        """
+        self._clip_factory = factory
+        self._text_clips = [None] * len(self.texts)
+
+    def text_clip(self, index: int):
+        if self._text_clips[index] is None:
+            if self._clip_factory is None:
+                raise ValueError("No text clip factory set on the timeline.")
+            self._text_clips[index] = self._clip_factory(self, index)
+        return self._text_clips[index]
+
+    def set_text_clip(self, index: int, text_clip):
+        self._text_clips[index] = text_clip
+
+    def release_text_clip(self, index: int):
+        self._text_clips[index] = None
+
+    def text_clips(self) -> list:
+        return [self.text_clip(i) for i in range(len(self.texts))]
+
+    # ---------------------------------------------------- #
+    # views + serialization
+
+    def segment(self, index: int) -> dict:
+        """
+        Dictionary view of a single segment, used by text effects.
+        """
+        return {
+            "index": index,
+            "text": self.texts[index],
+            "file": self.files[index],
+            "duration": float(self.durations[index]),
+            "start_time": float(self.starts[index]),
+            "end_time": float(self.ends[index]),
+            "sample_offset": int(self.sample_offsets[index]),
+            "sample_count": int(self.sample_counts[index]),
+            "trim_start": self.trim_starts[index],
+            "kokoro_voice": self.voices[index],
+            "kokoro_language": self.languages[index],
+            "text_clip": self.text_clip(index),
+        }
+
+    def to_dict(self) -> dict:
+        """
+        JSON-serializable form of the timeline, without any text clips.
+        """
+        return {
+            "sample_rate": self.sample_rate,
+            "gap": self.gap,
+            "texts": list(self.texts),
+            "files": list(self.files),
+            "voices": list(self.voices),
+            "languages": list(self.languages),
+            "trim_starts": list(self.trim_starts),
+            "sample_counts": list(self._sample_counts),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Timeline":
+        timeline = cls(sample_rate=data["sample_rate"], gap=data["gap"])
+        trim_starts = data.get("trim_starts") or [0] * len(data["texts"])
+        for text, file, sample_count, voice, language, trim_start in zip(
+            data["texts"],
+            data["files"],
+            data["sample_counts"],
+            data["voices"],
+            data["languages"],
+            trim_starts,
+        ):
+            timeline.append(text, file, sample_count, voice, language, trim_start)
+        return timeline
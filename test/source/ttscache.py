@@ -0,0 +1,79 @@
+import os
+import shutil
+import threading
+
+import soundfile as sf
+
+from source.pipeline import hash_value
+
+# ---------------------------------------------------------------- #
+
+
+class TTSCache:
+    """
+    Content addressed cache of synthesized segment audio.
+
+    Entries are keyed by a hash of (text, voice, language, sample rate), so the
+    same sentence is only synthesized once across runs, parts and jobs. Writes
+    go through a temporary file and os.replace(), which makes the cache safe to
+    share between threads and processes.
+    """
+
+    def __init__(self, folder: str):
+        """
+        :param folder: Folder the cached audio files are stored in.
+        """
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    # ---------------------------------------------------- #
+
+    def key(self, text: str, voice: str, language: str, sample_rate: int) -> str:
+        return hash_value(
+            {
+                "text": text,
+                "voice": voice,
+                "language": language,
+                "sample_rate": sample_rate,
+            }
+        )
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.wav")
+
+    def copy_to(self, key: str, target_file: str) -> int:
+        """
+        Copy a cached entry to target_file.
+
+        :return: Number of samples, or None if the entry is not cached.
+        """
+        cached_file = self.path(key)
+        if not os.path.exists(cached_file):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        shutil.copyfile(cached_file, target_file)
+        with self._lock:
+            self.hits += 1
+        return sf.info(cached_file).frames
+
+    def sample_count(self, key: str) -> int:
+        """
+        Number of samples of a cached entry without reading it, or None.
+        """
+        cached_file = self.path(key)
+        if not os.path.exists(cached_file):
+            return None
+        return sf.info(cached_file).frames
+
+    def store(self, key: str, audio_file: str):
+        """
+        Add a synthesized audio file to the cache.
+        """
+        temp_file = f"{self.path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(audio_file, temp_file)
+        os.replace(temp_file, self.path(key))
@@ -0,0 +1,120 @@
+import threading
+
+import numpy as np
+
+# ---------------------------------------------------------------- #
+
+KOKORO_REPO_ID = "hexgrad/Kokoro-82M"
+
+
+def voice_language(voice: str) -> str:
+    """
+    Kokoro language code of a voice, voice names start with it ("bf_emma" -> "b").
+    """
+    if not voice:
+        raise ValueError("Voice name is empty.")
+    return voice[0]
+
+
+class KokoroPool:
+    """
+    Kokoro pipelines for several languages on top of one shared model.
+
+    Every KPipeline normally loads its own copy of the model weights; the pool
+    loads the model once and hands the same instance to one pipeline per
+    language, which then only differ in their phonemizer. Voice packs are
+    loaded into the pipeline of their language up front (preload) instead of
+    on the first segment that uses them.
+
+    Synthesis runs on the shared model, so it is serialized on `lock`. Pass
+    the pool's lock to generators that use the pool from several threads.
+    """
+
+    def __init__(self, device: str = None, repo_id: str = KOKORO_REPO_ID):
+        """
+        :param device: Torch device for the model, e.g. "mps", "cuda" or "cpu".
+        :param repo_id: Hugging Face repository of the model and voices.
+        """
+        self.device = device
+        self.repo_id = repo_id
+        self.lock = threading.Lock()
+
+        self._model = None
+        self._pipelines = {}
+
+    # ---------------------------------------------------- #
+
+    @property
+    def model(self):
+        # kokoro (and torch) are only imported once a model is needed
+        from kokoro import KModel
+
+        if self._model is None:
+            model = KModel(repo_id=self.repo_id).eval()
+            self._model = model.to(self.device) if self.device else model
+        return self._model
+
+    def pipeline(self, lang_code: str):
+        """
+        Pipeline of a language, created on first use with the shared model.
+        """
+        from kokoro import KPipeline
+
+        with self.lock:
+            if lang_code not in self._pipelines:
+                self._pipelines[lang_code] = KPipeline(
+                    lang_code=lang_code, repo_id=self.repo_id, model=self.model
+                )
+            return self._pipelines[lang_code]
+
+    def pipeline_for_voice(self, voice: str):
+        return self.pipeline(voice_language(voice))
+
+    def languages(self) -> list:
+        return list(self._pipelines)
+
+    def preload(self, voices, debug_output=False) -> list:
+        """
+        Load voice packs into the pipelines of their languages.
+
+        :param voices: Voice names, or a dictionary of voice name lists such
+            as BrainrotClipGenerator.KOKORO_VOICES.
+        :param debug_output: If True, will print debug information.
+        :return: The voices that were loaded.
+        """
+        if isinstance(voices, dict):
+            voices = [voice for names in voices.values() for voice in names]
+
+        loaded = []
+        for voice in voices:
+            pipeline = self.pipeline_for_voice(voice)
+            try:
+                with self.lock:
+                    pipeline.load_voice(voice)
+            except Exception as e:
+                print(f"Warning: Could not preload voice {voice}: {e}")
+                continue
+            loaded.append(voice)
+        if debug_output:
+            print(
+                f"Preloaded {len(loaded)} voices for languages {self.languages()}: "
+                f"{loaded}"
+            )
+        return loaded
+
+    def synthesize(self, text: str, voice: str) -> np.ndarray:
+        """
+        Synthesize text with a voice, in the pipeline of the voice's language.
+
+        :return: Audio at the kokoro sample rate, empty if nothing was generated.
+        """
+        pipeline = self.pipeline_for_voice(voice)
+        chunks = []
+        # kokoro synthesizes lazily while the results are iterated, so the
+        # lock has to cover the loop
+        with self.lock:
+            for _, _, audio in pipeline(text, voice=voice):
+                chunks.append(audio.numpy() if hasattr(audio, "numpy") else audio)
+        if not chunks:
+            return np.zeros((0,), dtype=np.float32)
+        return np.concatenate(chunks, axis=0)
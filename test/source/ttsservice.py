@@ -0,0 +1,384 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+import socketserver
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+# ---------------------------------------------------------------- #
+
+TTS_SERVICE_HOST = "127.0.0.1"
+TTS_SERVICE_PORT = 8765
+
+SAMPLE_DTYPE = np.float32
+KOKORO_SAMPLE_RATE = 24000
+
+# a connection's buffer starts at one minute of audio and grows as needed
+INITIAL_BUFFER_SAMPLES = 60 * KOKORO_SAMPLE_RATE
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    Attach to a buffer created by the service without registering it with
+    this process's resource tracker, which would otherwise unlink it when
+    the client exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # python < 3.13 always tracks attached buffers
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+# ---------------------------------------------------------------- #
+
+
+class _TTSRequestHandler(socketserver.StreamRequestHandler):
+    """
+    One client connection. Requests and responses are JSON lines, audio is
+    written into a shared memory buffer owned by the connection and only
+    its name and sample count are sent back. The client copies the samples
+    out before its next request, so the buffer is reused for every segment.
+    """
+
+    def setup(self):
+        super().setup()
+        self.shm = None
+        self.server.client_connected(1)
+
+    def finish(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+        self.server.client_connected(-1)
+        super().finish()
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response = self.dispatch(request)
+            except Exception as e:
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+    # ---------------------------------------------------- #
+
+    def dispatch(self, request: dict) -> dict:
+        op = request.get("op")
+        if op == "synthesize":
+            return self.synthesize(request["text"], request["voice"])
+        if op == "preload":
+            return {
+                "ok": True,
+                "voices": self.server.tts_pool.preload(request["voices"]),
+            }
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        if op == "stats":
+            return {"ok": True, **self.server.stats()}
+        raise ValueError(f"Unknown operation: {op}")
+
+    def synthesize(self, text: str, voice: str) -> dict:
+        audio = np.asarray(self.server.tts_pool.synthesize(text, voice), SAMPLE_DTYPE)
+        self.server.count_request(len(audio))
+        if not len(audio):
+            return {"ok": True, "shm": None, "samples": 0}
+
+        nbytes = audio.nbytes
+        if self.shm is None or self.shm.size < nbytes:
+            if self.shm is not None:
+                self.shm.close()
+                self.shm.unlink()
+            size = max(nbytes, INITIAL_BUFFER_SAMPLES * audio.itemsize)
+            if self.shm is not None:
+                size = max(size, self.shm.size * 2)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+
+        np.ndarray(audio.shape, SAMPLE_DTYPE, buffer=self.shm.buf)[:] = audio
+        return {
+            "ok": True,
+            "shm": self.shm.name,
+            "samples": len(audio),
+            "sample_rate": KOKORO_SAMPLE_RATE,
+        }
+
+
+class TTSServer(socketserver.ThreadingTCPServer):
+    """
+    Local TTS service holding one warm KokoroPool for any number of render
+    processes. Synthesis is serialized on the pool's lock, so connections
+    are cheap and several renders can share the model.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple, tts_pool, debug_output=False):
+        super().__init__(address, _TTSRequestHandler)
+        self.tts_pool = tts_pool
+        self.debug_output = debug_output
+
+        self._lock = threading.Lock()
+        self._started_at = time.time()
+        self._clients = 0
+        self._requests = 0
+        self._samples = 0
+
+    def client_connected(self, delta: int):
+        with self._lock:
+            self._clients += delta
+        if self.debug_output:
+            print(f"TTS client {'connected' if delta > 0 else 'disconnected'}")
+
+    def count_request(self, samples: int):
+        with self._lock:
+            self._requests += 1
+            self._samples += samples
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "uptime": time.time() - self._started_at,
+                "clients": self._clients,
+                "requests": self._requests,
+                "audio_seconds": self._samples / KOKORO_SAMPLE_RATE,
+                "languages": self.tts_pool.languages(),
+            }
+
+
+# ---------------------------------------------------------------- #
+
+
+class TTSClient:
+    """
+    Client of a TTSServer, usable wherever a KokoroPool is (generator
+    tts_pool, preload). The render process never imports torch or kokoro;
+    audio arrives through the connection's shared memory buffer and is
+    copied out once.
+
+    Requests on one client are serialized on `lock`, pass it as tts_lock
+    when several generators share the client.
+    """
+
+    def __init__(
+        self,
+        host: str = TTS_SERVICE_HOST,
+        port: int = TTS_SERVICE_PORT,
+        timeout: float = 300.0,
+    ):
+        """
+        :param host: Address of the service.
+        :param port: Port of the service.
+        :param timeout: Seconds to wait for a single response.
+        """
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+        self._socket = None
+        self._reader = None
+        self._shm = None
+
+    # ---------------------------------------------------- #
+    # KokoroPool interface
+
+    def synthesize(self, text: str, voice: str) -> np.ndarray:
+        """
+        Synthesize text with a voice in the service.
+
+        :return: Audio at the kokoro sample rate, empty if nothing was generated.
+        """
+        with self.lock:
+            response = self._request({"op": "synthesize", "text": text, "voice": voice})
+            if not response["samples"]:
+                return np.zeros((0,), dtype=SAMPLE_DTYPE)
+            if self._shm is None or self._shm.name != response["shm"]:
+                self._close_shm()
+                self._shm = _attach_shared_memory(response["shm"])
+            return np.ndarray(
+                (response["samples"],), SAMPLE_DTYPE, buffer=self._shm.buf
+            ).copy()
+
+    def preload(self, voices, debug_output=False) -> list:
+        """
+        Load voice packs in the service, see KokoroPool.preload().
+        """
+        if isinstance(voices, dict):
+            voices = [voice for names in voices.values() for voice in names]
+        with self.lock:
+            loaded = self._request({"op": "preload", "voices": list(voices)})["voices"]
+        if debug_output:
+            print(f"TTS service preloaded {len(loaded)} voices: {loaded}")
+        return loaded
+
+    def languages(self) -> list:
+        return self.stats()["languages"]
+
+    # ---------------------------------------------------- #
+
+    def ping(self) -> bool:
+        try:
+            with self.lock:
+                self._request({"op": "ping"}, retry=False)
+            return True
+        except OSError:
+            return False
+
+    def stats(self) -> dict:
+        with self.lock:
+            return self._request({"op": "stats"})
+
+    def close(self):
+        with self.lock:
+            self._disconnect()
+
+    # ---------------------------------------------------- #
+
+    def _request(self, request: dict, retry: bool = True) -> dict:
+        try:
+            response = self._exchange(request)
+        except OSError:
+            # the service may have been restarted, reconnect once
+            self._disconnect()
+            if not retry:
+                raise
+            response = self._exchange(request)
+
+        if not response.get("ok"):
+            raise RuntimeError(f"TTS service error: {response.get('error')}")
+        return response
+
+    def _exchange(self, request: dict) -> dict:
+        if self._socket is None:
+            self._socket = socket.create_connection(
+                (self.host, self.port), timeout=self.timeout
+            )
+            self._reader = self._socket.makefile("rb")
+        self._socket.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("TTS service closed the connection.")
+        return json.loads(line)
+
+    def _disconnect(self):
+        self._close_shm()
+        if self._socket is not None:
+            self._reader.close()
+            self._socket.close()
+        self._socket = None
+        self._reader = None
+
+    def _close_shm(self):
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+
+def connect_tts_service(
+    host: str = TTS_SERVICE_HOST,
+    port: int = TTS_SERVICE_PORT,
+    device: str = None,
+    start: bool = True,
+    start_timeout: float = 300.0,
+    debug_output=False,
+) -> TTSClient:
+    """
+    Connect to the TTS service, starting it in the background if it is not
+    running. The service outlives the process that started it, so the model
+    stays warm for the next run.
+
+    :param host: Address of the service.
+    :param port: Port of the service.
+    :param device: Torch device of a newly started service.
+    :param start: If False, raise instead of starting the service.
+    :param start_timeout: Seconds to wait for a newly started service.
+    :param debug_output: If True, will print debug information.
+    :return: A connected TTSClient.
+    """
+    client = TTSClient(host, port)
+    if client.ping():
+        return client
+    if not start:
+        raise ConnectionError(f"No TTS service is running on {host}:{port}.")
+
+    command = [
+        sys.executable,
+        "-m",
+        "source.ttsservice",
+        "--host",
+        host,
+        "--port",
+        str(port),
+    ]
+    if device:
+        command += ["--device", device]
+    if debug_output:
+        print(f"Starting TTS service on {host}:{port}...")
+    subprocess.Popen(
+        command,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdin=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+    deadline = time.time() + start_timeout
+    while not client.ping():
+        if time.time() > deadline:
+            raise TimeoutError(f"TTS service did not start on {host}:{port}.")
+        time.sleep(0.5)
+    return client
+
+
+# ---------------------------------------------------------------- #
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Local TTS service keeping the Kokoro model warm across runs."
+    )
+    parser.add_argument("--host", default=TTS_SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=TTS_SERVICE_PORT)
+    parser.add_argument(
+        "--device",
+        default=os.getenv("KOKORO_DEVICE"),
+        help="Torch device for Kokoro (mps, cuda, cpu).",
+    )
+    parser.add_argument(
+        "--preload",
+        default="",
+        help="Comma separated voices loaded on start.",
+    )
+    parser.add_argument("--debug", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    from source.ttspool import KokoroPool
+
+    args = parse_args()
+    tts_pool = KokoroPool(device=args.device)
+    tts_pool.preload(
+        [voice for voice in args.preload.split(",") if voice],
+        debug_output=args.debug,
+    )
+
+    server = TTSServer((args.host, args.port), tts_pool, debug_output=args.debug)
+    print(f"TTS service listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    finally:
+        server.server_close()
@@ -0,0 +1,335 @@
+import os
+import re
+import json
+import time
+import shutil
+import platform
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+
+from source.pipeline import hash_value
+from source.encoder import FFMPEG_BINARY, build_video_filter, build_encoder_args
+from source.globals import DEFAULT_RENDER_OPTIONS
+
+# ---------------------------------------------------------------- #
+
+TUNING_VERSION = 1
+
+DEFAULT_TUNING_CANDIDATES = {
+    "preset": ["veryfast", "faster", "fast", "medium"],
+    "crf": [20, 23, 26],
+    "threads": [None],
+}
+
+# encode at least twice as fast as realtime, no quality floor (so CRF keeps
+# the encoder's default and only the speed settings are tuned)
+DEFAULT_TUNING_BUDGET = {"min_speed": 2.0, "min_ssim": None}
+
+
+def host_key() -> str:
+    """
+    Identifies the machine (and ffmpeg build) encoder settings were tuned on.
+    """
+    try:
+        ffmpeg_version = subprocess.run(
+            [FFMPEG_BINARY, "-version"], capture_output=True, text=True
+        ).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg_version = None
+    return hash_value(
+        {
+            "node": platform.node(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": ffmpeg_version,
+        }
+    )[:16]
+
+
+def candidate_settings(spec: dict, candidates: dict = None) -> list:
+    """
+    Every combination of the candidate values that the spec leaves open.
+
+    Keys set explicitly in the spec are not varied, and CRF is not varied for
+    specs with a fixed bitrate.
+    """
+    candidates = candidates or DEFAULT_TUNING_CANDIDATES
+    settings = [{}]
+    for key in ("preset", "crf", "threads"):
+        if key in spec or (key == "crf" and spec.get("bitrate")):
+            continue
+        settings = [
+            {**setting, key: value}
+            for setting in settings
+            for value in candidates.get(key, [None])
+        ]
+    return settings
+
+
+def tuned_options(settings: dict) -> dict:
+    """
+    Tuned settings without the values left to the encoder's default.
+    """
+    return {key: value for key, value in settings.items() if value is not None}
+
+
+# ---------------------------------------------------------------- #
+
+
+class EncoderTuner:
+    """
+    Benchmarks encoder settings on a short section of the actual composite
+    and remembers the best ones per host and output profile.
+
+    The section is composited once into a raw frame file; every candidate
+    (preset x CRF x threads) then encodes the same frames, so the benchmark
+    measures the encoder alone. The best candidate is the smallest output
+    that still encodes at min_speed times realtime (and reaches min_ssim, if
+    set). If no candidate is fast enough, the fastest one wins.
+
+    CRF trades quality for size, so it is only tuned against a min_ssim
+    floor. Without one the smallest output would always be the highest CRF,
+    so CRF is left at the encoder's default and only preset and threads are
+    tuned.
+
+    Results are stored in a JSON file keyed by host_key() and the profile
+    (codec, size, crop, bitrate, frame rate and budget), so tuning runs once
+    per machine and profile and render() afterwards only looks it up.
+    """
+
+    def __init__(
+        self,
+        cache_file: str,
+        candidates: dict = None,
+        budget: dict = None,
+        sample_duration: float = 3.0,
+        debug_output=False,
+    ):
+        """
+        :param cache_file: Path of the JSON file with the tuned settings.
+        :param candidates: Values tried per setting, see DEFAULT_TUNING_CANDIDATES.
+            CRF candidates are only tried with a min_ssim budget.
+        :param budget: min_speed (x realtime) and optional min_ssim (0-1).
+        :param sample_duration: Seconds of the composite used for benchmarking.
+        :param debug_output: If True, will print debug information.
+        """
+        self.cache_file = cache_file
+        self.candidates = {**DEFAULT_TUNING_CANDIDATES, **(candidates or {})}
+        self.budget = {**DEFAULT_TUNING_BUDGET, **(budget or {})}
+        if self.budget.get("min_ssim") is None:
+            self.candidates["crf"] = [None]
+        self.sample_duration = sample_duration
+        self.debug_output = debug_output
+
+        self.host = host_key()
+        self._lock = threading.Lock()
+
+    # ---------------------------------------------------- #
+
+    def profile_key(self, spec: dict, source_size: tuple, fps: float) -> str:
+        return hash_value(
+            {
+                "codec": spec.get("codec", DEFAULT_RENDER_OPTIONS["codec"]),
+                "source_size": list(source_size),
+                "size": spec.get("size"),
+                "crop": spec.get("crop"),
+                "bitrate": spec.get("bitrate"),
+                "fixed": {
+                    k: spec[k] for k in ("preset", "crf", "threads") if k in spec
+                },
+                "fps": fps,
+                "budget": self.budget,
+                "candidates": self.candidates,
+            }
+        )[:16]
+
+    def cached(self, spec: dict, source_size: tuple, fps: float) -> dict:
+        """
+        Tuned settings of a profile on this host, or None.
+        """
+        entry = (
+            self._load()
+            .get(self.host, {})
+            .get(self.profile_key(spec, source_size, fps))
+        )
+        return entry["settings"] if entry else None
+
+    def tune(self, clip, specs: list, fps: float) -> list:
+        """
+        Tuned settings for output specs, benchmarked on clip for every profile
+        this host has not tuned yet. The benchmark section is composited once
+        and shared by all specs.
+
+        :param clip: The composite clip.
+        :param specs: Output specs, see BrainrotClipGenerator.render().
+        :param fps: Frame rate the composite is rendered at.
+        :return: One dictionary with preset, crf and threads per spec.
+        """
+        source_size = tuple(clip.size)
+        with self._lock:
+            tuned = [self.cached(spec, source_size, fps) for spec in specs]
+            missing = [i for i, settings in enumerate(tuned) if settings is None]
+            if not missing:
+                return tuned
+
+            folder = tempfile.mkdtemp(prefix="encoder_tuning_")
+            try:
+                sample = self._write_sample(clip, fps, folder)
+                data = self._load()
+                for i in missing:
+                    results = self.benchmark(sample, specs[i], folder)
+                    best = self.choose(results, fps)
+                    tuned[i] = best["settings"]
+                    data.setdefault(self.host, {})[
+                        self.profile_key(specs[i], source_size, fps)
+                    ] = {
+                        "name": specs[i].get("name"),
+                        "settings": best["settings"],
+                        "results": results,
+                        "tuned_at": time.time(),
+                    }
+                    if self.debug_output:
+                        print(
+                            f"Tuned encoder for {specs[i].get('name') or 'default'}: "
+                            f"{best['settings']} ({best['fps']:.1f} fps, "
+                            f"{best['size'] / 1024:.0f} KiB)"
+                        )
+                self._save(data)
+            finally:
+                shutil.rmtree(folder, ignore_errors=True)
+        return tuned
+
+    def choose(self, results: list, fps: float) -> dict:
+        min_fps = self.budget["min_speed"] * fps
+        min_ssim = self.budget.get("min_ssim")
+        allowed = [
+            result
+            for result in results
+            if result["fps"] >= min_fps
+            and (min_ssim is None or (result["ssim"] or 0.0) >= min_ssim)
+        ]
+        if not allowed:
+            return max(results, key=lambda result: result["fps"])
+        return min(allowed, key=lambda result: (result["size"], -result["fps"]))
+
+    # ---------------------------------------------------- #
+    # benchmark
+
+    def _write_sample(self, clip, fps: float, folder: str) -> dict:
+        """
+        Composite the middle section of the clip into a raw RGB file.
+        """
+        width, height = clip.size
+        duration = min(self.sample_duration, clip.duration)
+        start = max(0.0, (clip.duration - duration) / 2)
+        frame_count = max(1, int(duration * fps))
+
+        raw_file = os.path.join(folder, "sample.rgb")
+        with open(raw_file, "wb") as f:
+            for i in range(frame_count):
+                frame = clip.get_frame(start + i / fps)
+                f.write(np.ascontiguousarray(frame[:, :, :3], np.uint8).tobytes())
+        return {
+            "size": (width, height),
+            "frame_count": frame_count,
+            "input": [
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgb24",
+                "-s",
+                f"{width}x{height}",
+                "-r",
+                str(fps),
+                "-i",
+                raw_file,
+            ],
+        }
+
+    def benchmark(self, sample: dict, spec: dict, folder: str) -> list:
+        """
+        Encode the sample with every candidate setting of a spec.
+
+        :return: One result per candidate with settings, fps, size and ssim.
+        """
+        video_filter = build_video_filter(sample["size"], spec)
+        results = []
+        for i, settings in enumerate(candidate_settings(spec, self.candidates)):
+            output_file = os.path.join(folder, f"candidate_{i}.mp4")
+            candidate = {**spec, **tuned_options(settings)}
+            command = (
+                [FFMPEG_BINARY, "-y", "-loglevel", "error"]
+                + sample["input"]
+                + ["-vf", video_filter]
+                + build_encoder_args(candidate)
+                + ["-an", output_file]
+            )
+            encode_start = time.perf_counter()
+            subprocess.run(command, capture_output=True, check=True)
+            elapsed = time.perf_counter() - encode_start
+
+            ssim = None
+            if self.budget.get("min_ssim") is not None:
+                ssim = self._measure_ssim(output_file, sample["input"], video_filter)
+
+            result = {
+                "settings": settings,
+                "fps": sample["frame_count"] / elapsed,
+                "size": os.path.getsize(output_file),
+                "ssim": ssim,
+            }
+            results.append(result)
+            if self.debug_output:
+                print(
+                    f"  {settings}: {result['fps']:.1f} fps, "
+                    f"{result['size'] / 1024:.0f} KiB"
+                    + (f", SSIM {ssim:.4f}" if ssim is not None else "")
+                )
+        return results
+
+    def _measure_ssim(
+        self, encoded_file: str, raw_input: list, video_filter: str
+    ) -> float:
+        output = subprocess.run(
+            [FFMPEG_BINARY, "-loglevel", "info", "-i", encoded_file]
+            + raw_input
+            + [
+                "-lavfi",
+                f"[1:v]{video_filter}[reference];[0:v][reference]ssim",
+                "-f",
+                "null",
+                "-",
+            ],
+            capture_output=True,
+            text=True,
+        ).stderr
+        match = re.search(r"All:([0-9.]+)", output)
+        return float(match.group(1)) if match else None
+
+    # ---------------------------------------------------- #
+    # persistence
+
+    def _load(self) -> dict:
+        if not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != TUNING_VERSION:
+            return {}
+        return data.get("hosts", {})
+
+    def _save(self, hosts: dict):
+        folder = os.path.dirname(self.cache_file)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        temp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump({"version": TUNING_VERSION, "hosts": hosts}, f, indent=2)
+        os.replace(temp_file, self.cache_file)
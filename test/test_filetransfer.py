@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from source import filetransfer
+from source.filetransfer import GeminiFileTransfer, UPLOAD_GRANULARITY
+
+# ---------------------------------------------------------------- #
+
+FILE_SIZE = 2 * UPLOAD_GRANULARITY + 1000  # three chunks
+
+
+class StubFilesApi(ThreadingHTTPServer):
+    """
+    Resumable upload protocol of the Gemini Files API, keeping the uploads in
+    memory. failures holds the status codes answered to the next chunk
+    requests (None lets a request through), the chunk is dropped on failure.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubFilesHandler)
+        self.sessions = {}
+        self.files = {}
+        self.failures = []
+        self.requests = {"start": 0, "upload": 0, "query": 0}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubFilesHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        path = urllib.parse.urlparse(self.path).path
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        command = self.headers.get("X-Goog-Upload-Command")
+
+        with server.lock:
+            if path == "/upload/v1beta/files" and command == "start":
+                server.requests["start"] += 1
+                session_id = str(len(server.sessions))
+                server.sessions[session_id] = bytearray()
+                self._reply(
+                    200,
+                    headers={
+                        "X-Goog-Upload-URL": f"{server.url}/upload/session/{session_id}"
+                    },
+                )
+                return
+
+            session_id = path.rsplit("/", 1)[-1]
+            received = server.sessions.get(session_id)
+            if received is None:
+                self._reply(404)
+                return
+            if command == "query":
+                server.requests["query"] += 1
+                self._reply(
+                    200,
+                    headers={
+                        "X-Goog-Upload-Status": "active",
+                        "X-Goog-Upload-Size-Received": str(len(received)),
+                    },
+                )
+                return
+
+            server.requests["upload"] += 1
+            failure = server.failures.pop(0) if server.failures else None
+            if failure is not None:
+                self._reply(failure)
+                return
+            if int(self.headers["X-Goog-Upload-Offset"]) != len(received):
+                self._reply(400)
+                return
+            received.extend(body)
+            if command != "upload, finalize":
+                self._reply(200)
+                return
+
+            name = f"files/{session_id}"
+            server.files[name] = bytes(received)
+            self._reply(
+                200,
+                {
+                    "file": {
+                        "name": name,
+                        "uri": f"{server.url}/v1beta/{name}",
+                        "mimeType": "video/mp4",
+                        "state": "ACTIVE",
+                    }
+                },
+            )
+
+    def _reply(self, status: int, payload: dict = None, headers: dict = None):
+        data = json.dumps(payload).encode("utf-8") if payload else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def api():
+    server = StubFilesApi()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def video_file(tmp_path):
+    path = tmp_path / "video.mp4"
+    path.write_bytes(os.urandom(FILE_SIZE))
+    return path
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(filetransfer.time, "sleep", lambda seconds: None)
+
+
+def make_transfer(api, tmp_path, **kwargs) -> GeminiFileTransfer:
+    return GeminiFileTransfer(
+        str(tmp_path / "uploads.json"),
+        api_key="test",
+        base_url=api.url,
+        chunk_size=UPLOAD_GRANULARITY,
+        **kwargs,
+    )
+
+
+def test_upload_sends_chunks_and_reuses_same_content(api, tmp_path, video_file):
+    transfer = make_transfer(api, tmp_path)
+    remote = transfer.upload(str(video_file))
+
+    assert api.files[remote["name"]] == video_file.read_bytes()
+    assert remote["size"] == FILE_SIZE
+    assert api.requests["upload"] == 3
+
+    # same bytes under another path, also from a new instance reading the index
+    copy = tmp_path / "copy.mp4"
+    copy.write_bytes(video_file.read_bytes())
+    assert make_transfer(api, tmp_path).upload(str(copy)) == remote
+    assert api.requests["start"] == 1
+
+
+def test_upload_resumes_after_server_error(api, tmp_path, video_file):
+    # the second chunk fails once, the retry continues at the confirmed offset
+    api.failures = [None, 503]
+    remote = make_transfer(api, tmp_path).upload(str(video_file))
+
+    assert api.files[remote["name"]] == video_file.read_bytes()
+    assert api.requests["start"] == 1
+    assert api.requests["query"] == 1
+    assert api.requests["upload"] == 4
+
+
+def test_upload_does_not_retry_client_errors(api, tmp_path, video_file):
+    api.failures = [403] * 10
+    with pytest.raises(RuntimeError, match="403"):
+        make_transfer(api, tmp_path).upload(str(video_file))
+    assert api.requests["upload"] == 1
+
+
+def test_upload_fails_after_max_retries(api, tmp_path, video_file):
+    api.failures = [500] * 10
+    with pytest.raises(RuntimeError, match="after 3 attempts"):
+        make_transfer(api, tmp_path, max_retries=2).upload(str(video_file))
+    assert api.requests["upload"] == 3
+    assert not api.files
@@ -0,0 +1,117 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+# ---------------------------------------------------------------- #
+
+TEST_FOLDER = os.path.dirname(os.path.abspath(__file__))
+REPO_FOLDER = os.path.dirname(TEST_FOLDER)
+
+# peak RSS a low memory composite may reach, whatever the story length
+MAX_PEAK_RSS = 400 * 1024 * 1024  # bytes
+# how much more a 60 minute story may use than a 1 minute one
+MAX_PEAK_RSS_GROWTH = 64 * 1024 * 1024  # bytes
+
+# composites one frame per segment of a synthetic story, concatenates its
+# narration and encodes the last seconds of the story through the variant
+# writer, then prints the peak RSS of the process in bytes
+MEASURE_SCRIPT = """
+import os
+import sys
+import resource
+
+import numpy as np
+import soundfile as sf
+import moviepy
+
+sys.path.insert(0, {test_folder!r})
+from source.timeline import Timeline
+from source.generator import BrainrotClipGenerator
+from source.streaming import StreamingCompositeClip
+from source.encoder import write_video_variants
+from source.globals import TARGET_VIDEO_WIDTH, TARGET_VIDEO_HEIGHT
+
+minutes, work_folder = float(sys.argv[1]), sys.argv[2]
+sample_rate, segment_duration = BrainrotClipGenerator.OUTPUT_SAMPLE_RATE, 3.0
+
+# every segment uses the same file, only the timeline grows with the story
+segment_file = os.path.join(work_folder, "segment.wav")
+samples = np.sin(np.arange(int(sample_rate * segment_duration)) / 7.0) * 0.3
+sf.write(segment_file, samples.astype(np.float32), sample_rate)
+
+timeline = Timeline(sample_rate, gap=0.1)
+for i in range(int(minutes * 60 / segment_duration)):
+    timeline.append(f"segment number {{i}} with a few words", segment_file, len(samples))
+
+# the model is never called, the timeline is restored instead of synthesized
+generator = BrainrotClipGenerator(
+    video_text="", video_file="", kokoro_model=object(), low_memory=True
+)
+timeline = generator.load_timeline(timeline.to_dict())
+generator.concat_audio_segment_files(os.path.join(work_folder, "audio.wav"))
+
+background = moviepy.ColorClip(
+    (TARGET_VIDEO_WIDTH, TARGET_VIDEO_HEIGHT),
+    (30, 60, 90),
+    duration=timeline.total_duration,
+).with_fps(30)
+clip = StreamingCompositeClip(background, timeline)
+for t in timeline.starts + segment_duration / 2:
+    clip.get_frame(t)
+
+section = clip.subclipped(timeline.total_duration - 2, timeline.total_duration)
+write_video_variants(
+    section,
+    [{{"file": os.path.join(work_folder, "video.mp4"), "preset": "ultrafast"}}],
+    30,
+)
+
+peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# kilobytes on Linux, bytes on macOS
+print(peak_rss * 1024 if sys.platform.startswith("linux") else peak_rss)
+"""
+
+
+def measure_peak_rss(minutes: float, work_folder: str) -> int:
+    """
+    Peak RSS in bytes of compositing a story of the given length, measured in
+    a fresh process so earlier allocations do not count.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            MEASURE_SCRIPT.format(test_folder=TEST_FOLDER),
+            str(minutes),
+            work_folder,
+        ],
+        cwd=REPO_FOLDER,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    return int(result.stdout.split()[-1])
+
+
+@pytest.mark.skipif(
+    sys.platform == "win32", reason="resource.getrusage is not available"
+)
+def test_low_memory_peak_rss_does_not_grow_with_story_length(tmp_path):
+    short_folder = tmp_path / "short"
+    long_folder = tmp_path / "long"
+    short_folder.mkdir()
+    long_folder.mkdir()
+
+    short_peak = measure_peak_rss(1, str(short_folder))
+    long_peak = measure_peak_rss(60, str(long_folder))
+
+    assert long_peak <= MAX_PEAK_RSS, (
+        f"60 minute story peaked at {long_peak / 2**20:.0f} MiB, "
+        f"more than {MAX_PEAK_RSS / 2**20:.0f} MiB"
+    )
+    assert long_peak - short_peak <= MAX_PEAK_RSS_GROWTH, (
+        f"60 minute story peaked at {long_peak / 2**20:.0f} MiB, "
+        f"1 minute story at {short_peak / 2**20:.0f} MiB"
+    )
@@ -0,0 +1,131 @@
+import os
+import sys
+import hashlib
+import threading
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from source.media import MediaStore
+
+# ---------------------------------------------------------------- #
+
+CHUNK_SIZE = 64 * 1024
+CONTENT = os.urandom(5 * CHUNK_SIZE - 1000)  # five chunks
+
+
+class StubMediaServer(ThreadingHTTPServer):
+    """
+    Serves CONTENT at any path. drop_once holds range starts whose first
+    request is cut off halfway through the body, with ranges False every
+    GET returns the whole file although HEAD advertises ranges.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubMediaHandler)
+        self.ranges = True
+        self.drop_once = set()
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class StubMediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._send_headers(200, len(CONTENT))
+
+    def do_GET(self):
+        server = self.server
+        requested = self.headers.get("Range")
+        with server.lock:
+            server.requests.append(requested)
+            drop = False
+            if requested and server.ranges:
+                start, end = map(int, requested.split("=")[1].split("-"))
+                drop = start in server.drop_once
+                server.drop_once.discard(start)
+
+        if not requested or not server.ranges:
+            self._send_headers(200, len(CONTENT))
+            self.wfile.write(CONTENT)
+            return
+
+        body = CONTENT[start : end + 1]
+        self._send_headers(206, len(body))
+        if drop:
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def _send_headers(self, status: int, length: int):
+        self.send_response(status)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", '"stub"')
+        self.end_headers()
+
+
+@pytest.fixture
+def server():
+    server = StubMediaServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_store(tmp_path) -> MediaStore:
+    return MediaStore(str(tmp_path / "media"), max_workers=2, chunk_size=CHUNK_SIZE)
+
+
+def read_stored(stored_file: str) -> bytes:
+    with open(stored_file, "rb") as f:
+        return f.read()
+
+
+def test_download_resumes_missing_chunks(server, tmp_path):
+    server.drop_once = {2 * CHUNK_SIZE}
+    url = server.url("/video.mp4")
+
+    with pytest.raises(urllib.error.ContentTooShortError):
+        make_store(tmp_path).download(url)
+    assert len(server.requests) == 5
+
+    # a new store continues from the state file, only the cut chunk is fetched
+    server.requests.clear()
+    stored_file = make_store(tmp_path).download(url)
+    assert server.requests == [f"bytes={2 * CHUNK_SIZE}-{3 * CHUNK_SIZE - 1}"]
+    assert read_stored(stored_file) == CONTENT
+    assert os.path.basename(stored_file) == (
+        hashlib.sha256(CONTENT).hexdigest() + ".mp4"
+    )
+    assert os.listdir(tmp_path / "media" / "downloads") == []
+
+    # stored already, no request at all
+    server.requests.clear()
+    assert make_store(tmp_path).download(url) == stored_file
+    assert server.requests == []
+
+
+def test_download_streams_when_ranges_are_ignored(server, tmp_path):
+    server.ranges = False
+    stored_file = make_store(tmp_path).download(server.url("/video.mp4"))
+
+    assert read_stored(stored_file) == CONTENT
+    # one streamed request after the ignored range requests
+    assert server.requests[-1] is None
+    assert os.listdir(tmp_path / "media" / "downloads") == []